@@ -1,8 +1,8 @@
 from django.conf import settings
 from django.utils import timezone
 
-from temba.utils import chunk_list
 from temba.utils.celery import nonoverlapping_task
+from temba.utils.trim import trim
 
 from .models import WebHookEvent
 
@@ -15,6 +15,4 @@ def trim_webhook_event_task():
 
     if settings.RETENTION_PERIODS["webhookevent"]:
         trim_before = timezone.now() - settings.RETENTION_PERIODS["webhookevent"]
-        event_ids = WebHookEvent.objects.filter(created_on__lte=trim_before).values_list("id", flat=True)
-        for batch in chunk_list(event_ids, 1000):
-            WebHookEvent.objects.filter(id__in=batch).delete()
+        trim("webhookevent", WebHookEvent.objects.filter(created_on__lte=trim_before))
@@ -892,7 +892,8 @@ class FlowReadSerializer(ReadSerializer):
         return [{"uuid": lb.uuid, "name": lb.name} for lb in obj.labels.all()]
 
     def get_runs(self, obj):
-        stats = obj.get_run_stats()
+        # run stats may be cached on the object
+        stats = obj.run_stats if hasattr(obj, "run_stats") else obj.get_run_stats()
         return {
             "active": stats["active"],
             "completed": stats["completed"],
@@ -2652,7 +2652,7 @@ class APITest(TembaTest):
         self.create_flow("Other", org=self.org2)
 
         # no filtering
-        with self.assertNumQueries(NUM_BASE_REQUEST_QUERIES + 5):
+        with self.assertNumQueries(NUM_BASE_REQUEST_QUERIES + 3):
             response = self.fetchJSON(url, readonly_models={Flow})
 
         resp_json = response.json()
@@ -1922,6 +1922,11 @@ class FlowsEndpoint(ListAPIMixin, BaseAPIView):
 
         return self.filter_before_after(queryset, "modified_on")
 
+    def prepare_for_serialization(self, object_list, using: str):
+        run_stats = Flow.get_run_stats_by_flow(object_list)
+        for flow in object_list:
+            flow.run_stats = run_stats[flow]
+
     @classmethod
     def get_read_explorer(cls):
         return {
@@ -1,8 +1,11 @@
 import base64
 import gzip
 import hashlib
+import os
 import re
 import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from gettext import gettext as _
 from urllib.parse import urlparse
@@ -156,10 +159,19 @@ class Archive(models.Model):
 
     @classmethod
     def iter_all_records(
-        cls, org, archive_type: str, after: datetime = None, before: datetime = None, where: dict = None
+        cls,
+        org,
+        archive_type: str,
+        after: datetime = None,
+        before: datetime = None,
+        where: dict = None,
+        prefetch: int = 0,
+        prefetch_max_size: int = None,
     ):
         """
-        Creates a record iterator across archives of the given type for records which match the given criteria
+        Creates a record iterator across archives of the given type for records which match the given criteria. If
+        prefetch is given, up to that many archives are fetched concurrently ahead of the one being iterated over and
+        spooled to disk, as long as their total compressed size doesn't exceed prefetch_max_size.
         """
 
         if not where:
@@ -171,6 +183,9 @@ class Archive(models.Model):
 
         archives = cls._get_covering_period(org, archive_type, after, before)
 
+        if prefetch:
+            return cls._iter_prefetched(archives, where, prefetch, prefetch_max_size)
+
         def generator():
             for archive in archives:
                 for record in archive.iter_records(where=where):
@@ -178,11 +193,87 @@ class Archive(models.Model):
 
         return generator()
 
+    @classmethod
+    def _iter_prefetched(cls, archives, where: dict, prefetch: int, max_size: int = None):
+        """
+        Iterates over the records of the given archives in order, fetching and decompressing upcoming archives in a
+        bounded thread pool. Prefetched records are spooled to temporary files rather than being held in memory.
+        """
+
+        def fetch(archive):
+            spool = tempfile.TemporaryFile()
+            try:
+                for record in archive.iter_records(where=where):
+                    spool.write((json.dumps(record) + "\n").encode("utf-8"))
+                spool.seek(0)
+            except Exception:
+                spool.close()
+                raise
+            return spool
+
+        def read(spool):
+            with spool:
+                for line in spool:
+                    yield json.loads(line.decode("utf-8"))
+
+        def discard(future):
+            if not future.cancelled() and not future.exception():
+                future.result().close()
+
+        def generator():
+            executor = ThreadPoolExecutor(max_workers=prefetch)
+            remaining = iter(archives)
+            upcoming = next(remaining, None)
+            queue = deque()
+            spooled_size = 0  # size of archives that are queued or being iterated over
+
+            def top_up():
+                nonlocal upcoming, spooled_size
+
+                # always allow at least one archive to be fetched regardless of the size cap
+                while upcoming and len(queue) < prefetch:
+                    if spooled_size and max_size and spooled_size + upcoming.size > max_size:
+                        break
+
+                    queue.append((upcoming, executor.submit(fetch, upcoming)))
+                    spooled_size += upcoming.size
+                    upcoming = next(remaining, None)
+
+            try:
+                top_up()
+
+                while queue:
+                    archive, future = queue.popleft()
+                    top_up()
+
+                    yield from read(future.result())
+
+                    spooled_size -= archive.size
+                    top_up()
+            finally:
+                # clean up the spools of any archives we didn't get to, including those still being fetched
+                for archive, future in queue:
+                    future.add_done_callback(discard)
+
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        return generator()
+
     def iter_records(self, *, where: dict = None):
         """
-        Creates an iterator for the records in this archive, streaming and decompressing on the fly
+        Creates an iterator for the records in this archive, streaming and decompressing on the fly. If a local archive
+        cache is configured, the archive file is read from there and any filtering is done locally.
         """
 
+        cache = ArchiveFileCache.get_default()
+        if cache:
+            try:
+                matcher = s3.compile_matcher(where) if where else None
+            except ValueError:  # raw conditions have to be evaluated by S3 select
+                pass
+            else:
+                return self._iter_cached_records(cache, matcher)
+
         s3_client = s3.client()
 
         if where:
@@ -207,6 +298,21 @@ class Archive(models.Model):
             s3_obj = s3_client.get_object(Bucket=bucket, Key=key)
             return jsonlgz_iterate(s3_obj["Body"])
 
+    def _iter_cached_records(self, cache, matcher):
+        cached = cache.get(self.hash)
+        if not cached:
+            bucket, key = self.get_storage_location()
+            s3_obj = s3.client().get_object(Bucket=bucket, Key=key)
+            cached = cache.put(self.hash, s3_obj["Body"])
+
+        def generator():
+            with cached:
+                for record in jsonlgz_iterate(cached):
+                    if not matcher or matcher(record):
+                        yield record
+
+        return generator()
+
     def rewrite(self, transform, delete_old=False):
         s3_client = s3.client()
         bucket, key = self.get_storage_location()
@@ -312,3 +418,81 @@ class FileAndHash:
 
     def close(self):  # pragma: no cover
         self.f.close()
+
+
+class ArchiveFileCache:
+    """
+    Local on-disk LRU cache of archive files keyed by their MD5 hashes. Archive files are immutable so cached files never
+    have to be invalidated, only evicted when the cache exceeds its maximum size.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+
+    @classmethod
+    def get_default(cls):
+        if settings.ARCHIVE_CACHE_DIR:
+            return cls(settings.ARCHIVE_CACHE_DIR, settings.ARCHIVE_CACHE_MAX_SIZE)
+        return None
+
+    def get(self, hash: str):
+        """
+        Gets an open file for the cached archive with the given hash, or None if it isn't cached
+        """
+        try:
+            f = open(self._get_path(hash), "rb")
+        except FileNotFoundError:
+            return None
+
+        os.utime(f.fileno())  # record as recently used
+        return f
+
+    def put(self, hash: str, stream):
+        """
+        Writes the given archive stream to the cache and returns an open file for it. If the written contents don't match
+        the given hash, the file is discarded but can still be read.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        f = tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False)
+        out = FileAndHash(f)
+        for chunk in iter(lambda: stream.read(self.CHUNK_SIZE), b""):
+            out.write(chunk)
+        f.flush()
+
+        # other processes may be reading from the cache so only move completed files into place
+        if out.hash.hexdigest() == hash:
+            os.replace(f.name, self._get_path(hash))
+            self.evict()
+        else:
+            os.remove(f.name)
+
+        f.seek(0)
+        return f
+
+    def evict(self):
+        """
+        Removes least recently used files until the cache is within its maximum size
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".jsonl.gz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(e[1] for e in entries)
+
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # pragma: no cover
+                pass
+            total_size -= size
+
+    def _get_path(self, hash: str) -> str:
+        return os.path.join(self.directory, f"{hash}.jsonl.gz")
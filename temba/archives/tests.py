@@ -2,18 +2,21 @@ import base64
 import gzip
 import hashlib
 import io
+import os
+import tempfile
 from datetime import date, datetime
 from unittest.mock import call, patch
 
 import pytz
 
+from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
 
 from temba.tests import CRUDLTestMixin, TembaTest
 from temba.tests.s3 import MockS3Client
 
-from .models import Archive, jsonlgz_rewrite
+from .models import Archive, ArchiveFileCache, jsonlgz_rewrite
 
 
 class ArchiveTest(TembaTest):
@@ -157,6 +160,68 @@ class ArchiveTest(TembaTest):
             [4, 5],
         )
 
+        # records from prefetched archives are still returned in order
+        assert_records(Archive.iter_all_records(self.org, Archive.TYPE_MSG, prefetch=2), [1, 2, 3, 4, 5, 6])
+        assert_records(
+            Archive.iter_all_records(self.org, Archive.TYPE_MSG, prefetch=5, prefetch_max_size=1), [1, 2, 3, 4, 5, 6]
+        )
+        assert_records(
+            Archive.iter_all_records(
+                self.org,
+                Archive.TYPE_MSG,
+                after=datetime(2020, 7, 30, 12, 0, 0, 0, pytz.UTC),
+                where={"contact__name": "Bob"},
+                prefetch=3,
+            ),
+            [4, 5, 6],
+        )
+
+        # and iteration can be stopped early
+        records = Archive.iter_all_records(self.org, Archive.TYPE_MSG, prefetch=2)
+        self.assertEqual(1, next(records)["id"])
+        records.close()
+
+    @patch("temba.utils.s3.client")
+    def test_iter_records_cached(self, mock_s3_client):
+        mock_s3 = MockS3Client()
+        mock_s3_client.return_value = mock_s3
+
+        archive1 = self.create_archive(
+            Archive.TYPE_MSG, "D", date(2020, 8, 1), [{"id": 1}, {"id": 2}, {"id": 3}], s3=mock_s3
+        )
+        archive2 = self.create_archive(Archive.TYPE_MSG, "D", date(2020, 8, 2), [{"id": 4}, {"id": 5}], s3=mock_s3)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with override_settings(ARCHIVE_CACHE_DIR=cache_dir, ARCHIVE_CACHE_MAX_SIZE=1024 * 1024):
+                # first read fetches from S3 and populates the cache
+                self.assertEqual([1, 2, 3], [r["id"] for r in archive1.iter_records()])
+                self.assertEqual(1, len(mock_s3.calls["get_object"]))
+                self.assertTrue(os.path.exists(os.path.join(cache_dir, f"{archive1.hash}.jsonl.gz")))
+
+                # subsequent reads, even with filtering, don't touch S3
+                self.assertEqual([1, 2, 3], [r["id"] for r in archive1.iter_records()])
+                self.assertEqual([2, 3], [r["id"] for r in archive1.iter_records(where={"id__gt": 1})])
+                self.assertEqual(1, len(mock_s3.calls["get_object"]))
+                self.assertEqual(0, len(mock_s3.calls["select_object_content"]))
+
+                # raw conditions still have to use S3 select
+                self.assertEqual([1, 2], [r["id"] for r in archive1.iter_records(where={"__raw__": "s.id < 3"})])
+                self.assertEqual(1, len(mock_s3.calls["select_object_content"]))
+
+            # if the cache is too small, least recently used files are evicted
+            with override_settings(ARCHIVE_CACHE_DIR=cache_dir, ARCHIVE_CACHE_MAX_SIZE=archive2.size):
+                self.assertEqual([4, 5], [r["id"] for r in archive2.iter_records()])
+                self.assertEqual(2, len(mock_s3.calls["get_object"]))
+                self.assertEqual([f"{archive2.hash}.jsonl.gz"], os.listdir(cache_dir))
+
+            # files which don't match their archive's hash aren't cached
+            cache = ArchiveFileCache(cache_dir, 1024 * 1024)
+            with cache.put("abcdef", io.BytesIO(b"12345")) as f:
+                self.assertEqual(b"12345", f.read())
+
+            self.assertIsNone(cache.get("abcdef"))
+            self.assertEqual([f"{archive2.hash}.jsonl.gz"], os.listdir(cache_dir))
+
     def test_end_date(self):
         daily = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2018, 2, 1), [], needs_deletion=True)
         monthly = self.create_archive(Archive.TYPE_FLOWRUN, "M", date(2018, 1, 1), [])
@@ -76,8 +76,8 @@ class BaseAssetStore:
         if not default_storage.exists(path):  # pragma: needs cover
             raise AssetFileNotFound()
 
-        # create a more friendly download filename
-        remainder, extension = path.rsplit(".", 1)
+        # create a more friendly download filename, keeping compound extensions like csv.gz
+        remainder, extension = os.path.basename(path).split(".", 1)
         filename = f"{self.key}_{pk}_{slugify(asset.org.name)}.{extension}"
 
         # if our storage backend is S3
@@ -105,6 +105,25 @@ class BaseAssetStore:
 
         default_storage.save(path, _file)
 
+    def open(self, pk, extension):
+        """
+        Opens a file asset for writing, so that it can be written straight to storage
+        """
+        if extension not in self.extensions:  # pragma: needs cover
+            raise ValueError("Extension %s not supported by handler" % extension)
+
+        asset = self.derive_asset(pk)
+
+        path = self.derive_path(asset.org, asset.uuid, extension)
+
+        # local storage won't create the directory for us
+        try:
+            os.makedirs(os.path.dirname(default_storage.path(path)), exist_ok=True)
+        except NotImplementedError:  # pragma: no cover
+            pass
+
+        return default_storage.open(path, "wb")
+
     def derive_asset(self, pk):
         """
         Derives the export given a PK
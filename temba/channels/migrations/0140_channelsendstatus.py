@@ -0,0 +1,170 @@
+# Generated by Django 4.0.4 on 2022-06-28 15:11
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+
+SQL = """
+----------------------------------------------------------------------
+-- Moves a channel's last sent time forward. To avoid contention on busy channels, it's only written when it has moved
+-- forward by more than a few minutes, which is plenty accurate for alerting.
+----------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION temba_update_channel_last_sent(_channel_id INTEGER, _sent_on TIMESTAMP WITH TIME ZONE) RETURNS VOID AS $$
+BEGIN
+  UPDATE channels_channelsendstatus SET last_sent_on = _sent_on
+  WHERE channel_id = _channel_id AND (last_sent_on IS NULL OR last_sent_on < _sent_on - INTERVAL '5 minutes');
+
+  IF NOT FOUND THEN
+    INSERT INTO channels_channelsendstatus(channel_id, last_sent_on) VALUES(_channel_id, _sent_on)
+    ON CONFLICT (channel_id) DO NOTHING;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+----------------------------------------------------------------------
+-- Trigger procedure to update user and system labels on column changes
+----------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION temba_msg_on_change() RETURNS TRIGGER AS $$
+DECLARE
+  _new_label_type CHAR(1);
+  _old_label_type CHAR(1);
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    -- prevent illegal message states
+    IF NEW.direction = 'I' AND NEW.status NOT IN ('P', 'H') THEN
+      RAISE EXCEPTION 'Incoming messages can only be PENDING or HANDLED';
+    END IF;
+    IF NEW.direction = 'O' AND NEW.visibility = 'A' THEN
+      RAISE EXCEPTION 'Outgoing messages cannot be archived';
+    END IF;
+  END IF;
+
+  -- new message inserted
+  IF TG_OP = 'INSERT' THEN
+    _new_label_type := temba_msg_determine_system_label(NEW);
+    IF _new_label_type IS NOT NULL THEN
+      PERFORM temba_insert_system_label(NEW.org_id, _new_label_type, 1);
+    END IF;
+
+    IF NEW.broadcast_id IS NOT NULL THEN
+      PERFORM temba_insert_broadcastmsgcount(NEW.broadcast_id, 1);
+    END IF;
+
+    -- update the contact's reference to their last message
+    UPDATE contacts_contact SET last_msg_id = NEW.id
+    WHERE id = NEW.contact_id AND (last_msg_id IS NULL OR last_msg_id < NEW.id);
+
+    -- message was created as already sent so update its channel's last sent time
+    IF NEW.direction = 'O' AND NEW.channel_id IS NOT NULL AND NEW.sent_on IS NOT NULL THEN
+      PERFORM temba_update_channel_last_sent(NEW.channel_id, NEW.sent_on);
+    END IF;
+
+  -- existing message updated
+  ELSIF TG_OP = 'UPDATE' THEN
+    _old_label_type := temba_msg_determine_system_label(OLD);
+    _new_label_type := temba_msg_determine_system_label(NEW);
+
+    IF _old_label_type IS DISTINCT FROM _new_label_type THEN
+      IF _old_label_type IS NOT NULL THEN
+        PERFORM temba_insert_system_label(OLD.org_id, _old_label_type, -1);
+      END IF;
+      IF _new_label_type IS NOT NULL THEN
+        PERFORM temba_insert_system_label(NEW.org_id, _new_label_type, 1);
+      END IF;
+    END IF;
+
+    -- is being archived or deleted (i.e. no longer included for user labels)
+    IF OLD.visibility = 'V' AND NEW.visibility != 'V' THEN
+      PERFORM temba_insert_message_label_counts(NEW.id, FALSE, -1);
+    END IF;
+
+    -- is being restored (i.e. now included for user labels)
+    IF OLD.visibility != 'V' AND NEW.visibility = 'V' THEN
+      PERFORM temba_insert_message_label_counts(NEW.id, FALSE, 1);
+    END IF;
+
+    -- update our broadcast msg count if it changed
+    IF NEW.broadcast_id IS DISTINCT FROM OLD.broadcast_id THEN
+      PERFORM temba_insert_broadcastmsgcount(OLD.broadcast_id, -1);
+      PERFORM temba_insert_broadcastmsgcount(NEW.broadcast_id, 1);
+    END IF;
+
+    -- message has been sent so update its channel's last sent time
+    IF NEW.direction = 'O' AND NEW.channel_id IS NOT NULL AND NEW.sent_on IS DISTINCT FROM OLD.sent_on AND NEW.sent_on IS NOT NULL THEN
+      PERFORM temba_update_channel_last_sent(NEW.channel_id, NEW.sent_on);
+    END IF;
+
+  -- existing message deleted
+  ELSIF TG_OP = 'DELETE' THEN
+    _old_label_type := temba_msg_determine_system_label(OLD);
+
+    IF _old_label_type IS NOT NULL THEN
+      PERFORM temba_insert_system_label(OLD.org_id, _old_label_type, -1);
+    END IF;
+
+    -- if this was the contact's last message, fall back to their previous message
+    UPDATE contacts_contact SET last_msg_id = (
+      SELECT id FROM msgs_msg WHERE contact_id = OLD.contact_id AND id < OLD.id ORDER BY id DESC LIMIT 1
+    )
+    WHERE id = OLD.contact_id AND last_msg_id = OLD.id;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def populate_send_status(apps, schema_editor):  # pragma: no cover
+    Msg = apps.get_model("msgs", "Msg")
+    ChannelSendStatus = apps.get_model("channels", "ChannelSendStatus")
+
+    # only messages sent in the last day matter for alerting
+    last_sent = (
+        Msg.objects.filter(direction="O", sent_on__gt=timezone.now() - timedelta(days=1))
+        .exclude(channel=None)
+        .values_list("channel_id")
+        .annotate(last_sent_on=Max("sent_on"))
+        .order_by()
+    )
+
+    ChannelSendStatus.objects.bulk_create(
+        [ChannelSendStatus(channel_id=c, last_sent_on=s) for c, s in last_sent], ignore_conflicts=True
+    )
+
+
+def reverse(apps, schema_editor):  # pragma: no cover
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("channels", "013902_pm_services"),
+        ("contacts", "0169_contact_last_msg"),
+        ("msgs", "0177_msg_msgs_outgoing_queued_channel"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChannelSendStatus",
+            fields=[
+                (
+                    "channel",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        primary_key=True,
+                        related_name="send_status",
+                        serialize=False,
+                        to="channels.channel",
+                    ),
+                ),
+                ("last_sent_on", models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.RunSQL(SQL),
+        migrations.RunPython(populate_send_status, reverse),
+    ]
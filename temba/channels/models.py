@@ -18,7 +18,7 @@ from django.contrib.auth.models import Group, User
 from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
-from django.db.models import Max, Q, Sum
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Sum
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.template import Context, Engine, TemplateDoesNotExist
@@ -1111,6 +1111,16 @@ class ChannelCount(SquashableModel):
         index_together = ["channel", "count_type", "day"]
 
 
+class ChannelSendStatus(models.Model):
+    """
+    Summary of a channel's sending, used for alerting on channels which have stopped sending. This model is maintained by
+    Postgres triggers.
+    """
+
+    channel = models.OneToOneField(Channel, on_delete=models.PROTECT, primary_key=True, related_name="send_status")
+    last_sent_on = models.DateTimeField(null=True)
+
+
 class ChannelEvent(models.Model):
     """
     An event other than a message that occurs between a channel and a contact. Can be used to trigger flows etc.
@@ -1474,86 +1484,95 @@ class Alert(SmartModel):
 
     @classmethod
     def check_alerts(cls):
+        """
+        Checks for channels which need new alerts, and for open alerts which can be resolved. This is done with a fixed
+        number of set based queries regardless of how many channels there are.
+        """
         from temba.channels.types.android import AndroidType
         from temba.msgs.models import Msg
 
-        thirty_minutes_ago = timezone.now() - timedelta(minutes=30)
-
-        # end any alerts that no longer seem valid
-        for alert in Alert.objects.filter(alert_type=cls.TYPE_DISCONNECTED, ended_on=None):
-            # if we've seen the channel since this alert went out, then clear the alert
-            if alert.channel.last_seen > alert.created_on:
-                alert.ended_on = alert.channel.last_seen
-                alert.save()
-                alert.send_resolved()
+        now = timezone.now()
+        thirty_minutes_ago = now - timedelta(minutes=30)
+        six_hours_ago = now - timedelta(hours=6)
+        day_ago = now - timedelta(days=1)
+
+        # end any disconnected alerts for channels we've seen since the alert went out
+        cls._end_alerts(
+            cls.objects.filter(
+                alert_type=cls.TYPE_DISCONNECTED, ended_on=None, channel__last_seen__gt=F("created_on")
+            ),
+            ended_on=Subquery(Channel.objects.filter(id=OuterRef("channel_id")).values("last_seen")[:1]),
+            notify=True,
+        )
 
-        for channel in (
+        # create disconnected alerts for android channels we haven't seen in a while, unless they already have one
+        cls._create_alerts(
             Channel.objects.filter(channel_type=AndroidType.code, is_active=True)
             .exclude(org=None)
             .exclude(last_seen__gte=thirty_minutes_ago)
-        ):
-            # have we already sent an alert for this channel
-            if not Alert.objects.filter(channel=channel, alert_type=cls.TYPE_DISCONNECTED, ended_on=None):
-                cls.create_and_send(channel, cls.TYPE_DISCONNECTED)
-
-        day_ago = timezone.now() - timedelta(days=1)
-        six_hours_ago = timezone.now() - timedelta(hours=6)
-
-        # end any sms alerts that are open and no longer seem valid
-        for alert in Alert.objects.filter(alert_type=cls.TYPE_SMS, ended_on=None).distinct("channel_id"):
-            # are there still queued messages?
+            .exclude(
+                Exists(cls.objects.filter(channel=OuterRef("id"), alert_type=cls.TYPE_DISCONNECTED, ended_on=None))
+            ),
+            cls.TYPE_DISCONNECTED,
+        )
 
-            if (
-                not Msg.objects.filter(
-                    status__in=["Q", "P"], channel_id=alert.channel_id, created_on__lte=thirty_minutes_ago
-                )
-                .exclude(created_on__lte=day_ago)
-                .exists()
-            ):
-                Alert.objects.filter(alert_type=cls.TYPE_SMS, ended_on=None, channel_id=alert.channel_id).update(
-                    ended_on=timezone.now()
-                )
+        # outgoing messages which have been queued for more than thirty minutes but less than a day
+        stuck_msgs = Msg.objects.filter(
+            direction=Msg.DIRECTION_OUT,
+            status__in=(Msg.STATUS_QUEUED, Msg.STATUS_PENDING),
+            created_on__gt=day_ago,
+            created_on__lte=thirty_minutes_ago,
+        )
 
-        # now look for channels that have many unsent messages
-        queued_messages = (
-            Msg.objects.filter(status__in=["Q", "P"])
-            .order_by("channel", "created_on")
-            .exclude(created_on__gte=thirty_minutes_ago)
-            .exclude(created_on__lte=day_ago)
-            .exclude(channel=None)
-            .values("channel")
-            .annotate(latest_queued=Max("created_on"))
+        # end any sms alerts for channels which no longer have stuck messages
+        cls._end_alerts(
+            cls.objects.filter(alert_type=cls.TYPE_SMS, ended_on=None).exclude(
+                Exists(stuck_msgs.filter(channel=OuterRef("channel_id")))
+            ),
+            ended_on=now,
+            notify=False,
         )
-        sent_messages = (
-            Msg.objects.filter(status__in=["S", "D"])
-            .exclude(created_on__lte=day_ago)
-            .exclude(channel=None)
-            .order_by("channel", "sent_on")
-            .values("channel")
-            .annotate(latest_sent=Max("sent_on"))
+
+        # create sms alerts for channels with stuck messages that haven't sent anything in the last six hours, unless
+        # they've had an alert in that time
+        cls._create_alerts(
+            Channel.objects.exclude(org=None)
+            .filter(Exists(stuck_msgs.filter(channel=OuterRef("id"))))
+            .filter(Q(send_status__last_sent_on=None) | Q(send_status__last_sent_on__lt=six_hours_ago))
+            .exclude(Exists(cls.objects.filter(channel=OuterRef("id"), created_on__gt=six_hours_ago))),
+            cls.TYPE_SMS,
         )
 
-        channels = dict()
-        for queued in queued_messages:
-            if queued["channel"]:
-                channels[queued["channel"]] = dict(queued=queued["latest_queued"], sent=None)
+    @classmethod
+    def _create_alerts(cls, channels, alert_type: str):
+        """
+        Creates and sends alerts of the given type for the given queryset of channels
+        """
+        channel_ids = list(channels.values_list("id", flat=True))
+        if not channel_ids:
+            return
 
-        for sent in sent_messages:
-            existing = channels.get(sent["channel"], dict(queued=None))
-            existing["sent"] = sent["latest_sent"]
+        user = get_alert_user()
+        alerts = cls.objects.bulk_create(
+            [cls(channel_id=c, alert_type=alert_type, created_by=user, modified_by=user) for c in channel_ids]
+        )
+        for alert in alerts:
+            alert.send_alert()
 
-        for (channel_id, value) in channels.items():
-            # we haven't sent any messages in the past six hours
-            if not value["sent"] or value["sent"] < six_hours_ago:
-                channel = Channel.objects.get(pk=channel_id)
+    @classmethod
+    def _end_alerts(cls, alerts, ended_on, *, notify: bool):
+        """
+        Ends the given queryset of alerts, optionally sending resolved notifications for them
+        """
+        alerts = list(alerts.only("id"))
+        if not alerts:
+            return
 
-                # never alert on channels that have no org
-                if channel.org is None:  # pragma: no cover
-                    continue
+        cls.objects.filter(id__in=[a.id for a in alerts]).update(ended_on=ended_on)
 
-                # if we haven't sent an alert in the past six ours
-                if not Alert.objects.filter(channel=channel).filter(Q(created_on__gt=six_hours_ago)).exists():
-                    cls.create_and_send(channel, cls.TYPE_SMS)
+        if notify:
+            for alert in alerts:
+                alert.send_resolved()
 
     def send_alert(self):
         from .tasks import send_alert_task
@@ -4,15 +4,15 @@ from datetime import timedelta
 import pytz
 
 from django.conf import settings
-from django.db.models import Count, Sum
+from django.db.models import Max, Sum
 from django.utils import timezone
 
 from celery import shared_task
 
 from temba.orgs.models import Org
-from temba.utils import chunk_list
 from temba.utils.analytics import track
 from temba.utils.celery import nonoverlapping_task
+from temba.utils.trim import trim
 
 from .models import Alert, Channel, ChannelCount, ChannelLog, SyncEvent
 
@@ -57,23 +57,17 @@ def send_alert_task(alert_id, resolved):
 @nonoverlapping_task(track_started=True, name="trim_sync_events_task")
 def trim_sync_events_task():
     """
-    Trims old sync events
+    Trims old sync events, keeping the most recent old one for each channel
     """
 
     trim_before = timezone.now() - settings.RETENTION_PERIODS["syncevent"]
+    old_events = SyncEvent.objects.filter(created_on__lte=trim_before)
+    keep_ids = old_events.values("channel").annotate(max_id=Max("id")).order_by().values_list("max_id", flat=True)
 
-    channels_with_sync_events = (
-        SyncEvent.objects.filter(created_on__lte=trim_before)
-        .values("channel")
-        .annotate(Count("id"))
-        .filter(id__count__gt=1)
-    )
-    for channel_sync_events in channels_with_sync_events:
-        sync_events = SyncEvent.objects.filter(
-            created_on__lte=trim_before, channel_id=channel_sync_events["channel"]
-        ).order_by("-created_on")[1:]
-        for event in sync_events:
-            event.release()
+    def delete_alerts(event_ids):
+        Alert.objects.filter(sync_event_id__in=event_ids).delete()
+
+    trim("syncevent", old_events.exclude(id__in=list(keep_ids)), before_delete=delete_alerts)
 
 
 @nonoverlapping_task(track_started=True, name="trim_channel_log_task")
@@ -83,10 +77,7 @@ def trim_channel_log_task():
     """
 
     trim_before = timezone.now() - settings.RETENTION_PERIODS["channellog"]
-
-    ids = ChannelLog.objects.filter(created_on__lte=trim_before).values_list("id", flat=True)
-    for chunk in chunk_list(ids, 1000):
-        ChannelLog.objects.filter(id__in=chunk).delete()
+    trim("channellog", ChannelLog.objects.filter(created_on__lte=trim_before))
 
 
 @nonoverlapping_task(
@@ -29,7 +29,7 @@ from temba.triggers.models import Trigger
 from temba.utils import json
 from temba.utils.models import generate_uuid
 
-from .models import Alert, Channel, ChannelCount, ChannelEvent, ChannelLog, SyncEvent
+from .models import Alert, Channel, ChannelCount, ChannelEvent, ChannelLog, ChannelSendStatus, SyncEvent
 from .tasks import (
     check_channels_task,
     squash_channelcounts,
@@ -1788,6 +1788,9 @@ class ChannelClaimTest(TembaTest):
             dany, "SENT Message", created_on=four_hours_ago, sent_on=one_hour_ago, status="D"
         )
 
+        # channel's last sent time is maintained by a trigger
+        self.assertEqual(one_hour_ago, ChannelSendStatus.objects.get(channel=self.channel).last_sent_on)
+
         # ok check on our channel
         check_channels_task()
 
@@ -1798,6 +1801,10 @@ class ChannelClaimTest(TembaTest):
         sent_msg.sent_on = three_hours_ago
         sent_msg.save()
 
+        # last sent time never moves backwards
+        self.assertEqual(one_hour_ago, ChannelSendStatus.objects.get(channel=self.channel).last_sent_on)
+        ChannelSendStatus.objects.filter(channel=self.channel).update(last_sent_on=three_hours_ago)
+
         msg1.delete()
         msg1 = self.create_outgoing_msg(contact, "Message One", created_on=two_hours_ago, status="Q")
 
@@ -1809,6 +1816,7 @@ class ChannelClaimTest(TembaTest):
 
         sent_msg.sent_on = six_hours_ago
         sent_msg.save()
+        ChannelSendStatus.objects.filter(channel=self.channel).update(last_sent_on=six_hours_ago)
 
         alert = Alert.objects.all()[0]
         alert.created_on = six_hours_ago
@@ -1838,7 +1846,7 @@ class ChannelClaimTest(TembaTest):
         )
 
         # run again, nothing should change
-        with self.assertNumQueries(9):
+        with self.assertNumQueries(4):
             check_channels_task()
 
         self.assertEqual(2, Alert.objects.filter(channel=self.channel, ended_on=None).count())
@@ -1849,6 +1857,9 @@ class ChannelClaimTest(TembaTest):
         msg1.sent_on = timezone.now()
         msg1.save(update_fields=("status", "sent_on"))
 
+        # last sent time has moved forward
+        self.assertEqual(msg1.sent_on, ChannelSendStatus.objects.get(channel=self.channel).last_sent_on)
+
         # run again, our alert should end
         check_channels_task()
 
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.4 on 2022-05-24 10:00
+
+from django.db import migrations
+
+import temba.utils.json
+import temba.utils.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contacts", "0167_alter_contactgroup_is_system"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exportcontactstask",
+            name="stats",
+            field=temba.utils.models.JSONField(
+                decoder=temba.utils.json.TembaDecoder, encoder=temba.utils.json.TembaEncoder, null=True
+            ),
+        ),
+    ]
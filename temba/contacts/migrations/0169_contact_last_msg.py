@@ -0,0 +1,133 @@
+# Generated by Django 4.0.4 on 2022-06-22 14:03
+
+from django.db import migrations, models
+
+SQL = """
+----------------------------------------------------------------------
+-- Trigger procedure to update user and system labels on column changes
+----------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION temba_msg_on_change() RETURNS TRIGGER AS $$
+DECLARE
+  _new_label_type CHAR(1);
+  _old_label_type CHAR(1);
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    -- prevent illegal message states
+    IF NEW.direction = 'I' AND NEW.status NOT IN ('P', 'H') THEN
+      RAISE EXCEPTION 'Incoming messages can only be PENDING or HANDLED';
+    END IF;
+    IF NEW.direction = 'O' AND NEW.visibility = 'A' THEN
+      RAISE EXCEPTION 'Outgoing messages cannot be archived';
+    END IF;
+  END IF;
+
+  -- new message inserted
+  IF TG_OP = 'INSERT' THEN
+    _new_label_type := temba_msg_determine_system_label(NEW);
+    IF _new_label_type IS NOT NULL THEN
+      PERFORM temba_insert_system_label(NEW.org_id, _new_label_type, 1);
+    END IF;
+
+    IF NEW.broadcast_id IS NOT NULL THEN
+      PERFORM temba_insert_broadcastmsgcount(NEW.broadcast_id, 1);
+    END IF;
+
+    -- update the contact's reference to their last message
+    UPDATE contacts_contact SET last_msg_id = NEW.id
+    WHERE id = NEW.contact_id AND (last_msg_id IS NULL OR last_msg_id < NEW.id);
+
+  -- existing message updated
+  ELSIF TG_OP = 'UPDATE' THEN
+    _old_label_type := temba_msg_determine_system_label(OLD);
+    _new_label_type := temba_msg_determine_system_label(NEW);
+
+    IF _old_label_type IS DISTINCT FROM _new_label_type THEN
+      IF _old_label_type IS NOT NULL THEN
+        PERFORM temba_insert_system_label(OLD.org_id, _old_label_type, -1);
+      END IF;
+      IF _new_label_type IS NOT NULL THEN
+        PERFORM temba_insert_system_label(NEW.org_id, _new_label_type, 1);
+      END IF;
+    END IF;
+
+    -- is being archived or deleted (i.e. no longer included for user labels)
+    IF OLD.visibility = 'V' AND NEW.visibility != 'V' THEN
+      PERFORM temba_insert_message_label_counts(NEW.id, FALSE, -1);
+    END IF;
+
+    -- is being restored (i.e. now included for user labels)
+    IF OLD.visibility != 'V' AND NEW.visibility = 'V' THEN
+      PERFORM temba_insert_message_label_counts(NEW.id, FALSE, 1);
+    END IF;
+
+    -- update our broadcast msg count if it changed
+    IF NEW.broadcast_id IS DISTINCT FROM OLD.broadcast_id THEN
+      PERFORM temba_insert_broadcastmsgcount(OLD.broadcast_id, -1);
+      PERFORM temba_insert_broadcastmsgcount(NEW.broadcast_id, 1);
+    END IF;
+
+  -- existing message deleted
+  ELSIF TG_OP = 'DELETE' THEN
+    _old_label_type := temba_msg_determine_system_label(OLD);
+
+    IF _old_label_type IS NOT NULL THEN
+      PERFORM temba_insert_system_label(OLD.org_id, _old_label_type, -1);
+    END IF;
+
+    -- if this was the contact's last message, fall back to their previous message
+    UPDATE contacts_contact SET last_msg_id = (
+      SELECT id FROM msgs_msg WHERE contact_id = OLD.contact_id AND id < OLD.id ORDER BY id DESC LIMIT 1
+    )
+    WHERE id = OLD.contact_id AND last_msg_id = OLD.id;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# populates the last message of contacts with tickets, as those are the ones it's currently used for
+POPULATE_SQL = """
+UPDATE contacts_contact c SET last_msg_id = (
+  SELECT id FROM msgs_msg m WHERE m.contact_id = c.id ORDER BY id DESC LIMIT 1
+)
+WHERE c.id IN (SELECT contact_id FROM tickets_ticket WHERE org_id = %s);
+"""
+
+
+def populate_last_msg(apps, schema_editor):
+    Org = apps.get_model("orgs", "Org")
+
+    for org_id in Org.objects.filter(is_active=True).order_by("id").values_list("id", flat=True):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(POPULATE_SQL, (org_id,))
+
+
+def reverse(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contacts", "0168_exportcontactstask_stats"),
+        ("msgs", "0176_exportmessagestask_stats"),
+        ("tickets", "0038_remove_ticket_tickets_ticketer_external_id_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="contact",
+            name="last_msg",
+            field=models.ForeignKey(
+                db_constraint=False,
+                db_index=False,
+                null=True,
+                on_delete=models.deletion.DO_NOTHING,
+                related_name="+",
+                to="msgs.msg",
+            ),
+        ),
+        migrations.RunSQL(SQL),
+        migrations.RunPython(populate_last_msg, reverse),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.4 on 2022-06-28 10:12
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def populate_queued_on(apps, schema_editor):
+    ContactImportBatch = apps.get_model("contacts", "ContactImportBatch")
+
+    # all existing batches were queued when they were created
+    ContactImportBatch.objects.filter(queued_on=None).update(queued_on=timezone.now())
+
+
+def reverse(apps, schema_editor):  # pragma: no cover
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contacts", "0169_contact_last_msg"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="contactimportbatch",
+            name="queued_on",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(populate_queued_on, reverse),
+    ]
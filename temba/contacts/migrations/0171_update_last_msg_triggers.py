@@ -0,0 +1,153 @@
+# Generated by Django 4.0.4 on 2022-06-29 09:41
+
+from django.db import migrations
+
+SQL = """
+----------------------------------------------------------------------
+-- Gets the id of the given contact's most recent message, excluding the given message
+----------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION temba_contact_last_msg_id(_contact_id INT, _exclude_id BIGINT) RETURNS BIGINT AS $$
+BEGIN
+  -- ordered to use the index on (contact_id, created_on DESC)
+  RETURN (
+    SELECT id FROM msgs_msg WHERE contact_id = _contact_id AND id IS DISTINCT FROM _exclude_id
+    ORDER BY created_on DESC, id DESC LIMIT 1
+  );
+END;
+$$ LANGUAGE plpgsql;
+
+----------------------------------------------------------------------
+-- Trigger procedure to update user and system labels on column changes
+----------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION temba_msg_on_change() RETURNS TRIGGER AS $$
+DECLARE
+  _new_label_type CHAR(1);
+  _old_label_type CHAR(1);
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    -- prevent illegal message states
+    IF NEW.direction = 'I' AND NEW.status NOT IN ('P', 'H') THEN
+      RAISE EXCEPTION 'Incoming messages can only be PENDING or HANDLED';
+    END IF;
+    IF NEW.direction = 'O' AND NEW.visibility = 'A' THEN
+      RAISE EXCEPTION 'Outgoing messages cannot be archived';
+    END IF;
+  END IF;
+
+  -- new message inserted
+  IF TG_OP = 'INSERT' THEN
+    _new_label_type := temba_msg_determine_system_label(NEW);
+    IF _new_label_type IS NOT NULL THEN
+      PERFORM temba_insert_system_label(NEW.org_id, _new_label_type, 1);
+    END IF;
+
+    IF NEW.broadcast_id IS NOT NULL THEN
+      PERFORM temba_insert_broadcastmsgcount(NEW.broadcast_id, 1);
+    END IF;
+
+    -- update the contact's reference to their last message, which is only maintained for contacts with open tickets
+    UPDATE contacts_contact SET last_msg_id = NEW.id
+    WHERE id = NEW.contact_id AND ticket_count > 0 AND (last_msg_id IS NULL OR last_msg_id < NEW.id);
+
+    -- message was created as already sent so update its channel's last sent time
+    IF NEW.direction = 'O' AND NEW.channel_id IS NOT NULL AND NEW.sent_on IS NOT NULL THEN
+      PERFORM temba_update_channel_last_sent(NEW.channel_id, NEW.sent_on);
+    END IF;
+
+  -- existing message updated
+  ELSIF TG_OP = 'UPDATE' THEN
+    _old_label_type := temba_msg_determine_system_label(OLD);
+    _new_label_type := temba_msg_determine_system_label(NEW);
+
+    IF _old_label_type IS DISTINCT FROM _new_label_type THEN
+      IF _old_label_type IS NOT NULL THEN
+        PERFORM temba_insert_system_label(OLD.org_id, _old_label_type, -1);
+      END IF;
+      IF _new_label_type IS NOT NULL THEN
+        PERFORM temba_insert_system_label(NEW.org_id, _new_label_type, 1);
+      END IF;
+    END IF;
+
+    -- is being archived or deleted (i.e. no longer included for user labels)
+    IF OLD.visibility = 'V' AND NEW.visibility != 'V' THEN
+      PERFORM temba_insert_message_label_counts(NEW.id, FALSE, -1);
+    END IF;
+
+    -- is being restored (i.e. now included for user labels)
+    IF OLD.visibility != 'V' AND NEW.visibility = 'V' THEN
+      PERFORM temba_insert_message_label_counts(NEW.id, FALSE, 1);
+    END IF;
+
+    -- update our broadcast msg count if it changed
+    IF NEW.broadcast_id IS DISTINCT FROM OLD.broadcast_id THEN
+      PERFORM temba_insert_broadcastmsgcount(OLD.broadcast_id, -1);
+      PERFORM temba_insert_broadcastmsgcount(NEW.broadcast_id, 1);
+    END IF;
+
+    -- message has been sent so update its channel's last sent time
+    IF NEW.direction = 'O' AND NEW.channel_id IS NOT NULL AND NEW.sent_on IS DISTINCT FROM OLD.sent_on AND NEW.sent_on IS NOT NULL THEN
+      PERFORM temba_update_channel_last_sent(NEW.channel_id, NEW.sent_on);
+    END IF;
+
+  -- existing message deleted
+  ELSIF TG_OP = 'DELETE' THEN
+    _old_label_type := temba_msg_determine_system_label(OLD);
+
+    IF _old_label_type IS NOT NULL THEN
+      PERFORM temba_insert_system_label(OLD.org_id, _old_label_type, -1);
+    END IF;
+
+    -- if this was the contact's last message, fall back to their previous message
+    UPDATE contacts_contact SET last_msg_id = temba_contact_last_msg_id(OLD.contact_id, OLD.id)
+    WHERE id = OLD.contact_id AND ticket_count > 0 AND last_msg_id = OLD.id;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+----------------------------------------------------------------------
+-- Trigger procedure to update user and system labels on column changes
+----------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION temba_ticket_on_change() RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN -- new ticket inserted
+    PERFORM temba_insert_ticketcount(NEW.org_id, NEW.assignee_id, NEW.status, 1);
+
+    IF NEW.status = 'O' THEN
+      UPDATE contacts_contact SET ticket_count = ticket_count + 1, modified_on = NOW(),
+      last_msg_id = temba_contact_last_msg_id(NEW.contact_id, NULL) WHERE id = NEW.contact_id;
+    END IF;
+  ELSIF TG_OP = 'UPDATE' THEN -- existing ticket updated
+    IF OLD.assignee_id IS DISTINCT FROM NEW.assignee_id OR OLD.status != NEW.status THEN
+      PERFORM temba_insert_ticketcount(OLD.org_id, OLD.assignee_id, OLD.status, -1);
+      PERFORM temba_insert_ticketcount(NEW.org_id, NEW.assignee_id, NEW.status, 1);
+    END IF;
+
+    IF OLD.status = 'O' AND NEW.status = 'C' THEN -- ticket closed
+      UPDATE contacts_contact SET ticket_count = ticket_count - 1, modified_on = NOW() WHERE id = OLD.contact_id;
+    ELSIF OLD.status = 'C' AND NEW.status = 'O' THEN -- ticket reopened
+      UPDATE contacts_contact SET ticket_count = ticket_count + 1, modified_on = NOW(),
+      last_msg_id = temba_contact_last_msg_id(OLD.contact_id, NULL) WHERE id = OLD.contact_id;
+    END IF;
+  ELSIF TG_OP = 'DELETE' THEN -- existing ticket deleted
+    PERFORM temba_insert_ticketcount(OLD.org_id, OLD.assignee_id, OLD.status, -1);
+
+    IF OLD.status = 'O' THEN -- open ticket deleted
+      UPDATE contacts_contact SET ticket_count = ticket_count - 1, modified_on = NOW() WHERE id = OLD.contact_id;
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("channels", "0140_channelsendstatus"),
+        ("contacts", "0170_contactimportbatch_queued_on"),
+    ]
+
+    operations = [migrations.RunSQL(SQL)]
@@ -0,0 +1,20 @@
+# Generated by Django 4.0.4 on 2022-06-30 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contacts", "0171_update_last_msg_triggers"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exportcontactstask",
+            name="format",
+            field=models.CharField(
+                choices=[("xlsx", "Excel"), ("csv", "CSV"), ("csv.gz", "Compressed CSV")], default="xlsx", max_length=6
+            ),
+        ),
+    ]
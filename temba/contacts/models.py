@@ -1,8 +1,9 @@
+import heapq
 import logging
 import time
 from datetime import date, datetime, timedelta
 from decimal import Decimal
-from itertools import chain
+from itertools import islice
 from pathlib import Path
 from typing import Any
 
@@ -20,6 +21,8 @@ from django.core.validators import validate_email
 from django.db import IntegrityError, models, transaction
 from django.db.models import Count, F, Max, Q, Sum, Value
 from django.db.models.functions import Concat, Lower
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -30,13 +33,14 @@ from temba.locations.models import AdminBoundary
 from temba.mailroom import ContactSpec, modifiers, queue_populate_dynamic_group
 from temba.orgs.models import DependencyMixin, Org
 from temba.utils import chunk_list, format_number, on_transaction_commit
+from temba.utils.dates import datetime_to_timestamp, timestamp_to_datetime
 from temba.utils.export import BaseExportAssetStore, BaseExportTask, TableExporter
 from temba.utils.models import JSONField, LegacyUUIDMixin, SquashableModel, TembaModel
 from temba.utils.text import decode_stream, unsnakify
 from temba.utils.urns import ParsedURN, parse_number, parse_urn
 from temba.utils.uuid import uuid4
 
-from .search import SearchException, elastic, parse_query
+from .search import SearchException, elastic, invalidate_search_cache, parse_query
 
 logger = logging.getLogger(__name__)
 
@@ -614,6 +618,11 @@ class Contact(LegacyUUIDMixin, SmartModel):
     current_flow = models.ForeignKey("flows.Flow", on_delete=models.PROTECT, null=True, db_index=False)
     ticket_count = models.IntegerField(default=0)
 
+    # the most recent message to or from this contact, maintained by a trigger on message changes
+    last_msg = models.ForeignKey(
+        "msgs.Msg", on_delete=models.DO_NOTHING, null=True, db_index=False, db_constraint=False, related_name="+"
+    )
+
     # user that last modified this contact
     modified_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -744,7 +753,7 @@ class Contact(LegacyUUIDMixin, SmartModel):
 
     def get_history(self, after: datetime, before: datetime, include_event_types: set, ticket, limit: int) -> list:
         """
-        Gets this contact's history of messages, calls, runs etc in the given time window
+        Gets this contact's history of messages, calls, runs etc in the given time window, newest first
         """
         from temba.flows.models import FlowExit
         from temba.ivr.models import IVRCall
@@ -770,6 +779,7 @@ class Contact(LegacyUUIDMixin, SmartModel):
         )
         started_runs = [r for r in runs if after <= r.created_on < before]
         exited_runs = [FlowExit(r) for r in runs if r.exited_on and after <= r.exited_on < before]
+        exited_runs = sorted(exited_runs, key=lambda e: e.run.exited_on, reverse=True)
 
         channel_events = (
             self.channel_events.filter(created_on__gte=after, created_on__lt=before)
@@ -812,41 +822,49 @@ class Contact(LegacyUUIDMixin, SmartModel):
             "-created_on"
         )[:limit]
 
-        session_events = self.get_session_events(after, before, include_event_types)
-
-        # chain all items together, sort by their event time, and slice
-        items = chain(
-            msgs,
-            started_runs,
-            exited_runs,
-            ticket_events,
-            channel_events,
-            campaign_events,
-            calls,
-            transfers,
-            session_events,
-        )
+        session_events = self._get_session_events(after, before, include_event_types)
+
+        # every stream is already sorted newest first, so pair items with their times and lazily merge the streams
+        # until we have enough items
+        streams = [
+            ((get_event_time(i), i) for i in stream)
+            for stream in (
+                msgs,
+                started_runs,
+                exited_runs,
+                ticket_events,
+                channel_events,
+                campaign_events,
+                calls,
+                transfers,
+            )
+        ]
+        streams.append(session_events)
 
-        # sort and slice
-        return sorted(items, key=get_event_time, reverse=True)[:limit]
+        merged = heapq.merge(*streams, key=lambda t: t[0], reverse=True)
+        return [item for _, item in islice(merged, limit)]
 
     def get_session_events(self, after: datetime, before: datetime, types: set) -> list:
         """
-        Extracts events from this contacts sessions that overlap with the given time window
+        Extracts events from this contacts sessions that overlap with the given time window, newest first
         """
+        return [event for _, event in self._get_session_events(after, before, types)]
+
+    def _get_session_events(self, after: datetime, before: datetime, types: set) -> list:
+        from temba.flows.models import FlowSession
+
         sessions = self.sessions.filter(
             Q(created_on__gte=after, created_on__lt=before) | Q(ended_on__gte=after, ended_on__lt=before)
         )
+        after_ts, before_ts = datetime_to_timestamp(after), datetime_to_timestamp(before)
+
         events = []
-        for session in sessions:
-            for run in session.output_json.get("runs", []):
-                for event in run.get("events", []):
-                    event["session_uuid"] = str(session.uuid)
-                    event_time = iso8601.parse_date(event["created_on"])
-                    if event["type"] in types and after <= event_time < before:
-                        events.append(event)
+        for session_events in FlowSession.get_events(sessions).values():
+            for ts, event in session_events:
+                if event["type"] in types and after_ts <= ts < before_ts:
+                    events.append((timestamp_to_datetime(ts), event))
 
-        return events
+        return sorted(events, key=lambda e: e[0], reverse=True)
 
     def get_field_json(self, field):
         """
@@ -1761,6 +1779,21 @@ class ContactGroup(LegacyUUIDMixin, TembaModel, DependencyMixin):
         constraints = [models.UniqueConstraint("org", Lower("name"), name="unique_contact_group_names")]
 
 
+@receiver(post_save, sender=ContactField)
+@receiver(post_delete, sender=ContactField)
+@receiver(post_save, sender=ContactGroup)
+@receiver(post_delete, sender=ContactGroup)
+def invalidate_org_search_cache(sender, instance, **kwargs):
+    """
+    Fields and groups can change how queries are parsed and what they match, so any memoized search results for the
+    org are invalidated when they change
+    """
+    if kwargs.get("raw"):  # pragma: no cover
+        return
+
+    invalidate_search_cache(instance.org_id)
+
+
 class ContactGroupCount(SquashableModel):
     """
     Maintains counts of contact groups. These are calculated via triggers on the database and squashed
@@ -1812,6 +1845,8 @@ class ExportContactsTask(BaseExportTask):
     analytics_key = "contact_export"
     notification_export_type = "contact"
 
+    BATCH_SIZE = 1000
+
     group = models.ForeignKey(
         ContactGroup,
         on_delete=models.PROTECT,
@@ -1824,9 +1859,13 @@ class ExportContactsTask(BaseExportTask):
 
     search = models.TextField(null=True, blank=True, help_text=_("The search query"))
 
+    format = models.CharField(max_length=6, choices=TableExporter.FORMAT_CHOICES, default=TableExporter.FORMAT_XLSX)
+
     @classmethod
-    def create(cls, org, user, group=None, search=None, group_memberships=()):
-        export = cls.objects.create(org=org, group=group, search=search, created_by=user, modified_by=user)
+    def create(cls, org, user, group=None, search=None, group_memberships=(), format=TableExporter.FORMAT_XLSX):
+        export = cls.objects.create(
+            org=org, group=group, search=search, format=format, created_by=user, modified_by=user
+        )
         export.group_memberships.add(*group_memberships)
         return export
 
@@ -1903,19 +1942,19 @@ class ExportContactsTask(BaseExportTask):
 
         include_group_memberships = bool(self.group_memberships.exists())
 
-        if self.search:
-            contact_ids = elastic.query_contact_ids(self.org, self.search, group=group)
-        else:
-            contact_ids = group.contacts.order_by("name", "id").values_list("id", flat=True)
+        contact_id_batches, get_total = self._get_contact_id_batches(group)
+        total_contacts = None
 
         # create our exporter
-        exporter = TableExporter(self, "Contact", [f["label"] for f in fields] + [g["label"] for g in group_fields])
+        exporter = TableExporter(
+            self, "Contact", [f["label"] for f in fields] + [g["label"] for g in group_fields], format=self.format
+        )
 
         total_exported_contacts = 0
         start = time.time()
 
         # write out contacts in batches to limit memory usage
-        for batch_ids in chunk_list(contact_ids, 1000):
+        for batch_ids in contact_id_batches:
             # fetch all the contacts for our batch
             batch_contacts = (
                 Contact.objects.filter(id__in=batch_ids).prefetch_related("org", "groups").using("readonly")
@@ -1947,16 +1986,19 @@ class ExportContactsTask(BaseExportTask):
 
                 # output some status information every 10,000 contacts
                 if total_exported_contacts % ExportContactsTask.LOG_PROGRESS_PER_ROWS == 0:
+                    if total_contacts is None:
+                        total_contacts = max(get_total(), total_exported_contacts)
+
                     elapsed = time.time() - start
-                    predicted = elapsed // (total_exported_contacts / len(contact_ids))
+                    predicted = elapsed // (total_exported_contacts / total_contacts)
 
                     logger.info(
                         "Export of %s contacts - %d%% (%s/%s) complete in %0.2fs (predicted %0.0fs)"
                         % (
                             self.org.name,
-                            total_exported_contacts * 100 // len(contact_ids),
+                            total_exported_contacts * 100 // total_contacts,
                             "{:,}".format(total_exported_contacts),
-                            "{:,}".format(len(contact_ids)),
+                            "{:,}".format(total_contacts),
                             time.time() - start,
                             predicted,
                         )
@@ -1967,6 +2009,45 @@ class ExportContactsTask(BaseExportTask):
 
         return exporter.save_file()
 
+    def _get_contact_id_batches(self, group) -> tuple:
+        """
+        Returns a generator of batches of the ids of contacts to export, and a function to get their total count. Group
+        members are paged through in contact id order using the index on group memberships, so the full list of ids is
+        never loaded into memory.
+        """
+        if self.search:
+            return elastic.query_contact_id_batches(
+                self.org,
+                self.search,
+                group=group,
+                batch_size=self.BATCH_SIZE,
+                slices=settings.ELASTICSEARCH_SCROLL_SLICES,
+            )
+
+        members = (
+            ContactGroup.contacts.through.objects.using("readonly")
+            .filter(contactgroup_id=group.id)
+            .order_by("contact_id")
+            .values_list("contact_id", flat=True)
+        )
+
+        def batches():
+            last_id = 0
+            while True:
+                contact_ids = list(members.filter(contact_id__gt=last_id)[: self.BATCH_SIZE])
+                if contact_ids:
+                    yield contact_ids
+
+                if len(contact_ids) < self.BATCH_SIZE:
+                    break
+
+                last_id = contact_ids[-1]
+
+        def get_total() -> int:
+            return group.get_member_count()
+
+        return batches(), get_total
+
     def get_field_value(self, field: dict, contact: Contact):
         if field["key"] == "name":
             return contact.name
@@ -2012,6 +2093,18 @@ class ContactImport(SmartModel):
     # how many sequential URNs triggers flagging
     SEQUENTIAL_URNS_THRESHOLD = 250
 
+    # how many of the imported URNs are kept to check for spamminess
+    SPAM_SAMPLE_SIZE = 5000
+
+    # redis keys for tracking progress of started imports
+    BATCHES_REMAINING_KEY = "contact_import_batches_remaining:%d"
+    PARSED_KEY = "contact_import_parsed:%d"
+    PROGRESS_TTL = 24 * 60 * 60
+
+    # lock held while an import is being parsed, renewed after each batch
+    LOCK_KEY = "contact_import_start:%d"
+    LOCK_TTL = 10 * 60
+
     STATUS_PENDING = "P"
     STATUS_PROCESSING = "O"
     STATUS_COMPLETE = "C"
@@ -2217,26 +2310,69 @@ class ContactImport(SmartModel):
 
     def start(self):
         """
-        Starts this import, creating batches to be handled by mailroom
+        Starts this import, creating batches to be handled by mailroom. Rows are parsed as a stream and each batch is
+        queued as soon as it's created, so if this is interrupted, calling it again resumes from the last batch created.
         """
 
-        assert self.status == self.STATUS_PENDING, "trying to start an already started import"
+        assert self.status in (self.STATUS_PENDING, self.STATUS_PROCESSING), "trying to start a finished import"
 
-        # mark us as processing to prevent double starting
-        self.status = self.STATUS_PROCESSING
-        self.started_on = timezone.now()
-        self.save(update_fields=("status", "started_on"))
+        r = get_redis_connection()
 
-        # create new contact fields as necessary
-        for item in self.mappings:
-            mapping = item["mapping"]
-            if mapping["type"] == "new_field":
-                ContactField.create(self.org, self.created_by, mapping["name"], value_type=mapping["value_type"])
+        # a redelivered task can overlap with one that is still running, so only one of them gets to parse the file
+        lock = r.lock(self.LOCK_KEY % self.id, timeout=self.LOCK_TTL)
+        if not lock.acquire(blocking=False):
+            logger.info(f"Contact import #{self.id} is already being started")
+            return
 
-        # if user wants contacts added to a new group, create it
-        if self.group_name and not self.group:
-            self.group = ContactGroup.create_manual(self.org, self.created_by, name=self.group_name)
-            self.save(update_fields=("group",))
+        try:
+            # another task may have made progress since we were loaded
+            self.refresh_from_db(fields=("status", "group"))
+
+            if self.status in (self.STATUS_PENDING, self.STATUS_PROCESSING):
+                self._start(r, lock)
+        finally:
+            lock.release()
+
+    def _start(self, r, lock):
+        remaining_key = self.BATCHES_REMAINING_KEY % self.id
+        parsed_key = self.PARSED_KEY % self.id
+
+        if self.status == self.STATUS_PENDING:
+            # mark us as processing to prevent double starting
+            self.status = self.STATUS_PROCESSING
+            self.started_on = timezone.now()
+            self.save(update_fields=("status", "started_on"))
+
+            # create new contact fields as necessary
+            for item in self.mappings:
+                mapping = item["mapping"]
+                if mapping["type"] == "new_field":
+                    ContactField.create(self.org, self.created_by, mapping["name"], value_type=mapping["value_type"])
+
+            # if user wants contacts added to a new group, create it
+            if self.group_name and not self.group:
+                self.group = ContactGroup.create_manual(self.org, self.created_by, name=self.group_name)
+                self.save(update_fields=("group",))
+
+            # set redis key which mailroom batch tasks can decrement to know when import has completed - the number of
+            # records was counted when the file was uploaded so we can predict the number of batches
+            r.set(remaining_key, self._get_expected_num_batches(), ex=self.PROGRESS_TTL)
+
+            resume_from = 0
+        else:
+            # if we previously finished parsing the file, there's nothing to resume
+            if r.get(parsed_key):
+                return
+
+            last_batch = self.batches.order_by("record_end").last()
+            resume_from = last_batch.record_end if last_batch else 0
+
+            # we may have been interrupted after creating a batch but before queueing it
+            unqueued = list(self.batches.filter(queued_on=None).order_by("record_start"))
+            if unqueued:
+                ContactImportBatch.queue_all(unqueued)
+
+            logger.info(f"Resuming contact import #{self.id} from record {resume_from}")
 
         # CSV reader expects str stream so wrap file
         file_type = self._get_file_type()
@@ -2245,26 +2381,53 @@ class ContactImport(SmartModel):
         # parse each row, creating batch tasks for mailroom
         data = pyexcel.iget_array(file_stream=file, file_type=file_type, start_row=1)
 
-        urns = []
-        batches = []
+        check_spam = not self.org.is_verified()
+        urn_sample = []
+        num_batches = self.batches.count()
 
         for batch_specs, batch_start, batch_end in self._batches_generator(data):
-            batches.append(self.batches.create(specs=batch_specs, record_start=batch_start, record_end=batch_end))
+            if batch_end <= resume_from:
+                continue
 
-            for spec in batch_specs:
-                urns.extend(spec.get("urns", []))
+            batch = self.batches.create(specs=batch_specs, record_start=batch_start, record_end=batch_end)
+            ContactImportBatch.queue_all([batch])
+            num_batches += 1
 
-        # set redis key which mailroom batch tasks can decrement to know when import has completed
-        r = get_redis_connection()
-        r.set(f"contact_import_batches_remaining:{self.id}", len(batches), ex=24 * 60 * 60)
+            # we're still working so keep hold of our lock
+            lock.reacquire()
 
-        # start each batch...
-        for batch in batches:
-            batch.import_async()
+            # flag org as soon as a sample of the imported URNs looks suspicious
+            if check_spam and len(urn_sample) < self.SPAM_SAMPLE_SIZE:
+                for spec in batch_specs:
+                    urn_sample.extend(spec.get("urns", []))
+                del urn_sample[self.SPAM_SAMPLE_SIZE :]
+
+                if self._detect_spamminess(urn_sample):
+                    self.org.flag()
+                    check_spam = False
+
+        r.set(parsed_key, 1, ex=self.PROGRESS_TTL)
 
-        # flag org if the set of imported URNs looks suspicious
-        if not self.org.is_verified() and self._detect_spamminess(urns):
-            self.org.flag()
+        # correct the remaining count if the number of batches we created differs from what we predicted
+        adjustment = num_batches - self._get_expected_num_batches()
+        if adjustment:
+            if r.incrby(remaining_key, adjustment) <= 0:
+                self._finish()
+
+    def _get_expected_num_batches(self) -> int:
+        return (self.num_records + self.BATCH_SIZE - 1) // self.BATCH_SIZE
+
+    def _finish(self):
+        """
+        Marks this import as complete, which is normally done by mailroom when it handles the last batch
+        """
+        from temba.notifications.models import Notification
+
+        self.status = self.STATUS_COMPLETE
+        self.finished_on = timezone.now()
+        self.save(update_fields=("status", "finished_on"))
+
+        Notification.import_finished(self)
 
     def _batches_generator(self, row_iter):
         """
@@ -2489,8 +2652,17 @@ class ContactImportBatch(models.Model):
     errors = models.JSONField(default=list)
     finished_on = models.DateTimeField(null=True)
 
-    def import_async(self):
-        mailroom.queue_contact_import_batch(self)
+    # when this batch was queued to mailroom
+    queued_on = models.DateTimeField(null=True)
+
+    @classmethod
+    def queue_all(cls, batches):
+        """
+        Queues the given batches to mailroom and records that they've been queued
+        """
+        mailroom.queue_contact_import_batches(batches)
+
+        cls.objects.filter(id__in=[b.id for b in batches]).update(queued_on=timezone.now())
 
 
 @register_asset_store
@@ -2499,4 +2671,4 @@ class ContactExportAssetStore(BaseExportAssetStore):
     key = "contact_export"
     directory = "contact_exports"
     permission = "contacts.contact_export"
-    extensions = ("xlsx", "csv")
+    extensions = ("xlsx", "csv", "csv.gz")
@@ -1,3 +1,6 @@
+from queue import Full, Queue
+from threading import Event, Thread
+
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search as es_Search
 
@@ -5,19 +8,132 @@ from django.conf import settings
 
 from .mailroom import parse_query
 
-ES = Elasticsearch(hosts=[settings.ELASTICSEARCH_URL])
+# a single client is shared by all requests, and it keeps a pool of connections to each node
+ES = Elasticsearch(
+    hosts=[settings.ELASTICSEARCH_URL],
+    timeout=settings.ELASTICSEARCH_TIMEOUT,
+    maxsize=settings.ELASTICSEARCH_MAX_CONNECTIONS,
+    max_retries=settings.ELASTICSEARCH_MAX_RETRIES,
+    retry_on_timeout=True,
+)
+
+SCROLL_TIMEOUT = "5m"
+SLICE_PUT_TIMEOUT = 1  # how often slice threads check whether the consumer has stopped
 
 
-def query_contact_ids(org, query, *, group=None):
+def query_contact_id_batches(org, query, *, group=None, batch_size: int = 1000, slices: int = 1) -> tuple:
     """
-    Returns the contact ids for the given query
+    Returns a generator of batches of the contact ids for the given query, and a function to get the total count. Results
+    are paged through in id order using search_after so the full list of ids is never held in memory. If slices is
+    greater than one, results are instead fetched by that many sliced scrolls in parallel, and so aren't in id order.
     """
     parsed = parse_query(org, query, group=group)
-    results = (
+    search = (
         es_Search(index="contacts").source(include=["id"]).params(routing=org.id).using(ES).query(parsed.elastic_query)
     )
 
-    return [int(r.id) for r in results.scan()]
+    def batches():
+        after = None
+        while True:
+            page = search.sort("id").extra(size=batch_size)
+            if after is not None:
+                page = page.extra(search_after=[after])
+
+            ids = [int(r.id) for r in page.execute()]
+            if ids:
+                yield ids
+
+            if len(ids) < batch_size:
+                break
+
+            after = ids[-1]
+
+    def get_total() -> int:
+        return search.count()
+
+    if slices > 1:
+        return _sliced_batches(search, slices, batch_size), get_total
+
+    return batches(), get_total
+
+
+def query_contact_ids_after(org, query, *, group=None, after_id: int, size: int, exclude_ids=()) -> tuple:
+    """
+    Returns a tuple of the parsed query, the next page of contact ids in descending id order after the given id, and the
+    total count. Pages are fetched using search_after so deep pages cost no more than the first.
+    """
+    parsed = parse_query(org, query, group=group)
+    search = (
+        es_Search(index="contacts")
+        .source(include=["id"])
+        .params(routing=org.id)
+        .using(ES)
+        .query(parsed.elastic_query)
+        .sort("-id")
+        .extra(size=size, search_after=[after_id], track_total_hits=True)
+    )
+    if exclude_ids:
+        search = search.exclude("terms", id=list(exclude_ids))
+
+    response = search.execute()
+
+    return parsed, [int(r.id) for r in response], response.hits.total.value
+
+
+def _sliced_batches(search, slices: int, batch_size: int):
+    """
+    Generates batches of ids from the given search using a sliced scroll, with each slice scanned in its own thread. If
+    the consumer stops early, the slice threads are stopped and their scrolls cleared.
+    """
+    queue = Queue(maxsize=slices * 2)  # bounded so that slices can't get too far ahead of the consumer
+    stopped = Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=SLICE_PUT_TIMEOUT)
+                return True
+            except Full:
+                pass
+        return False
+
+    def scan_slice(slice_id: int):
+        try:
+            sliced = search.extra(slice={"id": slice_id, "max": slices}).params(scroll=SCROLL_TIMEOUT, size=batch_size)
+            hits = sliced.scan()
+            try:
+                batch = []
+                for hit in hits:
+                    batch.append(int(hit.id))
+                    if len(batch) == batch_size:
+                        if not put(batch):
+                            return
+                        batch = []
+                if batch and not put(batch):
+                    return
+            finally:
+                hits.close()  # clears the scroll if we didn't finish it
+
+            put(done)
+        except Exception as e:
+            put(e)
+
+    for i in range(slices):
+        Thread(target=scan_slice, args=(i,), daemon=True).start()
+
+    try:
+        remaining = slices
+        while remaining:
+            item = queue.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stopped.set()
 
 
 def get_last_modified():
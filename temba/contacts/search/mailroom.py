@@ -1,7 +1,18 @@
+import hashlib
+from dataclasses import asdict
+
+from django_redis import get_redis_connection
+
+from django.conf import settings
 from django.utils.encoding import force_str
 from django.utils.translation import gettext_lazy as _
 
 from temba import mailroom
+from temba.utils import json
+
+CACHE_GENERATION_KEY = "org:%d:cache:search_generation"
+CACHE_RESULT_KEY = "org:%d:cache:search:%s"
+CACHE_STATS_KEY = "cache:search_stats"
 
 
 class SearchException(Exception):
@@ -45,10 +56,18 @@ def parse_query(org, query: str, *, parse_only: bool = False, group=None) -> mai
     """
     Parses the passed in query in the context of the org
     """
-    try:
-        group_uuid = group.uuid if group else None
+    group_uuid = str(group.uuid if group else None)
 
-        return mailroom.get_client().parse_query(org.id, query, parse_only=parse_only, group_uuid=str(group_uuid))
+    def fetch():
+        return mailroom.get_client().parse_query(org.id, query, parse_only=parse_only, group_uuid=group_uuid)
+
+    def decode(d):
+        return mailroom.ParsedQuery(d["query"], d["elastic_query"], mailroom.QueryMetadata(**d["metadata"]))
+
+    try:
+        return _memoize(
+            org, "parse_query", (group_uuid, query, parse_only), settings.SEARCH_PARSE_CACHE_TTL, fetch, decode
+        )
     except mailroom.MailroomException as e:
         raise SearchException.from_mailroom_exception(e)
 
@@ -56,16 +75,77 @@ def parse_query(org, query: str, *, parse_only: bool = False, group=None) -> mai
 def search_contacts(
     org, query: str, *, group=None, sort: str = None, offset: int = None, exclude_ids=()
 ) -> mailroom.SearchResults:
-    try:
-        group_uuid = group.uuid if group else None
+    group_uuid = str(group.uuid if group else None)
 
+    def fetch():
         return mailroom.get_client().contact_search(
-            org.id, group_uuid=str(group_uuid), query=query, sort=sort, offset=offset, exclude_ids=exclude_ids
+            org.id, group_uuid=group_uuid, query=query, sort=sort, offset=offset, exclude_ids=exclude_ids
+        )
+
+    def decode(d):
+        return mailroom.SearchResults(
+            d["query"], d["total"], d["contact_ids"], mailroom.QueryMetadata(**d["metadata"])
+        )
+
+    try:
+        return _memoize(
+            org,
+            "search_contacts",
+            (group_uuid, query, sort, offset, sorted(exclude_ids)),
+            settings.SEARCH_RESULTS_CACHE_TTL,
+            fetch,
+            decode,
         )
     except mailroom.MailroomException as e:
         raise SearchException.from_mailroom_exception(e)
 
 
+def invalidate_search_cache(org_id: int):
+    """
+    Invalidates all memoized parse and search results for the given org, e.g. because its fields or groups changed
+    """
+    get_redis_connection().incr(CACHE_GENERATION_KEY % org_id)
+
+
+def get_search_cache_stats() -> dict:
+    """
+    Gets the hit and miss counts of memoized parse and search results
+    """
+    stats = get_redis_connection().hgetall(CACHE_STATS_KEY)
+    return {force_str(k): int(v) for k, v in stats.items()}
+
+
+def _memoize(org, name: str, args: tuple, ttl: int, fetch, decode):
+    """
+    Memoizes the result of the given mailroom call in redis for a short time. Results are stored with the org's current
+    cache generation so that invalidating is just incrementing that.
+    """
+    if not ttl:
+        return fetch()
+
+    args_hash = hashlib.sha1(json.dumps([name, *args]).encode()).hexdigest()
+    generation_key, result_key = CACHE_GENERATION_KEY % org.id, CACHE_RESULT_KEY % (org.id, args_hash)
+
+    r = get_redis_connection()
+    generation, cached = r.mget(generation_key, result_key)
+    generation = int(generation or 0)
+
+    if cached is not None:
+        cached = json.loads(force_str(cached))
+        if cached["generation"] == generation:
+            r.hincrby(CACHE_STATS_KEY, f"{name}:hits", 1)
+            return decode(cached["result"])
+
+    result = fetch()
+
+    pipe = r.pipeline()
+    pipe.set(result_key, json.dumps({"generation": generation, "result": asdict(result)}), ex=ttl)
+    pipe.hincrby(CACHE_STATS_KEY, f"{name}:misses", 1)
+    pipe.execute()
+
+    return result
+
+
 def preview_start(
     org, flow, include: mailroom.QueryInclusions, exclude: mailroom.QueryExclusions, sample_size: int
 ) -> mailroom.StartPreview:
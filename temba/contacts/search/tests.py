@@ -1,7 +1,12 @@
+import time
+from unittest.mock import patch
+
+from django.test.utils import override_settings
+
 from temba.mailroom import MailroomException
 from temba.tests import TembaTest, mock_mailroom
 
-from . import SearchException, elastic
+from . import SearchException, elastic, get_search_cache_stats, parse_query, search_contacts
 
 
 class SearchExceptionTest(TembaTest):
@@ -101,9 +106,123 @@ class SearchExceptionTest(TembaTest):
             self.assertEqual(message, str(e))
 
 
+class SearchCacheTest(TembaTest):
+    @mock_mailroom
+    @override_settings(SEARCH_PARSE_CACHE_TTL=60, SEARCH_RESULTS_CACHE_TTL=10)
+    def test_memoization(self, mr_mocks):
+        bob = self.create_contact("Bob", phone="+12065551212")
+        mr_mocks.contact_search("name ~ bob", cleaned='name ~ "bob"', contacts=[bob])
+
+        results1 = search_contacts(self.org, "name ~ bob", group=self.org.active_contacts_group, sort="name")
+        results2 = search_contacts(self.org, "name ~ bob", group=self.org.active_contacts_group, sort="name")
+
+        self.assertEqual(results1, results2)
+        self.assertEqual('name ~ "bob"', results2.query)
+        self.assertEqual([bob.id], results2.contact_ids)
+        self.assertEqual(1, len(mr_mocks.calls["contact_search"]))
+
+        # a different offset is a different search
+        search_contacts(self.org, "name ~ bob", group=self.org.active_contacts_group, sort="name", offset=50)
+
+        self.assertEqual(2, len(mr_mocks.calls["contact_search"]))
+
+        parsed1 = parse_query(self.org, "name = bob")
+        parsed2 = parse_query(self.org, "name = bob")
+
+        self.assertEqual(parsed1, parsed2)
+        self.assertEqual(1, len(mr_mocks.calls["parse_query"]))
+
+        # adding a field invalidates everything for the org
+        self.create_field("age", "Age")
+
+        parse_query(self.org, "name = bob")
+        search_contacts(self.org, "name ~ bob", group=self.org.active_contacts_group, sort="name")
+
+        self.assertEqual(2, len(mr_mocks.calls["parse_query"]))
+        self.assertEqual(3, len(mr_mocks.calls["contact_search"]))
+
+        # as does a group change
+        self.create_group("Testers", contacts=[bob])
+
+        parse_query(self.org, "name = bob")
+
+        self.assertEqual(3, len(mr_mocks.calls["parse_query"]))
+
+        # but not changes in other orgs
+        self.create_field("age", "Age", org=self.org2)
+
+        parse_query(self.org, "name = bob")
+
+        self.assertEqual(3, len(mr_mocks.calls["parse_query"]))
+
+        # errors aren't memoized
+        mr_mocks.error("bad field <> error")
+        with self.assertRaises(SearchException):
+            parse_query(self.org, "bad_field <> error")
+
+        self.assertEqual(
+            {
+                "parse_query:hits": 2,
+                "parse_query:misses": 3,
+                "search_contacts:hits": 1,
+                "search_contacts:misses": 3,
+            },
+            get_search_cache_stats(),
+        )
+
+
 class TestElastic(TembaTest):
     @mock_mailroom
     def test_query_elasticsearch_for_ids_bad_query(self, mr_mocks):
         with self.assertRaises(SearchException):
             mr_mocks.error("bad field <> error")
-            elastic.query_contact_ids(self.org, "bad_field <> error")
+            elastic.query_contact_id_batches(self.org, "bad_field <> error")
+
+    @mock_mailroom
+    def test_query_contact_id_batches_sliced(self, mr_mocks):
+        def search(body, **kwargs):
+            slice_id = body["slice"]["id"]
+            ids = range(slice_id + 1, 11, 2)  # slice 0 gets odd ids, slice 1 gets even ids
+            return {
+                "_scroll_id": str(slice_id),
+                "_shards": {"failed": 0, "successful": 1, "total": 1},
+                "hits": {"hits": [{"_index": "contacts", "_source": {"id": i}} for i in ids]},
+            }
+
+        mr_mocks.parse_query("name ~ bob", elastic_query={"match": {"name": "bob"}})
+
+        with patch("temba.contacts.search.elastic.ES") as mock_es:
+            mock_es.search.side_effect = search
+            mock_es.scroll.return_value = {"_scroll_id": "0", "hits": {"hits": []}}
+
+            batches, get_total = elastic.query_contact_id_batches(self.org, "name ~ bob", batch_size=2, slices=2)
+            batches = list(batches)
+
+        self.assertEqual(6, len(batches))
+        self.assertTrue(all(len(b) <= 2 for b in batches))
+        self.assertEqual(list(range(1, 11)), sorted(i for b in batches for i in b))
+        self.assertEqual({0, 1}, {c.kwargs["body"]["slice"]["id"] for c in mock_es.search.call_args_list})
+
+        # errors in a slice are raised by the generator
+        with patch("temba.contacts.search.elastic.ES") as mock_es:
+            mock_es.search.side_effect = ValueError("boom")
+
+            batches, get_total = elastic.query_contact_id_batches(self.org, "name ~ bob", slices=2)
+            with self.assertRaises(ValueError):
+                list(batches)
+
+        # if the consumer stops early, the slice threads stop and clear their scrolls
+        with patch("temba.contacts.search.elastic.ES") as mock_es:
+            mock_es.search.side_effect = search
+            mock_es.scroll.return_value = {"_scroll_id": "0", "hits": {"hits": []}}
+
+            batches, get_total = elastic.query_contact_id_batches(self.org, "name ~ bob", batch_size=1, slices=2)
+            next(batches)
+            batches.close()
+
+            for _ in range(50):
+                if mock_es.clear_scroll.call_count == 2:
+                    break
+                time.sleep(0.1)
+
+            self.assertEqual(2, mock_es.clear_scroll.call_count)
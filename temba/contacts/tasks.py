@@ -32,7 +32,7 @@ def release_contacts(user_id, contact_ids):
             contact.release(user)
 
 
-@shared_task(track_started=True)
+@shared_task(track_started=True, acks_late=True)
 def import_contacts_task(import_id):
     """
     Import contacts from a spreadsheet
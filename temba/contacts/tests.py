@@ -1,3 +1,4 @@
+import gzip
 import io
 import subprocess
 import time
@@ -8,6 +9,7 @@ from uuid import UUID
 
 import iso8601
 import pytz
+from django_redis import get_redis_connection
 from openpyxl import load_workbook
 
 from django.conf import settings
@@ -22,6 +24,7 @@ from django.urls import reverse
 from django.utils import timezone
 
 from temba.airtime.models import AirtimeTransfer
+from temba.assets.models import get_asset_store
 from temba.campaigns.models import Campaign, CampaignEvent, EventFire
 from temba.channels.models import Channel, ChannelEvent, ChannelLog
 from temba.contacts.search import SearchException, search_contacts
@@ -260,6 +263,63 @@ class ContactCRUDLTest(CRUDLTestMixin, TembaTest):
         joe.refresh_from_db()
         self.assertEqual(Contact.STATUS_ARCHIVED, joe.status)
 
+    @mock_mailroom
+    def test_list_page_anchors(self, mr_mocks):
+        self.login(self.user)
+        list_url = reverse("contacts.contact_list")
+
+        contacts = [self.create_contact(f"Contact {i}", phone=f"+25078812345{i}") for i in range(5)]
+
+        with patch("temba.contacts.views.ContactListView.paginate_by", 2):
+            # jumping straight to a page has to use an offset
+            response = self.client.get(list_url + "?page=2")
+            self.assertEqual([contacts[2], contacts[1]], list(response.context["object_list"]))
+            self.assertEqual(contacts[1].id, response.context["page_after"])
+            self.assertContains(response, f"page=3&_after={contacts[1].id}")
+
+            # but the next page link says where that page ended, so following it seeks from there and isn't thrown off
+            # by a new contact being created
+            self.create_contact("Newbie", phone="+250788123460")
+
+            response = self.client.get(list_url + f"?page=3&_after={contacts[1].id}")
+            self.assertEqual([contacts[0]], list(response.context["object_list"]))
+            self.assertEqual(6, response.context["paginator"].count)
+
+            # whereas jumping straight to the same page is still by offset
+            response = self.client.get(list_url + "?page=3")
+            self.assertEqual([contacts[1], contacts[0]], list(response.context["object_list"]))
+
+            # an invalid anchor is ignored
+            response = self.client.get(list_url + "?page=3&_after=xyz")
+            self.assertEqual([contacts[1], contacts[0]], list(response.context["object_list"]))
+
+            # same for searches, where the next page is fetched from elastic using search_after
+            mr_mocks.contact_search("Contact", contacts=[contacts[2], contacts[1]], total=5)
+
+            response = self.client.get(list_url + "?search=Contact&page=2")
+            self.assertEqual([contacts[2], contacts[1]], list(response.context["object_list"]))
+            self.assertEqual(contacts[1].id, response.context["page_after"])
+
+            with patch("temba.contacts.search.elastic.ES") as mock_es:
+                mock_es.search.return_value = {
+                    "_shards": {"failed": 0, "successful": 10, "total": 10},
+                    "timed_out": False,
+                    "took": 1,
+                    "hits": {"total": {"value": 5, "relation": "eq"}, "hits": [{"_source": {"id": contacts[0].id}}]},
+                }
+
+                response = self.client.get(list_url + f"?search=Contact&page=3&_after={contacts[1].id}")
+
+                self.assertEqual([contacts[0]], list(response.context["object_list"]))
+                self.assertEqual([contacts[1].id], mock_es.search.call_args.kwargs["body"]["search_after"])
+
+            # lists with a sort order aren't anchored
+            mr_mocks.contact_search("Contact", contacts=[contacts[0]], total=5)
+
+            response = self.client.get(list_url + f"?search=Contact&sort_on=created_on&page=3&_after={contacts[1].id}")
+            self.assertEqual([contacts[0]], list(response.context["object_list"]))
+            self.assertNotIn("page_after", response.context)
+
     @mock_mailroom
     def test_blocked(self, mr_mocks):
         joe = self.create_contact("Joe", urns=["twitter:joe"])
@@ -2552,6 +2612,50 @@ class ContactTest(TembaTest):
         self.assertContains(response, "unable to send email")
         self.assertContains(response, "this is a failure")
 
+    def test_get_session_events(self):
+        flow = self.get_flow("color_v13")
+        nodes = flow.get_definition()["nodes"]
+        (
+            MockSessionWriter(self.joe, flow)
+            .visit(nodes[0])
+            .set_contact_name("Joe")
+            .set_contact_language("spa")
+            .complete()
+            .save()
+        )
+
+        after = timezone.now() - timedelta(days=1)
+        before = timezone.now() + timedelta(days=1)
+        types = {"contact_name_changed", "contact_language_changed"}
+
+        # events are filtered by type and returned newest first
+        events = self.joe.get_session_events(after, before, types)
+        self.assertEqual(["contact_language_changed", "contact_name_changed"], [e["type"] for e in events])
+        self.assertEqual(2, len(self.joe.get_session_events(after, before, types | {"run_result_changed"})))
+        self.assertEqual([], self.joe.get_session_events(after, after + timedelta(seconds=1), types))
+
+        with override_settings(SESSION_EVENTS_CACHE_TTL=60):
+            session = self.joe.sessions.get()
+
+            # events of a session which hasn't ended aren't cached
+            with self.assertNumQueries(2):
+                self.assertEqual(2, len(self.joe.get_session_events(after, before, types)))
+            with self.assertNumQueries(2):
+                self.assertEqual(2, len(self.joe.get_session_events(after, before, types)))
+
+            session.ended_on = timezone.now()
+            session.save(update_fields=("ended_on",))
+
+            with self.assertNumQueries(2):
+                self.assertEqual(2, len(self.joe.get_session_events(after, before, types)))
+
+            # but once it has ended, they're cached and its output no longer needs loading
+            with self.assertNumQueries(1):
+                events = self.joe.get_session_events(after, before, types)
+
+            self.assertEqual(["contact_language_changed", "contact_name_changed"], [e["type"] for e in events])
+            self.assertEqual(str(session.uuid), events[0]["session_uuid"])
+
     def test_history_templatetags(self):
         item = {"type": "webhook_called", "url": "http://test.com", "status": "success"}
         self.assertEqual(history_class(item), "non-msg detail-event")
@@ -3925,7 +4029,7 @@ class ContactFieldTest(TembaTest):
             .save()
         )
 
-        # create another contact, this should sort before Ben
+        # create another contact, which is exported after Ben as exports are in id order
         contact2 = self.create_contact("Adam Sumner", urns=["tel:+12067799191", "twitter:adam"], language="eng")
         urns = [str(urn) for urn in contact2.get_urns()]
         urns.append("mailto:adam@sumner.com")
@@ -3992,21 +4096,6 @@ class ContactFieldTest(TembaTest):
                         "Field:Second",
                         "Group:Poppin Tags",
                     ],
-                    [
-                        contact2.uuid,
-                        "Adam Sumner",
-                        "eng",
-                        contact2.created_on,
-                        "",
-                        "adam@sumner.com",
-                        "+12067799191",
-                        "1234",
-                        "adam",
-                        "",
-                        "",
-                        "",
-                        True,
-                    ],
                     [
                         contact.uuid,
                         "Ben Haggerty",
@@ -4022,6 +4111,21 @@ class ContactFieldTest(TembaTest):
                         "",
                         True,
                     ],
+                    [
+                        contact2.uuid,
+                        "Adam Sumner",
+                        "eng",
+                        contact2.created_on,
+                        "",
+                        "adam@sumner.com",
+                        "+12067799191",
+                        "1234",
+                        "adam",
+                        "",
+                        "",
+                        "",
+                        True,
+                    ],
                 ],
                 tz=self.org.timezone,
             )
@@ -4057,21 +4161,6 @@ class ContactFieldTest(TembaTest):
                         "Field:First",
                         "Group:Poppin Tags",
                     ],
-                    [
-                        contact2.uuid,
-                        "Adam Sumner",
-                        "eng",
-                        contact2.created_on,
-                        "",
-                        "adam@sumner.com",
-                        "+12067799191",
-                        "1234",
-                        "adam",
-                        "",
-                        "",
-                        "",
-                        True,
-                    ],
                     [
                         contact.uuid,
                         "Ben Haggerty",
@@ -4087,6 +4176,21 @@ class ContactFieldTest(TembaTest):
                         "One",
                         True,
                     ],
+                    [
+                        contact2.uuid,
+                        "Adam Sumner",
+                        "eng",
+                        contact2.created_on,
+                        "",
+                        "adam@sumner.com",
+                        "+12067799191",
+                        "1234",
+                        "adam",
+                        "",
+                        "",
+                        "",
+                        True,
+                    ],
                 ],
                 tz=self.org.timezone,
             )
@@ -4119,22 +4223,6 @@ class ContactFieldTest(TembaTest):
                         "Field:First",
                         "Group:Poppin Tags",
                     ],
-                    [
-                        contact2.uuid,
-                        "Adam Sumner",
-                        "eng",
-                        contact2.created_on,
-                        "",
-                        "adam@sumner.com",
-                        "+12067799191",
-                        "",
-                        "1234",
-                        "adam",
-                        "",
-                        "",
-                        "",
-                        True,
-                    ],
                     [
                         contact.uuid,
                         "Ben Haggerty",
@@ -4151,6 +4239,22 @@ class ContactFieldTest(TembaTest):
                         "One",
                         True,
                     ],
+                    [
+                        contact2.uuid,
+                        "Adam Sumner",
+                        "eng",
+                        contact2.created_on,
+                        "",
+                        "adam@sumner.com",
+                        "+12067799191",
+                        "",
+                        "1234",
+                        "adam",
+                        "",
+                        "",
+                        "",
+                        True,
+                    ],
                     [
                         contact3.uuid,
                         "Luol Deng",
@@ -4209,22 +4313,6 @@ class ContactFieldTest(TembaTest):
                         "Field:First",
                         "Group:Poppin Tags",
                     ],
-                    [
-                        contact2.uuid,
-                        "Adam Sumner",
-                        "eng",
-                        contact2.created_on,
-                        "",
-                        "adam@sumner.com",
-                        "+12067799191",
-                        "",
-                        "1234",
-                        "adam",
-                        "",
-                        "",
-                        "",
-                        True,
-                    ],
                     [
                         contact.uuid,
                         "Ben Haggerty",
@@ -4241,6 +4329,22 @@ class ContactFieldTest(TembaTest):
                         "One",
                         True,
                     ],
+                    [
+                        contact2.uuid,
+                        "Adam Sumner",
+                        "eng",
+                        contact2.created_on,
+                        "",
+                        "adam@sumner.com",
+                        "+12067799191",
+                        "",
+                        "1234",
+                        "adam",
+                        "",
+                        "",
+                        "",
+                        True,
+                    ],
                 ],
                 tz=self.org.timezone,
             )
@@ -4385,19 +4489,6 @@ class ContactFieldTest(TembaTest):
                         "Field:First",
                         "Group:Poppin Tags",
                     ],
-                    [
-                        str(contact2.id),
-                        "tel",
-                        contact2.uuid,
-                        "Adam Sumner",
-                        "eng",
-                        contact2.created_on,
-                        "",
-                        "",
-                        "",
-                        "",
-                        True,
-                    ],
                     [
                         str(contact.id),
                         "tel",
@@ -4411,6 +4502,19 @@ class ContactFieldTest(TembaTest):
                         "One",
                         True,
                     ],
+                    [
+                        str(contact2.id),
+                        "tel",
+                        contact2.uuid,
+                        "Adam Sumner",
+                        "eng",
+                        contact2.created_on,
+                        "",
+                        "",
+                        "",
+                        "",
+                        True,
+                    ],
                     [
                         str(contact3.id),
                         "tel",
@@ -4442,6 +4546,55 @@ class ContactFieldTest(TembaTest):
             )
             assertImportExportedFile()
 
+    def test_contact_export_formats(self):
+        self.clear_storage()
+        self.login(self.admin)
+
+        contact = self.create_contact("Bob", phone="+250788000001")
+
+        # users can choose to export as a compressed CSV file
+        self.client.post(reverse("contacts.contact_export"), {"format": "csv.gz"})
+
+        export = ExportContactsTask.objects.get()
+        self.assertEqual("csv.gz", export.format)
+        self.assertEqual(ExportContactsTask.STATUS_COMPLETE, export.status)
+
+        path = f"{settings.MEDIA_ROOT}/test_orgs/{self.org.id}/contact_exports/{export.uuid}.csv.gz"
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+
+        self.assertTrue(lines[0].startswith("Contact UUID,Name,Language,Created On,Last Seen On,"))
+        self.assertTrue(any(line.startswith(f"{contact.uuid},Bob,,") for line in lines[1:]))
+
+        # and download it with its compound extension
+        asset, url, filename = get_asset_store(model=ExportContactsTask).resolve(self.admin, export.id)
+        self.assertTrue(filename.endswith(".csv.gz"))
+
+    def test_contact_export_batches(self):
+        bob = self.create_contact("Bob", phone="+250788000001")
+        nameless1 = self.create_contact(phone="+250788000002")
+        ann1 = self.create_contact("Ann", phone="+250788000003")
+        nameless2 = self.create_contact(phone="+250788000004")
+        ann2 = self.create_contact("Ann", phone="+250788000005")
+        Contact.objects.filter(id__in=[nameless1.id, nameless2.id]).update(name=None)
+
+        group = self.create_group("Export", contacts=[bob, nameless1, ann1, nameless2, ann2])
+        export = ExportContactsTask.create(self.org, self.admin, group=group)
+
+        # members are paged through in id order
+        with patch.object(ExportContactsTask, "BATCH_SIZE", 2):
+            batches, get_total = export._get_contact_id_batches(group)
+
+            self.assertEqual([[bob.id, nameless1.id], [ann1.id, nameless2.id], [ann2.id]], list(batches))
+            self.assertEqual(5, get_total())
+
+        # exactly filling the last page means one extra empty page query but no empty batch
+        with patch.object(ExportContactsTask, "BATCH_SIZE", 5):
+            batches, get_total = export._get_contact_id_batches(group)
+
+            with self.assertNumQueries(2):
+                self.assertEqual([[bob.id, nameless1.id, ann1.id, nameless2.id, ann2.id]], list(batches))
+
     def test_prepare_sort_field_struct(self):
         ward = self.create_field("ward", "Home Ward", value_type=ContactField.TYPE_WARD)
         district = self.create_field("district", "Home District", value_type=ContactField.TYPE_DISTRICT)
@@ -5984,6 +6137,78 @@ class ContactImportTest(TembaTest):
             batch = imp.batches.get()
             self.assertEqual(test[1], batch.specs[0]["name"])
 
+    @mock_mailroom
+    def test_start_resume(self, mr_mocks):
+        r = get_redis_connection()
+
+        with patch("temba.contacts.models.ContactImport.BATCH_SIZE", 1):
+            imp = self.create_contact_import("media/test_imports/simple.xlsx")
+            imp.start()
+
+            # each batch is queued as it's created
+            self.assertEqual(3, imp.batches.count())
+            self.assertEqual(3, len(mr_mocks.queued_batch_tasks))
+            self.assertEqual(b"3", r.get(f"contact_import_batches_remaining:{imp.id}"))
+
+            # starting again after parsing finished is a noop
+            imp.start()
+
+            self.assertEqual(3, imp.batches.count())
+            self.assertEqual(3, len(mr_mocks.queued_batch_tasks))
+
+            # every batch is recorded as queued
+            self.assertEqual(0, imp.batches.filter(queued_on=None).count())
+
+            # simulate being interrupted after the second batch was created but before it was queued
+            batch1, batch2, batch3 = imp.batches.order_by("id")
+            batch3.delete()
+            imp.batches.filter(id=batch2.id).update(queued_on=None)
+            r.delete(f"contact_import_parsed:{imp.id}")
+
+            imp.start()
+
+            # second batch is queued as it never was, first batch isn't queued again, and the third is recreated
+            batches = list(imp.batches.order_by("record_start"))
+            self.assertEqual([batch1, batch2], batches[:2])
+            self.assertEqual([(0, 1), (1, 2), (2, 3)], [(b.record_start, b.record_end) for b in batches])
+            self.assertEqual(
+                [batch2.id, batches[2].id],
+                [t["task"]["contact_import_batch_id"] for t in mr_mocks.queued_batch_tasks[3:]],
+            )
+            self.assertEqual(0, imp.batches.filter(queued_on=None).count())
+            self.assertEqual(b"3", r.get(f"contact_import_batches_remaining:{imp.id}"))
+
+            # starting while another task holds the lock is a noop
+            r.delete(f"contact_import_parsed:{imp.id}")
+            batches[2].delete()
+
+            with r.lock(f"contact_import_start:{imp.id}", timeout=5):
+                imp.start()
+
+            self.assertEqual(2, imp.batches.count())
+            self.assertEqual(5, len(mr_mocks.queued_batch_tasks))
+
+            imp.start()
+
+            self.assertEqual(3, imp.batches.count())
+            self.assertEqual(6, len(mr_mocks.queued_batch_tasks))
+
+            # simulate an import which was predicted to have 4 batches, being interrupted after all its 3 actual
+            # batches were created, and mailroom then handling those
+            imp.batches.update(status=ContactImport.STATUS_COMPLETE)
+            r.delete(f"contact_import_parsed:{imp.id}")
+            r.set(f"contact_import_batches_remaining:{imp.id}", 1)
+            ContactImport.objects.filter(id=imp.id).update(num_records=4)
+            imp.refresh_from_db()
+
+            imp.start()
+
+            # the remaining count is corrected, and as it's now zero, we have to mark the import as complete
+            self.assertEqual(b"0", r.get(f"contact_import_batches_remaining:{imp.id}"))
+            self.assertEqual(ContactImport.STATUS_COMPLETE, imp.status)
+            self.assertIsNotNone(imp.finished_on)
+            self.assertEqual(1, imp.notifications.filter(notification_type="import:finished").count())
+
     @mock_mailroom
     def test_detect_spamminess(self, mr_mocks):
         imp = self.create_contact_import("media/test_imports/sequential_tels.xls")
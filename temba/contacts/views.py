@@ -48,6 +48,7 @@ from temba.orgs.views import (
 from temba.tickets.models import Ticket
 from temba.utils import analytics, json, languages, on_transaction_commit
 from temba.utils.dates import datetime_to_timestamp, timestamp_to_datetime
+from temba.utils.export import TableExporter
 from temba.utils.fields import (
     CheckboxWidget,
     InputWidget,
@@ -70,7 +71,7 @@ from .models import (
     ContactURN,
     ExportContactsTask,
 )
-from .search import SearchException, parse_query, search_contacts
+from .search import SearchException, elastic, parse_query, search_contacts
 from .search.omnibox import omnibox_query, omnibox_results_to_dict
 from .tasks import export_contacts_task
 
@@ -284,13 +285,16 @@ class ContactListView(SpaMixin, OrgPermsMixin, BulkActionMixin, SmartListView):
         # contact list views don't use regular field searching but use more complex contact searching
         search_query = self.request.GET.get("search", None)
         sort_on = self.request.GET.get("sort_on", "")
-        page = self.request.GET.get("page", "1")
+        page = int(self.request.GET.get("page", "1"))
 
-        offset = (int(page) - 1) * self.paginate_by
+        offset = (page - 1) * self.paginate_by
 
         self.sort_direction = "desc" if sort_on.startswith("-") else "asc"
         self.sort_field = sort_on.lstrip("-")
 
+        # if the request tells us where the previous page ended, we can seek from there
+        anchor = self.get_page_anchor() if page > 1 else None
+
         if search_query or sort_on:
             # is this request is part of a bulk action, get the ids that were modified so we can check which ones
             # should no longer appear in this view, even though ES won't have caught up yet
@@ -302,13 +306,25 @@ class ContactListView(SpaMixin, OrgPermsMixin, BulkActionMixin, SmartListView):
                 exclude_ids = []
 
             try:
-                results = search_contacts(
-                    org, search_query, group=self.group, sort=sort_on, offset=offset, exclude_ids=exclude_ids
-                )
-                self.parsed_query = results.query if len(results.query) > 0 else None
-                self.save_dynamic_search = results.metadata.allow_as_group
+                if anchor:
+                    parsed, contact_ids, total = elastic.query_contact_ids_after(
+                        org,
+                        search_query,
+                        group=self.group,
+                        after_id=anchor,
+                        size=self.paginate_by,
+                        exclude_ids=exclude_ids,
+                    )
+                else:
+                    results = search_contacts(
+                        org, search_query, group=self.group, sort=sort_on, offset=offset, exclude_ids=exclude_ids
+                    )
+                    parsed, contact_ids, total = results, results.contact_ids, results.total
 
-                return IDSliceQuerySet(Contact, results.contact_ids, offset=offset, total=results.total)
+                self.parsed_query = parsed.query if len(parsed.query) > 0 else None
+                self.save_dynamic_search = parsed.metadata.allow_as_group
+
+                return IDSliceQuerySet(Contact, contact_ids, offset=offset, total=total)
             except SearchException as e:
                 self.search_error = str(e)
 
@@ -316,10 +332,31 @@ class ContactListView(SpaMixin, OrgPermsMixin, BulkActionMixin, SmartListView):
                 return Contact.objects.none()
         else:
             # if user search is not defined, use DB to select contacts
-            qs = self.group.contacts.filter(org=self.request.org).order_by("-id").prefetch_related("org", "groups")
+            qs = self.group.contacts.filter(org=self.request.org).order_by("-id")
+
+            if anchor:
+                contact_ids = list(qs.filter(id__lt=anchor).values_list("id", flat=True)[: self.paginate_by])
+                return IDSliceQuerySet(
+                    Contact, contact_ids, offset=offset, total=self.group.get_member_count()
+                ).prefetch_related("org", "groups")
+
+            qs = qs.prefetch_related("org", "groups")
             patch_queryset_count(qs, self.group.get_member_count)
             return qs
 
+    def get_page_anchor(self) -> int:
+        """
+        Gets the id of the last contact on the previous page if the request includes it, as it does when following the
+        next page link. Only lists in the default order are anchored as seeking needs a unique sort key.
+        """
+        if self.request.GET.get("sort_on"):
+            return None
+
+        try:
+            return int(self.request.GET.get("_after", "")) or None
+        except ValueError:
+            return None
+
     def get_bulk_action_labels(self):
         return ContactGroup.get_groups(self.get_user().get_org(), manual_only=True)
 
@@ -332,6 +369,10 @@ class ContactListView(SpaMixin, OrgPermsMixin, BulkActionMixin, SmartListView):
         contacts = context["object_list"]
         Contact.bulk_urn_cache_initialize(contacts)
 
+        # let the next page link tell us where this page ended
+        if contacts and not self.request.GET.get("sort_on"):
+            context["page_after"] = list(contacts)[-1].id
+
         system_groups, smart_groups, manual_groups = self.get_groups(org)
 
         context["contacts"] = contacts
@@ -532,6 +573,15 @@ class ExportForm(Form):
         ),
     )
 
+    format = forms.ChoiceField(
+        choices=TableExporter.FORMAT_CHOICES,
+        initial=TableExporter.FORMAT_XLSX,
+        required=False,
+        label=_("Format"),
+        widget=SelectWidget(),
+        help_text=_("CSV files can be much larger than Excel supports and are quicker to export."),
+    )
+
     def __init__(self, user, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user = user
@@ -711,6 +761,7 @@ class ContactCRUDL(SmartCRUDL):
                 )
             else:
                 group_memberships = form.cleaned_data["group_memberships"]
+                format = form.cleaned_data["format"] or TableExporter.FORMAT_XLSX
 
                 group = org.groups.filter(uuid=group_uuid).first() if group_uuid else None
 
@@ -722,7 +773,7 @@ class ContactCRUDL(SmartCRUDL):
                 ):  # pragma: needs cover
                     analytics.track(self.request.user, "temba.contact_exported")
 
-                export = ExportContactsTask.create(org, user, group, search, group_memberships)
+                export = ExportContactsTask.create(org, user, group, search, group_memberships, format=format)
 
                 # schedule the export job
                 on_transaction_commit(lambda: export_contacts_task.delay(export.pk))
@@ -0,0 +1,35 @@
+# Generated by Django 4.0.4 on 2022-06-20 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flows", "0292_exportflowresultstask_stats"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FlowActivityCount",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False)),
+                ("is_squashed", models.BooleanField(default=False)),
+                ("from_uuid", models.UUIDField()),
+                ("count_type", models.CharField(max_length=1)),
+                ("period", models.DateTimeField()),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "flow",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT, related_name="activity_counts", to="flows.flow"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="flowactivitycount",
+            index=models.Index(fields=["flow", "count_type", "from_uuid", "period"], name="flows_activitycount_type"),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.0.4 on 2022-06-20 09:15
+
+from django.db import connection, migrations
+
+# rolls up the squashed path counts of a flow, leaving unsquashed counts to be rolled up when they're squashed
+ROLLUP_SQL = """
+INSERT INTO flows_flowactivitycount("flow_id", "from_uuid", "count_type", "period", "count", "is_squashed")
+SELECT p."flow_id", p."from_uuid", b."count_type", b."period", GREATEST(0, SUM(p."count")), TRUE
+FROM flows_flowpathcount p CROSS JOIN LATERAL (VALUES
+    ('H', date_trunc('hour', p."period")),
+    ('D', date_trunc('day', p."period")),
+    ('W', date_trunc('week', p."period")),
+    ('h', TIMESTAMPTZ '1970-01-01 00:00Z' + make_interval(hours => extract(hour from p."period"::timestamp)::int)),
+    ('d', TIMESTAMPTZ '1970-01-04 00:00Z' + make_interval(days => extract(dow from p."period"::timestamp)::int))
+) AS b("count_type", "period")
+WHERE p."flow_id" = %s AND p."is_squashed" = TRUE
+GROUP BY 1, 2, 3, 4
+"""
+
+
+def populate_flow_activity_counts(apps, schema_editor):
+    Flow = apps.get_model("flows", "Flow")
+
+    flow_ids = list(Flow.objects.order_by("id").values_list("id", flat=True))
+    num_populated = 0
+
+    for flow_id in flow_ids:
+        with connection.cursor() as cursor:
+            cursor.execute(ROLLUP_SQL, (flow_id,))
+
+        num_populated += 1
+        if num_populated % 1000 == 0:
+            print(f"Populated activity counts for {num_populated} of {len(flow_ids)} flows")
+
+
+def reverse(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flows", "0293_flowactivitycount"),
+    ]
+
+    operations = [migrations.RunPython(populate_flow_activity_counts, reverse)]
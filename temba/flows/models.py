@@ -2,6 +2,7 @@ import logging
 import time
 from array import array
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import iso8601
@@ -33,6 +34,7 @@ from temba.orgs.models import DependencyMixin, Org
 from temba.templates.models import Template
 from temba.tickets.models import Ticketer, Topic
 from temba.utils import analytics, chunk_list, json, on_transaction_commit, s3
+from temba.utils.dates import datetime_to_timestamp
 from temba.utils.export import BaseExportAssetStore, BaseExportTask
 from temba.utils.models import JSONAsTextField, JSONField, LegacyUUIDMixin, SquashableModel, TembaModel
 from temba.utils.uuid import uuid4
@@ -42,6 +44,34 @@ from . import legacy
 logger = logging.getLogger(__name__)
 
 
+def _map_concurrently(func, items: list) -> list:
+    """
+    Maps the given function over the given items using a bounded pool of threads, so func mustn't use the database
+    """
+    if len(items) <= 1:
+        return [func(i) for i in items]
+
+    with ThreadPoolExecutor(max_workers=settings.FLOW_IMPORT_WORKERS) as executor:
+        return list(executor.map(func, items))
+
+
+class _PhaseTimer:
+    """
+    Logs and records how long each phase of an operation takes
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.last = time.perf_counter()
+
+    def done(self, phase: str):
+        now = time.perf_counter()
+        elapsed, self.last = now - self.last, now
+
+        logger.info(f"{self.name} phase '{phase}' took {elapsed:.3f}s")
+        analytics.gauge(f"temba.{self.name}_{phase}_time", elapsed)
+
+
 class FlowException(Exception):
     pass
 
@@ -60,6 +90,18 @@ class FlowVersionConflictException(FlowException):
 FLOW_LOCK_TTL = 60  # 1 minute
 FLOW_LOCK_KEY = "org:%d:lock:flow:%d:definition"
 
+FLOW_DEFINITION_CACHE_KEY = "org:%d:cache:flow:%d:definition"
+
+# sets a cached flow definition unless a later revision is already cached
+FLOW_DEFINITION_CACHE_SET = """
+local cached_revision = tonumber(redis.call('get', KEYS[2]) or '0')
+if tonumber(ARGV[1]) >= cached_revision then
+  redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+  redis.call('set', KEYS[2], ARGV[1], 'EX', ARGV[3])
+end
+"""
+FLOW_MIGRATED_CACHE_KEY = "org:%d:cache:flow:%d:migrated:%d:%s"
+
 
 class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
     CONTACT_CREATION = "contact_creation"
@@ -370,9 +412,35 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
             dependency_mapping[flow_uuid] = str(flow.uuid)
             created_flows.append((flow, flow_def))
 
-        # import each definition (includes re-mapping dependency references)
-        for flow, definition in created_flows:
-            flow.import_definition(user, definition, dependency_mapping)
+        # import each definition (includes re-mapping dependency references). Requests to mailroom don't depend on the
+        # database so are made concurrently for all flows, in between the phases which have to run sequentially.
+        client = mailroom.get_client()
+        timer = _PhaseTimer("flow_import")
+
+        def migrate_and_inspect(definition: dict) -> tuple:
+            definition = Flow.migrate_definition(definition, flow=None)
+            return definition, client.flow_inspect(org.id, definition)
+
+        flows = [f for f, d in created_flows]
+        inspected = _map_concurrently(migrate_and_inspect, [d for f, d in created_flows])
+        timer.done("inspect")
+
+        for flow, (definition, flow_info) in zip(flows, inspected):
+            flow.resolve_import_dependencies(user, flow_info[Flow.INSPECT_DEPENDENCIES], dependency_mapping)
+        timer.done("dependencies")
+
+        def clone_and_inspect(definition: dict) -> tuple:
+            cloned = Flow.clone_definition(definition, dependency_mapping)
+            return cloned, client.flow_inspect(org.id, cloned)
+
+        cloned = _map_concurrently(clone_and_inspect, [d for d, i in inspected])
+        timer.done("clone")
+
+        # save new revisions, which we can't validate just yet because we're in a transaction and mailroom won't see
+        # any new database objects
+        for flow, (definition, flow_info) in zip(flows, cloned):
+            flow.save_revision(user, definition, flow_info=flow_info)
+        timer.done("save")
 
         # remap flow UUIDs in any campaign events
         for campaign in export_json.get("campaigns", []):
@@ -390,7 +458,7 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
                     trigger["flow"]["uuid"] = dependency_mapping[flow_uuid]
 
         # return the created flows
-        return [f[0] for f in created_flows]
+        return flows
 
     @classmethod
     def is_valid_expires(cls, flow_type: str, expires: int) -> bool:
@@ -553,7 +621,18 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         definition = Flow.migrate_definition(definition, flow=None)
 
         flow_info = mailroom.get_client().flow_inspect(self.org.id, definition)
-        dependencies = flow_info[Flow.INSPECT_DEPENDENCIES]
+
+        self.resolve_import_dependencies(user, flow_info[Flow.INSPECT_DEPENDENCIES], dependency_mapping)
+
+        # save a new revision but we can't validate it just yet because we're in a transaction and mailroom
+        # won't see any new database objects
+        self.save_revision(user, Flow.clone_definition(definition, dependency_mapping))
+
+    def resolve_import_dependencies(self, user, dependencies: list, dependency_mapping: dict):
+        """
+        Ensures that the given dependencies of an imported definition exist in this flow's workspace, creating them
+        where possible, and adds their UUIDs in this workspace to the given mapping.
+        """
 
         # converts a dep ref {uuid|key, name, type, missing} to an importable partial definition {uuid|key, name}
         def ref_to_def(r: dict) -> dict:
@@ -608,14 +687,24 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
 
                 dependency_mapping[ref["uuid"]] = str(obj.uuid) if obj else ref["uuid"]
 
-        # clone definition so that all flow elements get new random UUIDs
+    @classmethod
+    def clone_definition(cls, definition: dict, dependency_mapping: dict) -> dict:
+        """
+        Clones the given definition so that all flow elements get new random UUIDs and dependencies are remapped
+        """
         cloned_definition = mailroom.get_client().flow_clone(definition, dependency_mapping)
         if "revision" in cloned_definition:
             del cloned_definition["revision"]
 
-        # save a new revision but we can't validate it just yet because we're in a transaction and mailroom
-        # won't see any new database objects
-        self.save_revision(user, cloned_definition)
+        return cloned_definition
+
+    @classmethod
+    def inspect_definitions(cls, org, definitions: list) -> list:
+        """
+        Inspects the given definitions concurrently, returning their flow info in the same order
+        """
+        client = mailroom.get_client()
+        return _map_concurrently(lambda d: client.flow_inspect(org.id, d), definitions)
 
     def archive(self, user):
         self.is_archived = True
@@ -666,7 +755,18 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         self.save_revision(user, definition)
 
     def get_run_stats(self):
-        totals_by_exit = FlowRunCount.get_totals(self)
+        return self._get_run_stats(FlowRunCount.get_totals(self))
+
+    @classmethod
+    def get_run_stats_by_flow(cls, flows) -> dict:
+        """
+        Gets the run stats of multiple flows in a single query
+        """
+        totals_by_flow = FlowRunCount.get_totals_by_flow(flows)
+        return {flow: cls._get_run_stats(totals_by_flow.get(flow.id, {})) for flow in flows}
+
+    @staticmethod
+    def _get_run_stats(totals_by_exit: dict) -> dict:
         total_runs = sum(totals_by_exit.values())
         completed = totals_by_exit.get(FlowRun.EXIT_TYPE_COMPLETED, 0)
 
@@ -786,36 +886,72 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         """
         Returns the current definition of this flow
         """
-        rev = self.get_current_revision()
-
-        assert rev, "can't get definition of flow with no revisions"
+        revision, definition = self._get_current_definition()
 
         # update metadata in definition from database object as it may be out of date
-        definition = rev.definition
-
         if self.is_legacy():
             if "metadata" not in definition:
                 definition["metadata"] = {}
             definition["metadata"]["uuid"] = self.uuid
             definition["metadata"]["name"] = self.name
-            definition["metadata"]["revision"] = rev.revision
+            definition["metadata"]["revision"] = revision
             definition["metadata"]["expires"] = self.expires_after_minutes
         else:
             definition[Flow.DEFINITION_UUID] = self.uuid
             definition[Flow.DEFINITION_NAME] = self.name
-            definition[Flow.DEFINITION_REVISION] = rev.revision
+            definition[Flow.DEFINITION_REVISION] = revision
             definition[Flow.DEFINITION_EXPIRE_AFTER_MINUTES] = self.expires_after_minutes
         return definition
 
+    def _get_current_definition(self) -> tuple:
+        """
+        Gets the number and definition of the last saved revision, which are cached until a new revision is saved
+        """
+        cache_ttl = settings.FLOW_DEFINITION_CACHE_TTL
+
+        if cache_ttl:
+            cached = get_redis_connection().get(FLOW_DEFINITION_CACHE_KEY % (self.org_id, self.id))
+            if cached is not None:
+                cached = json.loads(cached)
+                return cached["revision"], cached["definition"]
+
+        rev = self.get_current_revision()
+
+        assert rev, "can't get definition of flow with no revisions"
+
+        if cache_ttl:
+            self._cache_definition(rev.revision, rev.definition)
+
+        return rev.revision, rev.definition
+
+    def _cache_definition(self, revision: int, definition: dict):
+        """
+        Caches the given revision as the current definition, unless a later revision has already been cached. That way
+        a reader which loaded a revision before a new one was saved can't replace the new one in the cache.
+        """
+        cache_key = FLOW_DEFINITION_CACHE_KEY % (self.org_id, self.id)
+        value = {"revision": revision, "definition": definition}
+
+        get_redis_connection().eval(
+            FLOW_DEFINITION_CACHE_SET,
+            2,
+            cache_key,
+            f"{cache_key}:revision",
+            revision,
+            json.dumps(value),
+            settings.FLOW_DEFINITION_CACHE_TTL,
+        )
+
     def get_current_revision(self):
         """
         Returns the last saved revision for this flow if any
         """
         return self.revisions.order_by("revision").last()
 
-    def save_revision(self, user, definition) -> tuple:
+    def save_revision(self, user, definition, flow_info: dict = None) -> tuple:
         """
-        Saves a new revision for this flow, validation will be done on the definition first
+        Saves a new revision for this flow, validation will be done on the definition first unless the flow info from
+        inspecting it is provided
         """
         if Version(definition.get(Flow.DEFINITION_SPEC_VERSION)) < Version(Flow.INITIAL_GOFLOW_VERSION):
             raise FlowVersionConflictException(definition.get(Flow.DEFINITION_SPEC_VERSION))
@@ -839,7 +975,9 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
         definition[Flow.DEFINITION_EXPIRE_AFTER_MINUTES] = self.expires_after_minutes
 
         # inspect the flow (with optional validation)
-        flow_info = mailroom.get_client().flow_inspect(self.org.id, definition)
+        if flow_info is None:
+            flow_info = mailroom.get_client().flow_inspect(self.org.id, definition)
+
         dependencies = flow_info[Flow.INSPECT_DEPENDENCIES]
         issues = flow_info[Flow.INSPECT_ISSUES]
 
@@ -883,6 +1021,9 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
 
             self.update_dependencies(dependencies)
 
+            if settings.FLOW_DEFINITION_CACHE_TTL:
+                on_transaction_commit(lambda: self._cache_definition(revision.revision, revision.definition))
+
         return revision, issues
 
     @classmethod
@@ -1046,6 +1187,7 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
 
         self.category_counts.all().delete()
         self.path_counts.all().delete()
+        self.activity_counts.all().delete()
         self.node_counts.all().delete()
         self.exit_counts.all().delete()
         self.labels.clear()
@@ -1079,6 +1221,8 @@ class FlowSession(models.Model):
         (STATUS_FAILED, "Failed"),
     )
 
+    EVENTS_CACHE_KEY = "session_events:%d"
+
     id = models.BigAutoField(primary_key=True)
     uuid = models.UUIDField(unique=True)
     org = models.ForeignKey(Org, related_name="sessions", on_delete=models.PROTECT)
@@ -1126,6 +1270,47 @@ class FlowSession(models.Model):
         else:
             return self.output
 
+    @classmethod
+    def get_events(cls, sessions) -> dict:
+        """
+        Gets the events of the given sessions as a map of session id to a list of (microsecond timestamp, event) tuples.
+        Ended sessions can't change so their events are cached, and only sessions whose events aren't cached have their
+        output loaded.
+        """
+        cache_ttl = settings.SESSION_EVENTS_CACHE_TTL
+        if not cache_ttl:
+            return {s.id: s._extract_events() for s in sessions}
+
+        r = get_redis_connection()
+        sessions = list(sessions.only("id", "ended_on"))
+        ended_ids = [s.id for s in sessions if s.ended_on]
+        events = {}
+
+        if ended_ids:
+            cached = r.mget([cls.EVENTS_CACHE_KEY % i for i in ended_ids])
+            events = {i: json.loads(c) for i, c in zip(ended_ids, cached) if c is not None}
+
+        to_load = [s.id for s in sessions if s.id not in events]
+        if to_load:
+            pipe = r.pipeline()
+
+            for session in cls.objects.filter(id__in=to_load):
+                events[session.id] = session._extract_events()
+                if session.ended_on:
+                    pipe.set(cls.EVENTS_CACHE_KEY % session.id, json.dumps(events[session.id]), ex=cache_ttl)
+
+            pipe.execute()
+
+        return events
+
+    def _extract_events(self) -> list:
+        events = []
+        for run in self.output_json.get("runs", []):
+            for event in run.get("events", []):
+                event["session_uuid"] = str(self.uuid)
+                events.append((datetime_to_timestamp(iso8601.parse_date(event["created_on"])), event))
+        return events
+
     def delete(self):
         for run in self.runs.all():
             run.delete()
@@ -1444,7 +1629,7 @@ class FlowRevision(SmartModel):
 
         # migrate our definition if necessary
         if self.spec_version != to_version:
-            definition = Flow.migrate_definition(definition, self.flow, to_version)
+            definition = self._migrate_definition(definition, to_version)
 
         # update variables from our db into our revision
         flow = self.flow
@@ -1455,6 +1640,26 @@ class FlowRevision(SmartModel):
 
         return definition
 
+    def _migrate_definition(self, definition: dict, to_version: str) -> dict:
+        """
+        Migrates the given definition of this revision to the given version. Revisions don't change so the results are
+        cached by flow, revision number and version.
+        """
+        cache_ttl = settings.FLOW_DEFINITION_CACHE_TTL
+        if not cache_ttl:
+            return Flow.migrate_definition(definition, self.flow, to_version)
+
+        r = get_redis_connection()
+        cache_key = FLOW_MIGRATED_CACHE_KEY % (self.flow.org_id, self.flow_id, self.revision, to_version)
+
+        cached = r.get(cache_key)
+        if cached is not None:
+            return json.loads(cached)
+
+        migrated = Flow.migrate_definition(definition, self.flow, to_version)
+        r.set(cache_key, json.dumps(migrated), ex=cache_ttl)
+        return migrated
+
     def as_json(self):
         name = self.created_by.get_full_name()
         return dict(
@@ -1545,17 +1750,22 @@ class FlowPathCount(SquashableModel):
     def get_squash_query(cls, distinct_set):
         sql = """
         WITH removed as (
-            DELETE FROM %(table)s WHERE "flow_id" = %%s AND "from_uuid" = %%s AND "to_uuid" = %%s AND "period" = date_trunc('hour', %%s) RETURNING "count"
-        )
+            DELETE FROM %(table)s WHERE "flow_id" = %%s AND "from_uuid" = %%s AND "to_uuid" = %%s AND "period" = date_trunc('hour', %%s) RETURNING "flow_id", "from_uuid", "period", "count", "is_squashed"
+        )%(rollups)s
         INSERT INTO %(table)s("flow_id", "from_uuid", "to_uuid", "period", "count", "is_squashed")
         VALUES (%%s, %%s, %%s, date_trunc('hour', %%s), GREATEST(0, (SELECT SUM("count") FROM removed)), TRUE);
         """ % {
-            "table": cls._meta.db_table
+            "table": cls._meta.db_table,
+            "rollups": cls._get_rollup_ctes(),
         }
 
         params = (distinct_set.flow_id, distinct_set.from_uuid, distinct_set.to_uuid, distinct_set.period) * 2
         return sql, params
 
+    @classmethod
+    def get_squash_rollups(cls) -> tuple:
+        return (FlowActivityCount.get_rollup_sql(),)
+
     @classmethod
     def get_totals(cls, flow):
         counts = cls.objects.filter(flow=flow)
@@ -1566,12 +1776,84 @@ class FlowPathCount(SquashableModel):
         index_together = ["flow", "from_uuid", "to_uuid", "period"]
 
 
+class FlowActivityCount(SquashableModel):
+    """
+    Maintains rollups of flow path counts by the exit they start from. These are updated as path counts are squashed
+    so that activity charts don't have to aggregate over every path count of a flow.
+    """
+
+    TYPE_HOUR = "H"
+    TYPE_DAY = "D"
+    TYPE_WEEK = "W"
+    TYPE_HOUR_OF_DAY = "h"  # period is that hour of 1970-01-01
+    TYPE_DAY_OF_WEEK = "d"  # period is that day of the week starting Sunday 1970-01-04
+
+    DAY_OF_WEEK_EPOCH = datetime(1970, 1, 4, tzinfo=pytz.UTC)
+
+    squash_over = ("flow_id", "from_uuid", "count_type", "period")
+
+    flow = models.ForeignKey(Flow, on_delete=models.PROTECT, related_name="activity_counts")
+
+    # the exit UUID of the node the counted path segments start with
+    from_uuid = models.UUIDField()
+
+    count_type = models.CharField(max_length=1)
+
+    # the bucket this activity falls into
+    period = models.DateTimeField()
+
+    count = models.IntegerField(default=0)
+
+    @classmethod
+    def get_rollup_sql(cls) -> str:
+        """
+        Gets the SQL which inserts rollups of the path counts in a "deltas" relation
+        """
+        return f"""
+        INSERT INTO {cls._meta.db_table}("flow_id", "from_uuid", "count_type", "period", "count", "is_squashed")
+        SELECT d."flow_id", d."from_uuid", b."count_type", b."period", SUM(d."count"), FALSE
+        FROM deltas d CROSS JOIN LATERAL (VALUES
+            ('{cls.TYPE_HOUR}', date_trunc('hour', d."period")),
+            ('{cls.TYPE_DAY}', date_trunc('day', d."period")),
+            ('{cls.TYPE_WEEK}', date_trunc('week', d."period")),
+            ('{cls.TYPE_HOUR_OF_DAY}', TIMESTAMPTZ '1970-01-01 00:00Z' + make_interval(hours => extract(hour from d."period"::timestamp)::int)),
+            ('{cls.TYPE_DAY_OF_WEEK}', TIMESTAMPTZ '1970-01-04 00:00Z' + make_interval(days => extract(dow from d."period"::timestamp)::int))
+        ) AS b("count_type", "period")
+        GROUP BY 1, 2, 3, 4
+        """
+
+    @classmethod
+    def get_squash_query(cls, distinct_set):
+        sql = f"""
+        WITH removed as (
+            DELETE FROM {cls._meta.db_table} WHERE "flow_id" = %s AND "from_uuid" = %s AND "count_type" = %s AND "period" = %s RETURNING "count"
+        )
+        INSERT INTO {cls._meta.db_table}("flow_id", "from_uuid", "count_type", "period", "count", "is_squashed")
+        VALUES (%s, %s, %s, %s, GREATEST(0, (SELECT SUM("count") FROM removed)), TRUE);
+        """
+
+        params = (distinct_set.flow_id, distinct_set.from_uuid, distinct_set.count_type, distinct_set.period) * 2
+        return sql, params
+
+    @classmethod
+    def get_day_of_week(cls, period) -> int:
+        """
+        Gets the day of the week (0 = Sunday) of a day of the week count period
+        """
+        return (period - cls.DAY_OF_WEEK_EPOCH).days
+
+    class Meta:
+        indexes = [
+            models.Index(name="flows_activitycount_type", fields=("flow", "count_type", "from_uuid", "period")),
+        ]
+
+
 class FlowNodeCount(SquashableModel):
     """
     Maintains counts of unique contacts at each flow node.
     """
 
-    squash_over = ("node_uuid",)
+    squash_over = ("flow_id", "node_uuid")
 
     flow = models.ForeignKey(Flow, on_delete=models.PROTECT, related_name="node_counts")
 
@@ -1651,6 +1933,23 @@ class FlowRunCount(SquashableModel):
         totals = list(cls.objects.filter(flow=flow).values_list("exit_type").annotate(replies=Sum("count")))
         return {t[0]: t[1] for t in totals}
 
+    @classmethod
+    def get_totals_by_flow(cls, flows) -> dict:
+        """
+        Gets the totals by exit type for each of the given flows as a dict of flow ids to dicts of totals
+        """
+        totals = (
+            cls.objects.filter(flow__in=flows)
+            .values_list("flow_id", "exit_type")
+            .annotate(replies=Sum("count"))
+            .order_by()
+        )
+
+        totals_by_flow = defaultdict(dict)
+        for flow_id, exit_type, count in totals:
+            totals_by_flow[flow_id][exit_type] = count
+        return totals_by_flow
+
     class Meta:
         index_together = ("flow", "exit_type")
 
@@ -1832,7 +2131,14 @@ class ExportFlowResultsTask(BaseExportTask):
         where = {"flow__uuid__in": flow_uuids}
         if responded_only:
             where["responded"] = True
-        records = Archive.iter_all_records(self.org, Archive.TYPE_FLOWRUN, after=earliest_created_on, where=where)
+        records = Archive.iter_all_records(
+            self.org,
+            Archive.TYPE_FLOWRUN,
+            after=earliest_created_on,
+            where=where,
+            prefetch=settings.ARCHIVE_PREFETCH,
+            prefetch_max_size=settings.ARCHIVE_PREFETCH_MAX_SIZE,
+        )
         seen = set()
 
         for record_batch in chunk_list(records, 1000):
@@ -1877,15 +2183,12 @@ class ExportFlowResultsTask(BaseExportTask):
         """
         Writes a batch of run JSON blobs to the export
         """
-        # get all the contacts referenced in this batch
+        # get the contact columns for all the contacts referenced in this batch
         contact_uuids = {r["contact"]["uuid"] for r in runs}
-        contacts = (
-            Contact.objects.filter(org=self.org, uuid__in=contact_uuids).prefetch_related("groups").using("readonly")
-        )
-        contacts_by_uuid = {str(c.uuid): c for c in contacts}
+        contact_values_by_uuid = self._get_contact_values(contact_uuids, extra_urn_columns, groups, contact_fields)
 
         for run in runs:
-            contact = contacts_by_uuid.get(run["contact"]["uuid"])
+            contact_values = contact_values_by_uuid.get(run["contact"]["uuid"])
 
             # get this run's results by node name(ruleset label)
             run_values = run["values"]
@@ -1894,29 +2197,6 @@ class ExportFlowResultsTask(BaseExportTask):
             else:
                 results_by_key = {key: result for key, result in run_values.items()}
 
-            # generate contact info columns
-            contact_values = [contact.uuid]
-
-            if self.org.is_anon:
-                contact_urns = contact.get_urns()
-                contact_values.append(f"{contact.id:010d}")
-                contact_values.append(contact_urns[0].scheme if contact_urns else "")
-            else:
-                contact_values.append(contact.get_urn_display(org=self.org, formatted=False))
-
-            for extra_urn_column in extra_urn_columns:
-                urn_display = contact.get_urn_display(org=self.org, formatted=False, scheme=extra_urn_column["scheme"])
-                contact_values.append(urn_display)
-
-            contact_values.append(self.prepare_value(contact.name))
-            contact_groups_ids = [g.id for g in contact.groups.all()]
-            for gr in groups:
-                contact_values.append(gr.id in contact_groups_ids)
-
-            for cf in contact_fields:
-                field_value = contact.get_field_display(cf)
-                contact_values.append(self.prepare_value(field_value))
-
             # generate result columns for each ruleset
             result_values = []
             for n, result_field in enumerate(result_fields):
@@ -1949,6 +2229,55 @@ class ExportFlowResultsTask(BaseExportTask):
 
             self.append_row(book.current_runs_sheet, runs_sheet_row)
 
+    def _get_contact_values(self, contact_uuids, extra_urn_columns, groups, contact_fields) -> dict:
+        """
+        Loads the given contacts with their URNs and memberships of the exported groups in a fixed number of queries,
+        and returns the values of their contact columns by contact UUID
+        """
+        contacts = list(Contact.objects.filter(org=self.org, uuid__in=contact_uuids).using("readonly"))
+
+        for contact in contacts:
+            contact.org = self.org  # avoid fetching the org for every contact
+
+        Contact.bulk_urn_cache_initialize(contacts, using="readonly")
+
+        group_ids_by_contact = defaultdict(set)
+        if groups and contacts:
+            memberships = ContactGroup.contacts.through.objects.using("readonly").filter(
+                contact_id__in=[c.id for c in contacts], contactgroup_id__in=[g.id for g in groups]
+            )
+            for contact_id, group_id in memberships.values_list("contact_id", "contactgroup_id"):
+                group_ids_by_contact[contact_id].add(group_id)
+
+        values_by_uuid = {}
+        for contact in contacts:
+            values = [contact.uuid]
+
+            if self.org.is_anon:
+                contact_urns = contact.get_urns()
+                values.append(f"{contact.id:010d}")
+                values.append(contact_urns[0].scheme if contact_urns else "")
+            else:
+                values.append(contact.get_urn_display(org=self.org, formatted=False))
+
+            for extra_urn_column in extra_urn_columns:
+                values.append(
+                    contact.get_urn_display(org=self.org, formatted=False, scheme=extra_urn_column["scheme"])
+                )
+
+            values.append(self.prepare_value(contact.name))
+
+            contact_group_ids = group_ids_by_contact[contact.id]
+            for group in groups:
+                values.append(group.id in contact_group_ids)
+
+            for cf in contact_fields:
+                values.append(self.prepare_value(contact.get_field_display(cf)))
+
+            values_by_uuid[str(contact.uuid)] = values
+
+        return values_by_uuid
+
 
 @register_asset_store
 class ResultsExportAssetStore(BaseExportAssetStore):
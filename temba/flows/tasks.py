@@ -13,10 +13,12 @@ from celery import shared_task
 
 from temba.utils import chunk_list
 from temba.utils.celery import nonoverlapping_task
+from temba.utils.trim import trim
 
 from .models import (
     ExportFlowResultsTask,
     Flow,
+    FlowActivityCount,
     FlowCategoryCount,
     FlowNodeCount,
     FlowPathCount,
@@ -61,6 +63,7 @@ def squash_flowcounts():
     FlowCategoryCount.squash()
     FlowStartCount.squash()
     FlowPathCount.squash()
+    FlowActivityCount.squash()  # after path counts since squashing those updates these
 
 
 @nonoverlapping_task(track_started=True, name="trim_flow_revisions")
@@ -93,26 +96,11 @@ def trim_flow_sessions():
     Cleanup old flow sessions
     """
     trim_before = timezone.now() - settings.RETENTION_PERIODS["flowsession"]
-    num_deleted = 0
-    start = timezone.now()
-
-    logger.info(f"Deleting flow sessions which ended before {trim_before.isoformat()}...")
-
-    while True:
-        session_ids = list(FlowSession.objects.filter(ended_on__lte=trim_before).values_list("id", flat=True)[:1000])
-        if not session_ids:
-            break
 
-        # detach any flows runs that belong to these sessions
+    def detach_runs(session_ids):
         FlowRun.objects.filter(session_id__in=session_ids).update(session_id=None)
 
-        FlowSession.objects.filter(id__in=session_ids).delete()
-        num_deleted += len(session_ids)
-
-        if num_deleted % 10000 == 0:  # pragma: no cover
-            print(f" > Deleted {num_deleted} flow sessions")
-
-    logger.info(f"Deleted {num_deleted} flow sessions in {timesince(start)}")
+    trim("flowsession", FlowSession.objects.filter(ended_on__lte=trim_before), before_delete=detach_runs)
 
 
 def trim_flow_starts():
@@ -120,22 +108,8 @@ def trim_flow_starts():
     Cleanup completed non-user created flow starts
     """
     trim_before = timezone.now() - settings.RETENTION_PERIODS["flowstart"]
-    num_deleted = 0
-    start = timezone.now()
-
-    logger.info(f"Deleting completed non-user created flow starts created before {trim_before.isoformat()}")
-
-    while True:
-        start_ids = list(
-            FlowStart.objects.filter(
-                created_by=None,
-                status__in=(FlowStart.STATUS_COMPLETE, FlowStart.STATUS_FAILED),
-                modified_on__lte=trim_before,
-            ).values_list("id", flat=True)[:1000]
-        )
-        if not start_ids:
-            break
 
+    def detach_and_delete_related(start_ids):
         # detach any flows runs that belong to these starts
         run_ids = FlowRun.objects.filter(start_id__in=start_ids).values_list("id", flat=True)[:100000]
         while len(run_ids) > 0:
@@ -148,10 +122,10 @@ def trim_flow_starts():
         FlowStart.contacts.through.objects.filter(flowstart_id__in=start_ids).delete()
         FlowStart.groups.through.objects.filter(flowstart_id__in=start_ids).delete()
         FlowStartCount.objects.filter(start_id__in=start_ids).delete()
-        FlowStart.objects.filter(id__in=start_ids).delete()
-        num_deleted += len(start_ids)
-
-        if num_deleted % 10000 == 0:  # pragma: no cover
-            logger.debug(f" > Deleted {num_deleted} flow starts")
 
-    logger.info(f"Deleted {num_deleted} completed non-user created flow starts in {timesince(start)}")
+    starts = FlowStart.objects.filter(
+        created_by=None,
+        status__in=(FlowStart.STATUS_COMPLETE, FlowStart.STATUS_FAILED),
+        modified_on__lte=trim_before,
+    )
+    trim("flowstart", starts, before_delete=detach_and_delete_related)
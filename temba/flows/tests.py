@@ -12,6 +12,7 @@ from openpyxl import load_workbook
 
 from django.conf import settings
 from django.contrib.auth.models import Group
+from django.db.models import Sum
 from django.db.models.functions import TruncDate
 from django.test.utils import override_settings
 from django.urls import reverse
@@ -23,7 +24,7 @@ from temba.api.models import Resthook
 from temba.archives.models import Archive
 from temba.campaigns.models import Campaign, CampaignEvent
 from temba.classifiers.models import Classifier
-from temba.contacts.models import URN, Contact, ContactField, ContactGroup
+from temba.contacts.models import URN, Contact, ContactField, ContactGroup, ContactURN
 from temba.globals.models import Global
 from temba.mailroom import FlowValidationException
 from temba.orgs.integrations.dtone import DTOneType
@@ -40,6 +41,7 @@ from .checks import mailroom_url
 from .models import (
     ExportFlowResultsTask,
     Flow,
+    FlowActivityCount,
     FlowCategoryCount,
     FlowLabel,
     FlowNodeCount,
@@ -156,6 +158,54 @@ class FlowTest(TembaTest):
         favorites.revisions.all().delete()
         self.assertRaises(AssertionError, favorites.get_definition)
 
+    @override_settings(FLOW_DEFINITION_CACHE_TTL=60)
+    def test_definition_cache(self):
+        flow = self.get_flow("color_v11")
+        original_def = self.get_flow_json("color_v11")
+
+        definition = flow.get_definition()
+        self.assertEqual(1, definition["revision"])
+
+        # current definition is now cached but metadata is still updated from the db object
+        flow.name = "Amazing Flow"
+
+        with self.assertNumQueries(0):
+            definition = flow.get_definition()
+
+        self.assertEqual(1, definition["revision"])
+        self.assertEqual("Amazing Flow", definition["name"])
+
+        # until a new revision is saved
+        flow.save_revision(self.admin, definition)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(2, flow.get_definition()["revision"])
+
+        # and a reader which loaded an older revision can't put it back in the cache
+        flow._cache_definition(1, original_def)
+
+        self.assertEqual(2, flow.get_definition()["revision"])
+
+        # rewind first revision to legacy spec
+        revision = flow.revisions.get(revision=1)
+        revision.definition = original_def
+        revision.spec_version = "11.12"
+        revision.save(update_fields=("definition", "spec_version"))
+
+        migrated = revision.get_migrated_definition()
+        self.assertEqual(Flow.CURRENT_SPEC_VERSION, migrated["spec_version"])
+
+        # migrations of a revision to a version are cached
+        with patch("temba.flows.models.Flow.migrate_definition") as mock_migrate:
+            mock_migrate.return_value = {"spec_version": "13.0.0"}
+
+            self.assertEqual(migrated, revision.get_migrated_definition())
+            self.assertEqual(0, mock_migrate.call_count)
+
+            # but not to other versions
+            revision.get_migrated_definition(to_version="13.0.0")
+            self.assertEqual(1, mock_migrate.call_count)
+
     def test_ensure_current_version(self):
         # importing migrates to latest spec version
         flow = self.get_flow("favorites_v13")
@@ -600,6 +650,14 @@ class FlowTest(TembaTest):
             {"total": 2, "active": 1, "completed": 1, "expired": 0, "interrupted": 0, "failed": 0, "completion": 50},
             flow.get_run_stats(),
         )
+
+        # run stats can also be fetched for several flows at once
+        other_flow = self.create_flow("Other")
+        expected = {flow: flow.get_run_stats(), other_flow: other_flow.get_run_stats()}
+
+        with self.assertNumQueries(1):
+            self.assertEqual(expected, Flow.get_run_stats_by_flow([flow, other_flow]))
+
         self.assertEqual(
             {
                 "counts": [
@@ -857,6 +915,87 @@ class FlowTest(TembaTest):
         squash_flowcounts()
         self.assertEqual(max_id, FlowRunCount.objects.all().order_by("-id").first().id)
 
+    def test_activity_counts(self):
+        flow = self.get_flow("favorites")
+        exit1, exit2 = "10a8ae35-0f2c-4ce0-91d3-6a0b8d4b8b3f", "5d4ac3b0-82c3-4d3f-a1d0-5a5ad5b32dd4"
+        node = "a6e1a5f5-d9e8-4c1e-b1f8-1b1f4b3d7e0e"
+
+        def add_count(from_uuid, period, count):
+            FlowPathCount.objects.create(flow=flow, from_uuid=from_uuid, to_uuid=node, period=period, count=count)
+
+        def get_counts(count_type):
+            counts = FlowActivityCount.objects.filter(count_type=count_type).values_list("from_uuid", "period")
+            return {(str(c[0]), c[1]): c[2] for c in counts.annotate(total=Sum("count"))}
+
+        monday = datetime(2022, 6, 20, 10, 0, 0, 0, pytz.UTC)
+        tuesday = datetime(2022, 6, 21, 15, 0, 0, 0, pytz.UTC)
+
+        add_count(exit1, monday, 2)
+        add_count(exit1, monday, -1)
+        add_count(exit1, tuesday, 3)
+        add_count(exit2, monday, 1)
+
+        squash_flowcounts()
+
+        self.assertFalse(FlowActivityCount.objects.filter(is_squashed=False).exists())
+        self.assertEqual(
+            {(exit1, monday): 1, (exit1, tuesday): 3, (exit2, monday): 1},
+            get_counts(FlowActivityCount.TYPE_HOUR),
+        )
+        self.assertEqual(
+            {
+                (exit1, datetime(2022, 6, 20, tzinfo=pytz.UTC)): 1,
+                (exit1, datetime(2022, 6, 21, tzinfo=pytz.UTC)): 3,
+                (exit2, datetime(2022, 6, 20, tzinfo=pytz.UTC)): 1,
+            },
+            get_counts(FlowActivityCount.TYPE_DAY),
+        )
+        self.assertEqual(
+            {(exit1, datetime(2022, 6, 20, tzinfo=pytz.UTC)): 4, (exit2, datetime(2022, 6, 20, tzinfo=pytz.UTC)): 1},
+            get_counts(FlowActivityCount.TYPE_WEEK),
+        )
+        self.assertEqual(
+            {
+                (exit1, datetime(1970, 1, 1, 10, tzinfo=pytz.UTC)): 1,
+                (exit1, datetime(1970, 1, 1, 15, tzinfo=pytz.UTC)): 3,
+                (exit2, datetime(1970, 1, 1, 10, tzinfo=pytz.UTC)): 1,
+            },
+            get_counts(FlowActivityCount.TYPE_HOUR_OF_DAY),
+        )
+
+        day_of_week = get_counts(FlowActivityCount.TYPE_DAY_OF_WEEK)
+        self.assertEqual(
+            {(exit1, 1): 1, (exit1, 2): 3, (exit2, 1): 1},
+            {(k[0], FlowActivityCount.get_day_of_week(k[1])): v for k, v in day_of_week.items()},
+        )
+
+        # squashing again doesn't roll up already squashed path counts again
+        squash_flowcounts()
+        self.assertEqual(
+            {(exit1, monday): 1, (exit1, tuesday): 3, (exit2, monday): 1},
+            get_counts(FlowActivityCount.TYPE_HOUR),
+        )
+
+        # new counts are also rolled up when path counts are squashed one set at a time
+        add_count(exit1, tuesday, 2)
+
+        with override_settings(SQUASH_MODE="sets"):
+            squash_flowcounts()
+
+        self.assertEqual(
+            {(exit1, monday): 1, (exit1, tuesday): 5, (exit2, monday): 1},
+            get_counts(FlowActivityCount.TYPE_HOUR),
+        )
+        self.assertEqual(
+            {(exit1, datetime(2022, 6, 20, tzinfo=pytz.UTC)): 6, (exit2, datetime(2022, 6, 20, tzinfo=pytz.UTC)): 1},
+            get_counts(FlowActivityCount.TYPE_WEEK),
+        )
+
+        # rollups are deleted with their flow
+        flow.release(self.admin, interrupt_sessions=False)
+        flow.delete()
+        self.assertFalse(FlowActivityCount.objects.exists())
+
     def test_category_counts(self):
         def assertCount(counts, result_key, category_name, truth):
             found = False
@@ -3172,6 +3311,9 @@ class FlowCRUDLTest(TembaTest, CRUDLTestMixin):
             FlowCRUDL.ActivityChart.HISTOGRAM_MIN = 0
             FlowCRUDL.ActivityChart.PERIOD_MIN = 0
 
+            # charts read from rollups which are updated as path counts are squashed
+            squash_flowcounts()
+
             # and some charts
             response = self.client.get(reverse("flows.flow_activity_chart", args=[flow.id]))
 
@@ -3212,6 +3354,8 @@ class FlowCRUDLTest(TembaTest, CRUDLTestMixin):
             self.assertEqual(1, len(response.context["runs"]))
             self.assertContains(response, "Jimmy")
 
+            squash_flowcounts()
+
             # now only one active, one completed, one failed and 5 total responses
             response = self.client.get(reverse("flows.flow_activity_chart", args=[flow.id]))
 
@@ -3227,17 +3371,28 @@ class FlowCRUDLTest(TembaTest, CRUDLTestMixin):
             points = response.context["histogram"]
             self.assertEqual(1, len(points))
 
-            # put one of our counts way in the past so we get a different histogram scale
-            count = FlowPathCount.objects.filter(flow=flow).order_by("id")[1]
-            count.period = count.period - timedelta(days=25)
-            count.save()
+            def move_response(from_uuid, to_uuid, period, new_period):
+                FlowPathCount.objects.create(flow=flow, from_uuid=from_uuid, to_uuid=to_uuid, period=period, count=-1)
+                FlowPathCount.objects.create(
+                    flow=flow, from_uuid=from_uuid, to_uuid=to_uuid, period=new_period, count=1
+                )
+                squash_flowcounts()
+
+            # move one of our responses way in the past so we get a different histogram scale
+            count = FlowPathCount.objects.filter(flow=flow, from_uuid__in=flow.metadata["waiting_exit_uuids"]).first()
+            move_response(count.from_uuid, count.to_uuid, count.period, count.period - timedelta(days=25))
+
             response = self.client.get(reverse("flows.flow_activity_chart", args=[flow.id]))
             points = response.context["histogram"]
             self.assertTrue(timedelta(days=24) < (points[1]["bucket"] - points[0]["bucket"]))
 
             # pick another scale
-            count.period = count.period - timedelta(days=600)
-            count.save()
+            move_response(
+                count.from_uuid,
+                count.to_uuid,
+                count.period - timedelta(days=25),
+                count.period - timedelta(days=625),
+            )
             response = self.client.get(reverse("flows.flow_activity_chart", args=[flow.id]))
 
             # this should give us a more compressed histogram
@@ -4015,7 +4170,9 @@ class ExportFlowResultsTest(TembaTest):
 
         readonly_models = {FlowRun, ContactGroup, ContactField}
         if has_results:
-            readonly_models.add(Contact)
+            readonly_models |= {Contact, ContactURN}
+            if group_memberships:
+                readonly_models.add(ContactGroup.contacts.through)
 
         with self.mockReadOnly(assert_models=readonly_models):
             response = self.client.post(reverse("flows.flow_export_results"), form)
@@ -4160,7 +4317,7 @@ class ExportFlowResultsTest(TembaTest):
                 # make sure that we trigger logger
                 log_info_threshold.return_value = 1
 
-                with self.assertNumQueries(43):
+                with self.assertNumQueries(41):
                     workbook = self._export(flow, group_memberships=[devs])
 
                 self.assertEqual(len(captured_logger.output), 3)
@@ -4296,7 +4453,7 @@ class ExportFlowResultsTest(TembaTest):
         )
 
         # test without unresponded
-        with self.assertNumQueries(41):
+        with self.assertNumQueries(40):
             workbook = self._export(flow, responded_only=True, group_memberships=(devs,))
 
         tz = self.org.timezone
@@ -4362,7 +4519,7 @@ class ExportFlowResultsTest(TembaTest):
         )
 
         # test export with a contact field
-        with self.assertNumQueries(43):
+        with self.assertNumQueries(42):
             workbook = self._export(
                 flow,
                 responded_only=True,
@@ -4537,7 +4694,7 @@ class ExportFlowResultsTest(TembaTest):
 
         contact1_run1, contact2_run1, contact3_run1, contact1_run2, contact2_run2 = FlowRun.objects.order_by("id")
 
-        with self.assertNumQueries(54):
+        with self.assertNumQueries(51):
             workbook = self._export(flow)
 
         tz = self.org.timezone
@@ -5342,7 +5499,7 @@ class SimulationTest(TembaTest):
         url = reverse("flows.flow_simulate", args=[flow.id])
 
         with override_settings(MAILROOM_AUTH_TOKEN="sesame", MAILROOM_URL="https://mailroom.temba.io"):
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(200, '{"session": {}}')
                 response = self.client.post(url, payload, content_type="application/json")
 
@@ -5380,13 +5537,13 @@ class SimulationTest(TembaTest):
         url = reverse("flows.flow_simulate", args=[flow.pk])
 
         with override_settings(MAILROOM_AUTH_TOKEN="sesame", MAILROOM_URL="https://mailroom.temba.io"):
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(400, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(500, response.status_code)
 
             # start a flow
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(200, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(200, response.status_code)
@@ -5412,12 +5569,12 @@ class SimulationTest(TembaTest):
                 "flow": {},
             }
 
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(400, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(500, response.status_code)
 
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(200, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(200, response.status_code)
@@ -21,7 +21,7 @@ from django import forms
 from django.conf import settings
 from django.contrib import messages
 from django.core.exceptions import ValidationError
-from django.db.models import Count, Max, Min, Sum
+from django.db.models import Count, F, Max, Min, Sum
 from django.db.models.functions import Lower
 from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.urls import reverse
@@ -36,7 +36,7 @@ from temba.archives.models import Archive
 from temba.channels.models import Channel
 from temba.contacts.models import URN, ContactField, ContactGroup
 from temba.contacts.search import SearchException, parse_query
-from temba.flows.models import Flow, FlowRevision, FlowRun, FlowRunCount, FlowSession, FlowStart
+from temba.flows.models import Flow, FlowActivityCount, FlowRevision, FlowRun, FlowRunCount, FlowSession, FlowStart
 from temba.flows.tasks import export_flow_results_task, update_session_wait_expires
 from temba.ivr.models import IVRCall
 from temba.mailroom import FlowValidationException
@@ -1533,32 +1533,28 @@ class FlowCRUDL(SmartCRUDL):
             context = super().get_context_data(*args, **kwargs)
 
             flow = self.get_object()
-            from temba.flows.models import FlowPathCount
 
+            # read from the rollups of path counts from waiting exits, i.e. responses
             from_uuids = flow.metadata["waiting_exit_uuids"]
-            dates = FlowPathCount.objects.filter(flow=flow, from_uuid__in=from_uuids).aggregate(
-                Max("period"), Min("period")
-            )
+            counts = FlowActivityCount.objects.filter(flow=flow, from_uuid__in=from_uuids)
+
+            dates = counts.filter(count_type=FlowActivityCount.TYPE_HOUR).aggregate(Max("period"), Min("period"))
             start_date = dates.get("period__min")
             end_date = dates.get("period__max")
 
             # by hour of the day
-            hod = FlowPathCount.objects.filter(flow=flow, from_uuid__in=from_uuids).extra(
-                {"hour": "extract(hour from period::timestamp)"}
-            )
-            hod = hod.values("hour").annotate(count=Sum("count")).order_by("hour")
-            hod_dict = {int(h.get("hour")): h.get("count") for h in hod}
+            hod = counts.filter(count_type=FlowActivityCount.TYPE_HOUR_OF_DAY)
+            hod = hod.values("period").annotate(count=Sum("count")).order_by("period")
+            hod_dict = {h["period"].hour: h["count"] for h in hod}
 
             hours = []
             for x in range(0, 24):
                 hours.append({"bucket": datetime(1970, 1, 1, hour=x), "count": hod_dict.get(x, 0)})
 
             # by day of the week
-            dow = FlowPathCount.objects.filter(flow=flow, from_uuid__in=from_uuids).extra(
-                {"day": "extract(dow from period::timestamp)"}
-            )
-            dow = dow.values("day").annotate(count=Sum("count"))
-            dow_dict = {int(d.get("day")): d.get("count") for d in dow}
+            dow = counts.filter(count_type=FlowActivityCount.TYPE_DAY_OF_WEEK)
+            dow = dow.values("period").annotate(count=Sum("count"))
+            dow_dict = {FlowActivityCount.get_day_of_week(d["period"]): d["count"] for d in dow}
 
             dow = []
             for x in range(0, 7):
@@ -1591,18 +1587,22 @@ class FlowCRUDL(SmartCRUDL):
             if total_responses > self.HISTOGRAM_MIN:
                 # our main histogram
                 date_range = end_date - start_date
-                histogram = FlowPathCount.objects.filter(flow=flow, from_uuid__in=from_uuids)
                 if date_range < timedelta(days=21):
-                    histogram = histogram.extra({"bucket": "date_trunc('hour', period)"})
+                    histogram = counts.filter(count_type=FlowActivityCount.TYPE_HOUR)
                     min_date = start_date - timedelta(hours=1)
                 elif date_range < timedelta(days=500):
-                    histogram = histogram.extra({"bucket": "date_trunc('day', period)"})
+                    histogram = counts.filter(count_type=FlowActivityCount.TYPE_DAY)
                     min_date = end_date - timedelta(days=100)
                 else:
-                    histogram = histogram.extra({"bucket": "date_trunc('week', period)"})
+                    histogram = counts.filter(count_type=FlowActivityCount.TYPE_WEEK)
                     min_date = end_date - timedelta(days=500)
 
-                histogram = histogram.values("bucket").annotate(count=Sum("count")).order_by("bucket")
+                histogram = (
+                    histogram.values(bucket=F("period"))
+                    .annotate(count=Sum("count"))
+                    .filter(count__gt=0)
+                    .order_by("bucket")
+                )
                 context["histogram"] = histogram
 
                 # highcharts works in UTC, but we want to offset our chart according to the org timezone
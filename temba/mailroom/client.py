@@ -1,11 +1,14 @@
 import logging
+import threading
+import time
 from dataclasses import asdict, dataclass, field
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from django.conf import settings
 
-from temba.utils import json
+from temba.utils import analytics, json
 
 from .modifiers import Modifier
 
@@ -105,6 +108,47 @@ class StartPreview:
     metadata: QueryMetadata
 
 
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter which applies a default (connect, read) timeout to requests which don't specify one
+    """
+
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout or self.timeout, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Gets the HTTP session shared by all clients in this process so that connections to mailroom are kept alive and
+    pooled rather than opened for every request
+    """
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                adapter = TimeoutHTTPAdapter(
+                    timeout=(settings.MAILROOM_CONNECT_TIMEOUT, settings.MAILROOM_READ_TIMEOUT),
+                    pool_connections=1,
+                    pool_maxsize=settings.MAILROOM_POOL_SIZE,
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+
+    return _session
+
+
 class MailroomClient:
     """
     Basic web client for mailroom
@@ -112,6 +156,22 @@ class MailroomClient:
 
     default_headers = {"User-Agent": "Temba"}
 
+    # endpoints which don't change any state and so can be safely retried
+    idempotent_endpoints = {
+        "",
+        "expression/migrate",
+        "flow/migrate",
+        "flow/inspect",
+        "flow/change_language",
+        "flow/clone",
+        "flow/preview_start",
+        "po/export",
+        "contact/search",
+        "contact/parse_query",
+    }
+    retry_statuses = {502, 503, 504}
+    retry_backoff = 0.1  # seconds before first retry, doubled for each subsequent retry
+
     def __init__(self, base_url, auth_token):
         self.base_url = base_url
         self.headers = self.default_headers.copy()
@@ -313,8 +373,32 @@ class MailroomClient:
         else:
             kwargs = dict(json=payload)
 
-        req_fn = requests.post if post else requests.get
-        response = req_fn("%s/mr/%s" % (self.base_url, endpoint), headers=headers, **kwargs)
+        session = get_session()
+        req_fn = session.post if post else session.get
+        url = "%s/mr/%s" % (self.base_url, endpoint)
+        metric = "temba.mailroom_%s" % (endpoint.replace("/", "_") or "version")
+        num_attempts = (settings.MAILROOM_RETRIES + 1) if endpoint in self.idempotent_endpoints else 1
+        start = time.perf_counter()
+
+        for attempt in range(num_attempts):
+            if attempt > 0:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+            try:
+                response = req_fn(url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt < num_attempts - 1:
+                    continue
+
+                analytics.gauge(f"{metric}_errors", 1)
+                raise
+
+            if response.status_code not in self.retry_statuses or attempt == num_attempts - 1:
+                break
+
+        analytics.gauge(f"{metric}_time", time.perf_counter() - start)
+        if response.status_code >= 400:
+            analytics.gauge(f"{metric}_errors", 1)
 
         return_val = response.json() if returns_json else response.content
 
@@ -1,4 +1,5 @@
 import time
+from collections import defaultdict
 from enum import Enum
 
 from django_redis import get_redis_connection
@@ -84,20 +85,31 @@ def queue_broadcast(broadcast):
     Queues the passed in broadcast for sending by mailroom
     """
 
-    task = {
-        "translations": {lang: {"text": text} for lang, text in broadcast.text.items()},
-        "template_state": broadcast.get_template_state(),
-        "base_language": broadcast.base_language,
-        "urns": broadcast.raw_urns or [],
-        "contact_ids": list(broadcast.contacts.values_list("id", flat=True)),
-        "group_ids": list(broadcast.groups.values_list("id", flat=True)),
-        "broadcast_id": broadcast.id,
-        "org_id": broadcast.org_id,
-        "ticket_id": broadcast.ticket_id,
-        "created_by_id": broadcast.created_by_id,
-    }
+    queue_broadcasts([broadcast])
 
-    _queue_batch_task(broadcast.org_id, BatchTask.SEND_BROADCAST, task, HIGH_PRIORITY)
+
+def queue_broadcasts(broadcasts):
+    """
+    Queues the passed in broadcasts for sending by mailroom
+    """
+
+    tasks = []
+    for broadcast in broadcasts:
+        task = {
+            "translations": {lang: {"text": text} for lang, text in broadcast.text.items()},
+            "template_state": broadcast.get_template_state(),
+            "base_language": broadcast.base_language,
+            "urns": broadcast.raw_urns or [],
+            "contact_ids": list(broadcast.contacts.values_list("id", flat=True)),
+            "group_ids": list(broadcast.groups.values_list("id", flat=True)),
+            "broadcast_id": broadcast.id,
+            "org_id": broadcast.org_id,
+            "ticket_id": broadcast.ticket_id,
+            "created_by_id": broadcast.created_by_id,
+        }
+        tasks.append((broadcast.org_id, BatchTask.SEND_BROADCAST, task, HIGH_PRIORITY))
+
+    _queue_batch_tasks(tasks)
 
 
 def queue_populate_dynamic_group(group):
@@ -151,9 +163,25 @@ def queue_contact_import_batch(batch):
     Queues a task to import a batch of contacts
     """
 
-    task = {"contact_import_batch_id": batch.id}
+    queue_contact_import_batches([batch])
+
 
-    _queue_batch_task(batch.contact_import.org.id, BatchTask.IMPORT_CONTACT_BATCH, task, DEFAULT_PRIORITY)
+def queue_contact_import_batches(batches):
+    """
+    Queues tasks to import the passed in batches of contacts
+    """
+
+    _queue_batch_tasks(
+        [
+            (
+                batch.contact_import.org_id,
+                BatchTask.IMPORT_CONTACT_BATCH,
+                {"contact_import_batch_id": batch.id},
+                DEFAULT_PRIORITY,
+            )
+            for batch in batches
+        ]
+    )
 
 
 def queue_interrupt(org, *, contacts=None, channel=None, flow=None, session=None):
@@ -183,9 +211,31 @@ def _queue_batch_task(org_id, task_type, task, priority):
     Adds the passed in task to the mailroom batch queue
     """
 
+    _queue_batch_tasks([(org_id, task_type, task, priority)])
+
+
+def _queue_batch_tasks(tasks):
+    """
+    Adds the passed in (org_id, task_type, task, priority) tuples to the mailroom batch queue, using a single pipeline
+    with one ZADD per org queue, and a single timestamp for all of them
+    """
+
+    if not tasks:
+        return
+
+    now = _now_millis()
+    payloads_by_org = defaultdict(dict)
+
+    for org_id, task_type, task, priority in tasks:
+        payload = json.dumps(_create_mailroom_task(org_id, task_type, task))
+        payloads_by_org[org_id][payload] = now + priority
+
     r = get_redis_connection("default")
     pipe = r.pipeline()
-    _queue_task(pipe, org_id, BATCH_QUEUE, task_type, task, priority)
+
+    for org_id, payloads in payloads_by_org.items():
+        _queue_payloads(pipe, org_id, BATCH_QUEUE, payloads)
+
     pipe.execute()
 
 
@@ -224,21 +274,33 @@ def _queue_task(pipe, org_id, queue, task_type, task, priority):
     """
 
     # our score is the time in milliseconds since epoch + any priority modifier
-    score = int(round(time.time() * 1000)) + priority
+    score = _now_millis() + priority
 
     # create our payload
     payload = _create_mailroom_task(org_id, task_type, task)
 
+    _queue_payloads(pipe, org_id, queue, {json.dumps(payload): score})
+
+
+def _queue_payloads(pipe, org_id, queue, payloads: dict):
+    """
+    Adds the given serialized task payloads (mapped to their scores) to an org's queue and marks that org as active
+    """
+
     org_queue = QUEUE_PATTERN % (queue, org_id)
     active_queue = ACTIVE_PATTERN % queue
 
     # push onto our org queue
-    pipe.zadd(org_queue, {json.dumps(payload): score})
+    pipe.zadd(org_queue, payloads)
 
     # and mark that org as active
     pipe.zincrby(active_queue, 0, org_id)
 
 
+def _now_millis() -> int:
+    return int(round(time.time() * 1000))
+
+
 def _create_mailroom_task(org_id, task_type, task):
     """
     Returns a mailroom format task job based on the task type and passed in task
@@ -1,6 +1,9 @@
+import threading
 from decimal import Decimal
-from unittest.mock import patch
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import call, patch
 
+import requests
 from django_redis import get_redis_connection
 
 from django.conf import settings
@@ -11,27 +14,35 @@ from temba.campaigns.models import Campaign, CampaignEvent, EventFire
 from temba.channels.models import ChannelEvent, ChannelLog
 from temba.flows.models import FlowRun, FlowStart
 from temba.ivr.models import IVRCall
-from temba.mailroom.client import ContactSpec, MailroomException, get_client
+from temba.mailroom.client import ContactSpec, MailroomException, get_client, get_session
 from temba.msgs.models import Broadcast, Msg
 from temba.tests import MockResponse, TembaTest, matchers, mock_mailroom
 from temba.tests.engine import MockSessionWriter
 from temba.tickets.models import Ticketer, TicketEvent
 from temba.utils import json
 
-from . import QueryExclusions, QueryInclusions, QueryMetadata, StartPreview, modifiers, queue_interrupt
+from . import (
+    QueryExclusions,
+    QueryInclusions,
+    QueryMetadata,
+    StartPreview,
+    modifiers,
+    queue_broadcasts,
+    queue_interrupt,
+)
 from .events import Event
 
 
 class MailroomClientTest(TembaTest):
     def test_version(self):
-        with patch("requests.get") as mock_get:
+        with patch("requests.Session.get") as mock_get:
             mock_get.return_value = MockResponse(200, '{"version": "5.3.4"}')
             version = get_client().version()
 
         self.assertEqual("5.3.4", version)
 
     def test_expression_migrate(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"migrated": "@fields.age"}')
             migrated = get_client().expression_migrate("@contact.age")
 
@@ -52,7 +63,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_migrate(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"name": "Migrated!"}')
             migrated = get_client().flow_migrate(flow_def, to_version="13.1.0")
 
@@ -68,7 +79,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_inspect(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"dependencies":[]}')
             info = get_client().flow_inspect(self.org.id, flow_def)
 
@@ -83,7 +94,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_change_language(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"language": "spa"}')
             migrated = get_client().flow_change_language(flow_def, language="spa")
 
@@ -96,7 +107,7 @@ class MailroomClientTest(TembaTest):
         self.assertEqual({"flow": flow_def, "language": "spa"}, json.loads(call[1]["data"]))
 
     def test_flow_preview_start(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_resp = {
                 "query": 'group = "Farmers" AND status = "active"',
                 "total": 2345,
@@ -153,7 +164,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_contact_modify(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(
                 200,
                 """{
@@ -221,7 +232,7 @@ class MailroomClientTest(TembaTest):
                 },
             )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_msg_resend(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"msg_ids": [12345]}')
         response = get_client().msg_resend(org_id=self.org.id, msg_ids=[12345, 67890])
@@ -235,7 +246,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_po_export(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, 'msgid "Red"\nmsgstr "Rojo"\n\n')
             response = get_client().po_export(self.org.id, [123, 234], "spa")
 
@@ -248,7 +259,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_po_import(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"flows": []}')
             response = get_client().po_import(self.org.id, [123, 234], "spa", b'msgid "Red"\nmsgstr "Rojo"\n\n')
 
@@ -261,7 +272,7 @@ class MailroomClientTest(TembaTest):
             files={"po": b'msgid "Red"\nmsgstr "Rojo"\n\n'},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_parse_query(self, mock_post):
         mock_post.return_value = MockResponse(
             200, '{"query":"name ~ \\"frank\\"", "elastic_query": {}, "metadata": {"attributes":["name"]}}'
@@ -282,7 +293,7 @@ class MailroomClientTest(TembaTest):
         with self.assertRaises(MailroomException):
             get_client().parse_query(1, "age > 10")
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_create(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"contact": {"id": 1234, "name": "", "language": ""}}')
 
@@ -334,7 +345,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_resolve(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"contact": {"id": 1234}, "urn": {"id": 2345}}')
 
@@ -348,7 +359,7 @@ class MailroomClientTest(TembaTest):
             json={"org_id": self.org.id, "channel_id": 345, "urn": "tel:+1234567890"},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_search(self, mock_post):
         mock_post.return_value = MockResponse(
             200,
@@ -385,7 +396,7 @@ class MailroomClientTest(TembaTest):
             get_client().contact_search(1, "2752dbbc-723f-4007-8bc5-b3720835d3a9", "age > 10", "-created_on")
 
     def test_ticket_assign(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_assign(1, 12, [123, 345], 4, "please handle")
 
@@ -397,7 +408,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_add_note(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_add_note(1, 12, [123, 345], "please handle")
 
@@ -409,7 +420,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_change_topic(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_change_topic(1, 12, [123, 345], 67)
 
@@ -421,7 +432,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_close(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_close(1, 12, [123, 345], force=True)
 
@@ -433,7 +444,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_reopen(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_reopen(1, 12, [123, 345])
 
@@ -447,7 +458,7 @@ class MailroomClientTest(TembaTest):
     def test_request_failure(self):
         flow = self.get_flow("color")
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(400, '{"errors":["Bad request", "Doh!"]}')
 
             with self.assertRaises(MailroomException) as e:
@@ -462,6 +473,65 @@ class MailroomClientTest(TembaTest):
         # empty is as empty does
         self.assertEqual("", get_client().expression_migrate(""))
 
+    def test_session(self):
+        session = get_session()
+
+        # all clients share one session whose adapters apply our timeouts
+        self.assertIs(session, get_session())
+        self.assertEqual((5, 60), session.get_adapter("http://localhost:8090/mr/").timeout)
+
+    def test_request_retries(self):
+        requested, responses = [], []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                requested.append(self.path)
+
+                status, body = responses.pop(0)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("localhost", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            with override_settings(MAILROOM_URL=f"http://localhost:{server.server_port}"):
+                with patch("temba.mailroom.client.time.sleep") as mock_sleep:
+                    # idempotent requests are retried with backoff after 503s
+                    responses.extend([(503, b"{}"), (503, b"{}"), (200, b'{"name": "Migrated!"}')])
+
+                    self.assertEqual({"name": "Migrated!"}, get_client().flow_migrate({"nodes": []}))
+                    self.assertEqual(["/mr/flow/migrate"] * 3, requested)
+                    self.assertEqual([call(0.1), call(0.2)], mock_sleep.call_args_list)
+
+                    # but only up to the max number of retries
+                    requested.clear()
+                    responses.extend([(503, b"{}"), (503, b"{}"), (503, b"{}")])
+
+                    with self.assertRaises(requests.HTTPError):
+                        get_client().flow_migrate({"nodes": []})
+
+                    self.assertEqual(3, len(requested))
+
+                    # and other requests aren't retried
+                    requested.clear()
+                    responses.extend([(503, b"{}")])
+
+                    with self.assertRaises(requests.HTTPError):
+                        get_client().msg_resend(self.org.id, [12345])
+
+                    self.assertEqual(["/mr/msg/resend"], requested)
+        finally:
+            server.shutdown()
+            server.server_close()
+
 
 class MailroomQueueTest(TembaTest):
     def setUp(self):
@@ -646,6 +716,38 @@ class MailroomQueueTest(TembaTest):
             },
         )
 
+    def test_queue_broadcasts(self):
+        jim = self.create_contact("Jim", phone="+12065551212")
+        bob = self.create_contact("Bob", phone="+12065551313", org=self.org2)
+
+        bcast1 = Broadcast.create(self.org, self.admin, {"eng": "Hello"}, contacts=[jim], base_language="eng")
+        bcast2 = Broadcast.create(self.org, self.admin, {"eng": "Hi"}, contacts=[jim], base_language="eng")
+        bcast3 = Broadcast.create(self.org2, self.admin2, {"eng": "Hey"}, contacts=[bob], base_language="eng")
+
+        with patch("temba.mailroom.queue.get_redis_connection", wraps=get_redis_connection) as mock_get_redis:
+            queue_broadcasts([bcast1, bcast2, bcast3])
+
+            self.assertEqual(1, mock_get_redis.call_count)
+
+        r = get_redis_connection()
+
+        # both orgs are active, and each org's tasks were queued with the same score
+        self.assertEqual(2, r.zcard("batch:active"))
+
+        org1_tasks = r.zrange(f"batch:{self.org.id}", 0, -1, withscores=True)
+        self.assertEqual(
+            {bcast1.id, bcast2.id}, {json.loads(payload)["task"]["broadcast_id"] for payload, _ in org1_tasks}
+        )
+        self.assertEqual(1, len({score for _, score in org1_tasks}))
+
+        org2_tasks = r.zrange(f"batch:{self.org2.id}", 0, -1)
+        self.assertEqual([bcast3.id], [json.loads(payload)["task"]["broadcast_id"] for payload in org2_tasks])
+
+        # queueing nothing is a noop
+        queue_broadcasts([])
+
+        self.assertEqual(2, r.zcard(f"batch:{self.org.id}"))
+
     def test_queue_interrupt_by_contacts(self):
         jim = self.create_contact("Jim", phone="+12065551212")
         bob = self.create_contact("Bob", phone="+12065551313")
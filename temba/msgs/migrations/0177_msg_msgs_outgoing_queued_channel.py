@@ -0,0 +1,21 @@
+# Generated by Django 4.0.4 on 2022-06-28 15:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("msgs", "0176_exportmessagestask_stats"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="msg",
+            index=models.Index(
+                condition=models.Q(("direction", "O"), ("status__in", ("Q", "P"))),
+                fields=["channel", "created_on"],
+                name="msgs_outgoing_queued_channel",
+            ),
+        ),
+    ]
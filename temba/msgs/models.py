@@ -1,18 +1,20 @@
 import logging
 import time
-from array import array
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import iso8601
 import pytz
+from django_redis import get_redis_connection
 from xlsxlite.writer import XLSXBook
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
 from django.core.files.temp import NamedTemporaryFile
-from django.db import models
-from django.db.models import Prefetch, Q, Sum
+from django.db import connections, models
+from django.db.models import Q
 from django.db.models.functions import Lower
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -24,6 +26,7 @@ from temba.contacts.models import URN, Contact, ContactGroup, ContactURN
 from temba.orgs.models import DependencyMixin, Org, TopUp
 from temba.schedules.models import Schedule
 from temba.utils import chunk_list, on_transaction_commit
+from temba.utils.cache import get_count_totals
 from temba.utils.export import BaseExportAssetStore, BaseExportTask
 from temba.utils.models import JSONAsTextField, LegacyUUIDMixin, SquashableModel, TembaModel, TranslatableField
 from temba.utils.text import clean_string
@@ -460,6 +463,32 @@ class Msg(models.Model):
             "sent_on": self.sent_on.isoformat() if self.sent_on else None,
         }
 
+    @classmethod
+    def values_as_archive_json(cls, values: dict, labels: list) -> dict:
+        """
+        Returns a message fetched as a dict of MsgIterator.FIELDS values in the same format as as_archive_json
+        """
+        from temba.api.v2.serializers import MsgReadSerializer
+
+        channel_uuid, flow_uuid = values["channel__uuid"], values["flow__uuid"]
+
+        return {
+            "id": values["id"],
+            "contact": {"uuid": str(values["contact__uuid"]), "name": values["contact__name"]},
+            "channel": {"uuid": str(channel_uuid), "name": values["channel__name"]} if channel_uuid else None,
+            "flow": {"uuid": str(flow_uuid), "name": values["flow__name"]} if flow_uuid else None,
+            "urn": values["contact_urn__identity"],
+            "direction": "in" if values["direction"] == Msg.DIRECTION_IN else "out",
+            "type": MsgReadSerializer.TYPES.get(values["msg_type"]),
+            "status": MsgReadSerializer.STATUSES.get(values["status"]),
+            "visibility": MsgReadSerializer.VISIBILITIES.get(values["visibility"]),
+            "text": values["text"],
+            "attachments": [attachment.as_json() for attachment in Attachment.parse_all(values["attachments"])],
+            "labels": [{"uuid": uuid, "name": name} for uuid, name in labels],
+            "created_on": values["created_on"].isoformat(),
+            "sent_on": values["sent_on"].isoformat() if values["sent_on"] else None,
+        }
+
     @classmethod
     def get_text_parts(cls, text, max_length=160):
         """
@@ -701,6 +730,12 @@ class Msg(models.Model):
                 fields=["org", "-sent_on", "-id"],
                 condition=Q(direction="O", visibility="V", status__in=("W", "S", "D")),
             ),
+            # used for finding channels with messages stuck in their queue
+            models.Index(
+                name="msgs_outgoing_queued_channel",
+                fields=["channel", "created_on"],
+                condition=Q(direction="O", status__in=("Q", "P")),
+            ),
         ]
         constraints = [
             models.CheckConstraint(
@@ -838,6 +873,11 @@ class SystemLabelCount(SquashableModel):
     """
 
     squash_over = ("org_id", "label_type", "is_archived")
+    squash_generation_key = "squash:msgs_systemlabelcount:%d"
+    squash_generation_over = "org_id"
+
+    CACHE_KEY = "org:%d:cache:system_label_counts"
+    CACHE_TTL = 60 * 15  # how often cached totals are reconciled with the database
 
     org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="system_labels")
     label_type = models.CharField(max_length=1, choices=SystemLabel.TYPE_CHOICES)
@@ -863,9 +903,10 @@ class SystemLabelCount(SquashableModel):
         """
         Gets all system label counts by type for the given org
         """
+        r = get_redis_connection()
+        generation = cls.get_squash_generation(r, org.id)
         counts = cls.objects.filter(org=org, is_archived=False)
-        counts = counts.values_list("label_type").annotate(count_sum=Sum("count"))
-        counts_by_type = {c[0]: c[1] for c in counts}
+        counts_by_type = get_count_totals(cls.CACHE_KEY % org.id, counts, "label_type", generation, cls.CACHE_TTL, r=r)
 
         # for convenience, include all label types
         return {lb: counts_by_type.get(lb, 0) for lb, n in SystemLabel.TYPE_CHOICES}
@@ -1014,6 +1055,11 @@ class LabelCount(SquashableModel):
     """
 
     squash_over = ("label_id", "is_archived")
+    squash_generation_key = "squash:msgs_labelcount:%d"
+    squash_generation_over = "label_id"
+
+    CACHE_KEY = "org:%d:cache:label_counts"
+    CACHE_TTL = 60 * 15  # how often cached totals are reconciled with the database
 
     label = models.ForeignKey(Label, on_delete=models.PROTECT, related_name="counts")
     is_archived = models.BooleanField(default=False)
@@ -1033,53 +1079,123 @@ class LabelCount(SquashableModel):
 
         return sql, (distinct_set.label_id, distinct_set.is_archived) * 2
 
+    @classmethod
+    def get_squash_generation_scopes(cls, values) -> set:
+        # cached totals are per org so that's what we version
+        return set(Label.objects.filter(id__in=values).values_list("org_id", flat=True).distinct())
+
     @classmethod
     def get_totals(cls, labels):
         """
         Gets total counts for all the given labels
         """
-        counts = (
-            cls.objects.filter(label__in=labels, is_archived=False)
-            .values_list("label_id")
-            .annotate(count_sum=Sum("count"))
-        )
-        counts_by_label_id = {c[0]: c[1] for c in counts}
+        r = get_redis_connection()
+
+        counts_by_label_id = {}
+        for org_id in {lb.org_id for lb in labels}:
+            generation = cls.get_squash_generation(r, org_id)
+            counts = cls.objects.filter(label__org_id=org_id, is_archived=False)
+            counts_by_label_id.update(
+                get_count_totals(cls.CACHE_KEY % org_id, counts, "label_id", generation, cls.CACHE_TTL, r=r)
+            )
+
         return {lb: counts_by_label_id.get(lb.id, 0) for lb in labels}
 
 
 class MsgIterator:
     """
-    Queryset wrapper to chunk queries and reduce in-memory footprint
+    Iterates over the messages of a queryset in batches of dicts in the archive format, paging by (created_on, id) so
+    that ids don't have to be fetched up front. If prefetch is true, each next batch is fetched on a background thread
+    while the current one is being consumed.
     """
 
-    def __init__(self, ids, order_by=None, select_related=None, prefetch_related=None, max_obj_num=1000):
-        self._ids = ids
-        self._order_by = order_by
-        self._select_related = select_related
-        self._prefetch_related = prefetch_related
-        self._generator = self._setup()
-        self.max_obj_num = max_obj_num
+    FIELDS = (
+        "id",
+        "contact__uuid",
+        "contact__name",
+        "channel__uuid",
+        "channel__name",
+        "flow__uuid",
+        "flow__name",
+        "contact_urn__identity",
+        "direction",
+        "msg_type",
+        "status",
+        "visibility",
+        "text",
+        "attachments",
+        "created_on",
+        "sent_on",
+    )
 
-    def _setup(self):
-        for i in range(0, len(self._ids), self.max_obj_num):
-            chunk_queryset = Msg.objects.filter(id__in=self._ids[i : i + self.max_obj_num])
+    def __init__(self, queryset, *, max_obj_num: int = 1000, prefetch: bool = False):
+        self._queryset = queryset.order_by("created_on", "id")
+        self.max_obj_num = max_obj_num
 
-            if self._order_by:
-                chunk_queryset = chunk_queryset.order_by(*self._order_by)
+        # other connections can't see rows from an uncommitted transaction so in that case we fetch inline
+        self.prefetch = prefetch and not connections[self._queryset.db].in_atomic_block
 
-            if self._select_related:
-                chunk_queryset = chunk_queryset.select_related(*self._select_related)
+    def __iter__(self):
+        return self._iter_prefetched() if self.prefetch else self._iter_inline()
+
+    def _iter_inline(self):
+        after = None
+        while True:
+            batch, after = self._fetch(after)
+            if batch:
+                yield batch
+
+            if len(batch) < self.max_obj_num:
+                break
+
+    def _iter_prefetched(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        db = self._queryset.db
+        try:
+            future = executor.submit(self._fetch, None)
+            while future:
+                batch, after = future.result()
+
+                # start fetching the next batch before handing over this one
+                future = executor.submit(self._fetch, after) if len(batch) == self.max_obj_num else None
+
+                if batch:
+                    yield batch
+        finally:
+            # the worker thread has its own connection which needs closing
+            executor.submit(lambda: connections[db].close())
+            executor.shutdown(wait=True)
+
+    def _fetch(self, after: tuple) -> tuple:
+        """
+        Fetches the batch of messages after the given (created_on, id) key, returning it and the key of its last message
+        """
+        msgs = self._queryset
+        if after:
+            created_on, msg_id = after
+            # the >= bound lets the (org, created_on, id) index start its range scan at the key, and the OR then only
+            # has to filter out the messages with the same created_on that we've already seen
+            msgs = msgs.filter(created_on__gte=created_on).filter(
+                Q(created_on__gt=created_on) | Q(created_on=created_on, id__gt=msg_id)
+            )
 
-            if self._prefetch_related:
-                chunk_queryset = chunk_queryset.prefetch_related(*self._prefetch_related)
+        rows = list(msgs.values(*self.FIELDS)[: self.max_obj_num])
+        if not rows:
+            return [], after
 
-            yield chunk_queryset
+        labels_by_msg = defaultdict(list)
+        msg_labels = (
+            Msg.labels.through.objects.db_manager(self._queryset.db)
+            .filter(msg_id__in=[r["id"] for r in rows])
+            .order_by("label__name")
+            .values_list("msg_id", "label__uuid", "label__name")
+        )
+        for msg_id, label_uuid, label_name in msg_labels:
+            labels_by_msg[msg_id].append((label_uuid, label_name))
 
-    def __iter__(self):
-        return self
+        batch = [Msg.values_as_archive_json(r, labels_by_msg[r["id"]]) for r in rows]
 
-    def __next__(self):
-        return next(self._generator)
+        return batch, (rows[-1]["created_on"], rows[-1]["id"])
 
 
 class ExportMessagesTask(BaseExportTask):
@@ -1208,7 +1324,15 @@ class ExportMessagesTask(BaseExportTask):
         elif label:
             where["__raw__"] = f"'{label.uuid}' IN s.labels[*].uuid[*]"
 
-        records = Archive.iter_all_records(self.org, Archive.TYPE_MSG, start_date, end_date, where=where)
+        records = Archive.iter_all_records(
+            self.org,
+            Archive.TYPE_MSG,
+            start_date,
+            end_date,
+            where=where,
+            prefetch=settings.ARCHIVE_PREFETCH,
+            prefetch_max_size=settings.ARCHIVE_PREFETCH_MAX_SIZE,
+        )
         last_created_on = None
 
         for record_batch in chunk_list(records, 1000):
@@ -1238,27 +1362,17 @@ class ExportMessagesTask(BaseExportTask):
             messages = messages.filter(created_on__lte=end_date)
 
         if self.groups.all():
-            messages = messages.filter(contact__groups__in=self.groups.all())
+            # a semi-join so that contacts in several of the groups don't have their messages repeated
+            messages = messages.filter(contact__in=Contact.objects.filter(groups__in=self.groups.all()))
 
-        messages = messages.order_by("created_on").using("readonly")
+        messages = messages.using("readonly")
         if last_created_on:
             messages = messages.filter(created_on__gt=last_created_on)
 
-        all_message_ids = array(str("l"), messages.values_list("id", flat=True))
-
-        logger.info(
-            f"Msgs export #{self.id} for org #{self.org.id}: found {len(all_message_ids)} msgs in database to export"
-        )
+        logger.info(f"Msgs export #{self.id} for org #{self.org.id}: fetching msgs from database to export...")
 
-        prefetch = Prefetch("labels", queryset=Label.objects.order_by("name"))
-        for msg_batch in MsgIterator(
-            all_message_ids,
-            order_by=["" "created_on"],
-            select_related=["contact", "contact_urn", "channel", "flow"],
-            prefetch_related=[prefetch],
-        ):
-            # convert this batch of msgs to same format as records in our archives
-            yield [msg.as_archive_json() for msg in msg_batch]
+        # batches are fetched as values in the same format as records in our archives
+        yield from MsgIterator(messages, prefetch=True)
 
     def _write_msgs(self, book, msgs):
         # get all the contacts referenced in this batch
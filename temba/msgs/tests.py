@@ -20,6 +20,7 @@ from temba.msgs.models import (
     Label,
     LabelCount,
     Msg,
+    MsgIterator,
     SystemLabel,
     SystemLabelCount,
 )
@@ -27,6 +28,7 @@ from temba.schedules.models import Schedule
 from temba.tests import AnonymousOrg, CRUDLTestMixin, TembaTest
 from temba.tests.engine import MockSessionWriter
 from temba.tests.s3 import MockS3Client, jsonlgz_encode
+from temba.tickets.models import Ticket, Ticketer
 
 from .tasks import squash_msgcounts
 from .templatetags.sms import as_icon
@@ -116,6 +118,39 @@ class MsgTest(TembaTest):
             },
         )
 
+    def test_msg_iterator(self):
+        flow = self.create_flow("Color Flow")
+        created_on = datetime(2017, 1, 1, 10, tzinfo=pytz.UTC)
+        msg1 = self.create_incoming_msg(self.joe, "Hi", flow=flow, created_on=created_on)
+        msg2 = self.create_incoming_msg(self.frank, "Hello", attachments=["image:http://a.jpg"], created_on=created_on)
+        msg3 = self.create_outgoing_msg(self.joe, "Yo", created_on=datetime(2017, 1, 1, 9, tzinfo=pytz.UTC))
+        msg4 = self.create_outgoing_msg(self.kevin, "Hey", status=Msg.STATUS_SENT, sent_on=created_on)
+
+        label1 = self.create_label("Spam")
+        label2 = self.create_label("Important")
+        label1.toggle_label([msg1, msg2], add=True)
+        label2.toggle_label([msg1], add=True)
+
+        # batches are paged through by created_on then id, including across messages with the same created_on
+        with self.assertNumQueries(5):
+            batches = list(MsgIterator(Msg.objects.filter(org=self.org), max_obj_num=2))
+
+        self.assertEqual(
+            [[msg3.as_archive_json(), msg1.as_archive_json()], [msg2.as_archive_json(), msg4.as_archive_json()]],
+            batches,
+        )
+        self.assertEqual(["Important", "Spam"], [lb["name"] for lb in batches[0][1]["labels"]])
+
+        self.assertEqual([], list(MsgIterator(Msg.objects.filter(org=self.org2))))
+
+        # inside a transaction messages are fetched inline even if prefetching is requested
+        iterator = MsgIterator(Msg.objects.filter(org=self.org), prefetch=True)
+        self.assertFalse(iterator.prefetch)
+        self.assertEqual(
+            [[msg3.as_archive_json(), msg1.as_archive_json(), msg2.as_archive_json(), msg4.as_archive_json()]],
+            list(iterator),
+        )
+
     def test_delete(self):
         # create some incoming messages
         msg1 = self.create_incoming_msg(self.joe, "i'm having a problem", attachments=["image:http://a.jpg"])
@@ -145,6 +180,49 @@ class MsgTest(TembaTest):
         self.assertEqual(self.org._calculate_credits_used()[0], 2)  # used credits unchanged
         self.assertEqual(0, msg2.channel_logs.count())  # logs should be gone
 
+    def test_contact_last_msg(self):
+        def assert_last_msg(contact, msg):
+            contact.refresh_from_db()
+            self.assertEqual(msg.id if msg else None, contact.last_msg_id)
+
+        ticketer = Ticketer.create(self.org, self.admin, "mailgun", "Support Tickets", {})
+
+        # reference isn't maintained for contacts without open tickets
+        msg1 = self.create_incoming_msg(self.joe, "Hi")
+        assert_last_msg(self.joe, None)
+
+        # but is set when a ticket is opened
+        ticket = self.create_ticket(ticketer, self.joe, "Help")
+        assert_last_msg(self.joe, msg1)
+
+        msg2 = self.create_outgoing_msg(self.joe, "Hello")
+        self.create_incoming_msg(self.frank, "Hey")
+        assert_last_msg(self.joe, msg2)
+        assert_last_msg(self.frank, None)
+
+        # updating an older message doesn't change the reference
+        msg1.status = Msg.STATUS_PENDING
+        msg1.save(update_fields=("status",))
+        assert_last_msg(self.joe, msg2)
+
+        # deleting the last message falls back to the previous one
+        msg2.delete()
+        assert_last_msg(self.joe, msg1)
+
+        msg1.delete()
+        assert_last_msg(self.joe, None)
+
+        # once the ticket is closed, new messages don't update the reference
+        Ticket.objects.filter(id=ticket.id).update(status=Ticket.STATUS_CLOSED)
+        self.create_incoming_msg(self.joe, "Bye")
+        assert_last_msg(self.joe, None)
+
+        # and it's refreshed when the ticket is reopened
+        Ticket.objects.filter(id=ticket.id).update(status=Ticket.STATUS_OPEN)
+        msg4 = self.joe.msgs.get(text="Bye")
+        assert_last_msg(self.joe, msg4)
+        assert_last_msg(self.frank, None)
+
     def test_get_sync_commands(self):
         msg1 = self.create_outgoing_msg(self.joe, "Hello, we heard from you.")
         msg2 = self.create_outgoing_msg(self.frank, "Hello, we heard from you.")
@@ -871,7 +949,7 @@ class MsgTest(TembaTest):
 
         # perform the export manually, assert how many queries
         with self.mockReadOnly():
-            self.assertNumQueries(15, lambda: blocking_export.perform())
+            self.assertNumQueries(14, lambda: blocking_export.perform())
 
         blocking_export.refresh_from_db()
         # after performing the export `modified_on` should be updated
@@ -894,7 +972,7 @@ class MsgTest(TembaTest):
                 # make sure that we trigger logger
                 log_info_threshold.return_value = 5
 
-                with self.assertNumQueries(30):
+                with self.assertNumQueries(29):
                     self.assertExcelSheet(
                         request_export("?l=I", {"export_all": 1}),
                         [
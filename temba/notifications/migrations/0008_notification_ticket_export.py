@@ -0,0 +1,25 @@
+# Generated by Django 4.0.4 on 2022-06-14 15:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tickets", "0039_exportticketstatstask"),
+        ("notifications", "0007_remove_alert_notifications"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="ticket_export",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="notifications",
+                to="tickets.exportticketstatstask",
+            ),
+        ),
+    ]
@@ -13,6 +13,7 @@ from temba.contacts.models import ContactImport, ExportContactsTask
 from temba.flows.models import ExportFlowResultsTask
 from temba.msgs.models import ExportMessagesTask
 from temba.orgs.models import Org
+from temba.tickets.models import ExportTicketStatsTask
 from temba.utils.email import send_template_email
 from temba.utils.models import SquashableModel
 
@@ -255,6 +256,9 @@ class Notification(models.Model):
     results_export = models.ForeignKey(
         ExportFlowResultsTask, null=True, on_delete=models.PROTECT, related_name="notifications"
     )
+    ticket_export = models.ForeignKey(
+        ExportTicketStatsTask, null=True, on_delete=models.PROTECT, related_name="notifications"
+    )
     contact_import = models.ForeignKey(
         ContactImport, null=True, on_delete=models.PROTECT, related_name="notifications"
     )
@@ -275,6 +279,21 @@ class Notification(models.Model):
             **{export.notification_export_type + "_export": export},
         )
 
+    @classmethod
+    def import_finished(cls, imp):
+        """
+        Creates an import finished notification for the creator of the given import.
+        """
+
+        cls._create_all(
+            imp.org,
+            ImportFinishedNotificationType.slug,
+            scope=f"contact:{imp.id}",
+            users=[imp.created_by],
+            email_status=cls.EMAIL_STATUS_NONE,
+            contact_import=imp,
+        )
+
     @classmethod
     def incident_started(cls, incident):
         """
@@ -337,7 +356,7 @@ class Notification(models.Model):
 
     @cached_property
     def export(self):
-        return self.contact_export or self.message_export or self.results_export
+        return self.contact_export or self.message_export or self.results_export or self.ticket_export
 
     @property
     def type(self):
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 
 import pytz
 
@@ -12,6 +12,7 @@ from temba.flows.models import ExportFlowResultsTask
 from temba.msgs.models import ExportMessagesTask
 from temba.orgs.models import OrgRole
 from temba.tests import CRUDLTestMixin, TembaTest, matchers
+from temba.tickets.models import ExportTicketStatsTask
 
 from .models import Incident, Notification
 from .tasks import send_notification_emails, squash_notificationcounts
@@ -235,6 +236,32 @@ class NotificationTest(TembaTest):
         self.assertIn("Test Flow 1", mail.outbox[0].body)
         self.assertIn("Test Flow 2", mail.outbox[0].body)
 
+    def test_ticket_export_finished(self):
+        export = ExportTicketStatsTask.create(self.org, self.editor, date(2022, 6, 1), date(2022, 6, 8))
+        export.perform()
+
+        self.assertFalse(self.editor.notifications.get(ticket_export=export).is_seen)
+
+        # we only notify the user that started the export
+        self.assert_notifications(
+            after=export.created_on,
+            expected_json={
+                "type": "export:finished",
+                "created_on": matchers.ISODate(),
+                "target_url": f"/assets/download/ticket_stats_export/{export.id}/",
+                "is_seen": False,
+                "export": {"type": "ticket"},
+            },
+            expected_users={self.editor},
+            email=True,
+        )
+
+        send_notification_emails()
+
+        self.assertEqual(1, len(mail.outbox))
+        self.assertEqual("[Nyaruka] Your ticket export is ready", mail.outbox[0].subject)
+        self.assertEqual(["editor@nyaruka.com"], mail.outbox[0].recipients())
+
     def test_import_finished(self):
         imp = ContactImport.objects.create(
             org=self.org, mappings={}, num_records=5, created_by=self.editor, modified_by=self.editor
@@ -41,6 +41,7 @@ class NotificationCRUDL(SmartCRUDL):
             "contact_export",
             "message_export",
             "results_export",
+            "ticket_export",
             "incident",
         )
 
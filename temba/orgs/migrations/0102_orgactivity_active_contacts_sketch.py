@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2022-06-30 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orgs", "0101_remove_org_administrators_remove_org_agents_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orgactivity",
+            name="active_contacts_sketch",
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -3,7 +3,7 @@ import logging
 import os
 from abc import ABCMeta
 from collections import defaultdict
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from decimal import Decimal
 from enum import Enum
 from urllib.parse import quote, urlencode, urlparse
@@ -27,20 +27,20 @@ from django.core.exceptions import ValidationError
 from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
 from django.db import models, transaction
-from django.db.models import Count, F, Prefetch, Q, Sum
+from django.db.models import F, Prefetch, Q, Sum
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
-from temba import mailroom
 from temba.archives.models import Archive
 from temba.bundles import get_brand_bundles, get_bundle_map
 from temba.locations.models import AdminBoundary
 from temba.utils import chunk_list, json, languages
 from temba.utils.cache import get_cacheable_result
-from temba.utils.dates import datetime_to_str
+from temba.utils.dates import date_range, datetime_to_str
 from temba.utils.email import send_template_email
+from temba.utils.hyperloglog import HyperLogLog
 from temba.utils.models import JSONAsTextField, JSONField, SquashableModel
 from temba.utils.s3 import public_file_storage
 from temba.utils.text import generate_token, random_string
@@ -771,10 +771,12 @@ class Org(SmartModel):
             campaign.schedule_events_async()
 
         # with all the flows and dependencies committed, we can now have mailroom do full validation
-        for flow in new_flows:
-            flow_info = mailroom.get_client().flow_inspect(self.id, flow.get_definition())
+        definitions = [flow.get_definition() for flow in new_flows]
+
+        for flow, flow_info in zip(new_flows, Flow.inspect_definitions(self, definitions)):
             flow.has_issues = len(flow_info[Flow.INSPECT_ISSUES]) > 0
-            flow.save(update_fields=("has_issues",))
+
+        Flow.objects.bulk_update(new_flows, ["has_issues"])
 
     def clean_import(self, import_def):
         from temba.triggers.models import Trigger
@@ -1858,6 +1860,8 @@ class Org(SmartModel):
         Does an actual delete of this org
         """
 
+        from temba.channels.models import ChannelSendStatus
+
         assert not self.is_active and self.released_on, "can't delete an org which hasn't been released"
         assert not self.deleted_on, "can't delete an org twice"
 
@@ -1869,6 +1873,7 @@ class Org(SmartModel):
         self.exportcontactstasks.all().delete()
         self.exportmessagestasks.all().delete()
         self.exportflowresultstasks.all().delete()
+        self.exportticketstatstasks.all().delete()
 
         for label in self.msgs_labels.all():
             label.release(user)
@@ -1926,6 +1931,7 @@ class Org(SmartModel):
 
         # delete our channels
         for channel in self.channels.all():
+            ChannelSendStatus.objects.filter(channel=channel).delete()
             channel.counts.all().delete()
             channel.logs.all().delete()
             channel.template_translations.all().delete()
@@ -2314,6 +2320,7 @@ class TopUpCredits(SquashableModel):
     """
 
     squash_over = ("topup_id",)
+    squash_sum = ("used",)
 
     topup = models.ForeignKey(TopUp, on_delete=models.PROTECT)
     used = models.IntegerField()  # how many credits were used, can be negative
@@ -2473,6 +2480,9 @@ class OrgActivity(models.Model):
        * total # of active contacts in plan period up to that date (if there is one)
     """
 
+    # the maximum number of days to sketch from messages each time missing sketches are backfilled
+    BACKFILL_BATCH_SIZE = 100
+
     # the org this contact activity is being tracked for
     org = models.ForeignKey("orgs.Org", related_name="contact_activity", on_delete=models.CASCADE)
 
@@ -2494,76 +2504,195 @@ class OrgActivity(models.Model):
     # the number of active contacts in the plan period (if they are on a plan)
     plan_active_contact_count = models.IntegerField(null=True)
 
+    # sketch of the active contacts on this day, which can be merged with other days to count active contacts over time
+    active_contacts_sketch = models.BinaryField(null=True)
+
     @classmethod
     def update_day(cls, now):
         """
-        Updates our org activity for the passed in day.
+        Updates our org activity for the passed in day. Contact and message totals are read from our squashed counts,
+        and active contacts are counted into a sketch for the day, so that active contacts over a plan period can be
+        counted by merging daily sketches rather than scanning all the messages in that period.
         """
+        from temba.channels.models import ChannelCount
+        from temba.contacts.models import ContactGroup, ContactGroupCount
         from temba.msgs.models import Msg
 
         # truncate to midnight the same day in UTC
         end = pytz.utc.normalize(now.astimezone(pytz.utc)).replace(hour=0, minute=0, second=0, microsecond=0)
         start = end - timedelta(days=1)
 
-        # first get all our contact counts
-        contact_counts = Org.objects.filter(
-            is_active=True, contacts__is_active=True, contacts__created_on__lt=end
-        ).annotate(contact_count=Count("contacts"))
-
-        # then get active contacts
-        active_counts = Org.objects.filter(
-            is_active=True, msgs__created_on__gte=start, msgs__created_on__lt=end
-        ).annotate(contact_count=Count("msgs__contact_id", distinct=True))
-        active_counts = {o.id: o.contact_count for o in active_counts}
-
-        # number of received msgs
-        incoming_count = Org.objects.filter(
-            is_active=True, msgs__created_on__gte=start, msgs__created_on__lt=end, msgs__direction="I"
-        ).annotate(msg_count=Count("id"))
-        incoming_count = {o.id: o.msg_count for o in incoming_count}
-
-        # number of sent messages
-        outgoing_count = Org.objects.filter(
-            is_active=True, msgs__created_on__gte=start, msgs__created_on__lt=end, msgs__direction="O"
-        ).annotate(msg_count=Count("id"))
-        outgoing_count = {o.id: o.msg_count for o in outgoing_count}
-
-        # calculate active count in plan period for orgs with an active plan
+        # first get all our contact counts, which are the totals of the contact status groups
+        contact_counts = (
+            ContactGroupCount.objects.filter(
+                group__org__is_active=True,
+                group__org__created_on__lt=end,
+                group__group_type__in=ContactGroup.CONTACT_STATUS_TYPES,
+            )
+            .values_list("group__org_id")
+            .annotate(contact_count=Sum("count"))
+            .filter(contact_count__gt=0)
+            .order_by()
+        )
+
+        # then get our incoming and outgoing message counts from the channel counts for the day
+        incoming_count, outgoing_count = defaultdict(int), defaultdict(int)
+        for org_id, count_type, count in (
+            ChannelCount.objects.filter(
+                channel__org__is_active=True,
+                day=start.date(),
+                count_type__in=(
+                    ChannelCount.INCOMING_MSG_TYPE,
+                    ChannelCount.INCOMING_IVR_TYPE,
+                    ChannelCount.OUTGOING_MSG_TYPE,
+                    ChannelCount.OUTGOING_IVR_TYPE,
+                ),
+            )
+            .values_list("channel__org_id", "count_type")
+            .annotate(count=Sum("count"))
+            .order_by()
+        ):
+            if count_type in (ChannelCount.INCOMING_MSG_TYPE, ChannelCount.INCOMING_IVR_TYPE):
+                incoming_count[org_id] += count
+            else:
+                outgoing_count[org_id] += count
+
+        # then count and sketch the active contacts of each org, i.e. the contacts with messages on the day
+        active_counts, active_sketches = defaultdict(int), defaultdict(HyperLogLog)
+        active_contacts = (
+            Msg.objects.filter(created_on__gte=start, created_on__lt=end)
+            .values_list("org_id", "contact_id")
+            .distinct()
+            .order_by()
+        )
+        for org_id, contact_id in active_contacts.iterator(chunk_size=10000):
+            active_counts[org_id] += 1
+            active_sketches[org_id].add(contact_id)
+
+        # calculate active count in plan period for orgs with an active plan by merging their daily sketches
         plan_active_contact_counts = dict()
+        for parent, orgs in cls._get_plan_orgs(start):
+            plan_sketches = {org.id: HyperLogLog() for org in orgs}
+
+            # previous days in the plan period come from their stored sketches, and today from the one we just made.
+            # Days without a stored sketch are left to backfill_sketches rather than being sketched from messages here.
+            previous_days = cls.objects.filter(
+                org_id__in=plan_sketches.keys(), day__gte=parent.plan_start.date(), day__lt=start.date()
+            ).exclude(active_contacts_sketch=None)
+
+            for org_id, sketch in previous_days.values_list("org_id", "active_contacts_sketch"):
+                plan_sketches[org_id].merge(HyperLogLog.from_bytes(bytes(sketch)))
+
+            for org_id, sketch in plan_sketches.items():
+                if org_id in active_sketches:
+                    sketch.merge(active_sketches[org_id])
+
+                plan_active_contact_counts[org_id] = sketch.count()
+
+        activities = []
+        for org_id, contact_count in contact_counts:
+            sketch = active_sketches.get(org_id)
+            activities.append(
+                cls(
+                    org_id=org_id,
+                    day=start.date(),
+                    contact_count=contact_count,
+                    active_contact_count=active_counts.get(org_id, 0),
+                    incoming_count=incoming_count.get(org_id, 0),
+                    outgoing_count=outgoing_count.get(org_id, 0),
+                    plan_active_contact_count=plan_active_contact_counts.get(org_id),
+                    active_contacts_sketch=(sketch or HyperLogLog()).to_bytes(),
+                )
+            )
+
+        with transaction.atomic():
+            cls.objects.filter(day=start.date()).delete()
+            cls.objects.bulk_create(activities, batch_size=1000)
+
+    @classmethod
+    def backfill_sketches(cls, now, limit: int) -> int:
+        """
+        Sketches the active contacts of previous days in current plan periods which don't have a stored sketch, e.g.
+        from before we stored them or days we have no activity row for. At most limit days are sketched from their
+        messages per call, and each is saved so that it's never sketched again. Returns the number of days sketched.
+        """
+        end = pytz.utc.normalize(now.astimezone(pytz.utc)).replace(hour=0, minute=0, second=0, microsecond=0)
+        start = end - timedelta(days=1)
+
+        missing = []
+        for parent, orgs in cls._get_plan_orgs(start):
+            sketched = set(
+                cls.objects.filter(
+                    org_id__in=[o.id for o in orgs], day__gte=parent.plan_start.date(), day__lt=start.date()
+                )
+                .exclude(active_contacts_sketch=None)
+                .values_list("org_id", "day")
+            )
+
+            for org in orgs:
+                # workspaces created during the plan period have nothing to sketch before they existed
+                first_day = max(parent.plan_start.date(), org.created_on.astimezone(pytz.utc).date())
+
+                for day in date_range(first_day, start.date()):
+                    if (org.id, day) not in sketched:
+                        missing.append((org.id, day))
+
+            if len(missing) >= limit:
+                break
+
+        missing = missing[:limit]
+
+        for org_id, day in missing:
+            sketch = cls._sketch_active_contacts(org_id, day)
+            cls.objects.update_or_create(
+                org_id=org_id, day=day, defaults={"active_contacts_sketch": sketch.to_bytes()}
+            )
+
+        return len(missing)
+
+    @classmethod
+    def _get_plan_orgs(cls, start) -> list:
+        """
+        Gets the orgs with a plan period that hasn't ended before the given time, as tuples of the org and all the
+        orgs whose activity counts towards its plan, i.e. itself and any workspaces that share its usage
+        """
+        plan_orgs = []
         for parent in (
             Org.objects.exclude(plan_end=None)
             .exclude(plan_start=None)
             .exclude(plan_end__lt=start)
             .exclude(plan=settings.WORKSPACE_PLAN)
-            .only("plan_start", "plan_end")
+            .only("plan", "plan_start", "plan_end", "created_on", "brand")
         ):
-            plan_end = parent.plan_end if parent.plan_end < end else end
             orgs = [parent]
 
             # find our shared usage and collect their stats too
             if parent.has_shared_usage():
-                for child_org in Org.objects.filter(parent=parent, is_active=True):
-                    orgs.append(child_org)
+                orgs += list(Org.objects.filter(parent=parent, is_active=True).only("created_on"))
 
-            for org in orgs:
-                count = (
-                    Msg.objects.filter(org=org, created_on__gt=parent.plan_start, created_on__lt=plan_end)
-                    .only("contact")
-                    .distinct("contact")
-                    .count()
-                )
-                plan_active_contact_counts[org.id] = count
-
-        for org in contact_counts:
-            OrgActivity.objects.update_or_create(
-                org=org,
-                day=start,
-                contact_count=org.contact_count,
-                active_contact_count=active_counts.get(org.id, 0),
-                incoming_count=incoming_count.get(org.id, 0),
-                outgoing_count=outgoing_count.get(org.id, 0),
-                plan_active_contact_count=plan_active_contact_counts.get(org.id),
-            )
+            plan_orgs.append((parent, orgs))
+
+        return plan_orgs
+
+    @classmethod
+    def _sketch_active_contacts(cls, org_id: int, day) -> HyperLogLog:
+        """
+        Sketches the active contacts of an org on the given day from its messages
+        """
+        from temba.msgs.models import Msg
+
+        start = datetime.combine(day, time.min, tzinfo=pytz.utc)
+        contact_ids = (
+            Msg.objects.filter(org_id=org_id, created_on__gte=start, created_on__lt=start + timedelta(days=1))
+            .values_list("contact_id", flat=True)
+            .distinct()
+            .order_by()
+        )
+
+        sketch = HyperLogLog()
+        for contact_id in contact_ids.iterator(chunk_size=10000):
+            sketch.add(contact_id)
+        return sketch
 
     class Meta:
         unique_together = ("org", "day")
@@ -90,6 +90,17 @@ def update_org_activity(now=None):
     OrgActivity.update_day(now)
 
 
+@nonoverlapping_task(
+    track_started=True,
+    name="backfill_org_activity_sketches",
+    lock_key="backfill_org_activity_sketches",
+    lock_timeout=7200,
+)
+def backfill_org_activity_sketches(now=None):
+    now = now if now else timezone.now()
+    OrgActivity.backfill_sketches(now, limit=OrgActivity.BACKFILL_BATCH_SIZE)
+
+
 @nonoverlapping_task(
     track_started=True, name="suspend_topup_orgs_task", lock_key="suspend_topup_orgs_task", lock_timeout=7200
 )
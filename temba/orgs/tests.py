@@ -64,6 +64,7 @@ from temba.tickets.models import Ticketer
 from temba.tickets.types.mailgun import MailgunType
 from temba.triggers.models import Trigger
 from temba.utils import json, languages
+from temba.utils.hyperloglog import HyperLogLog
 
 from .context_processors import RolePermsWrapper
 from .models import CreditAlert, Invitation, Org, OrgRole, TopUp, TopUpCredits, User
@@ -4755,7 +4756,7 @@ class BulkExportTest(TembaTest):
                 "parent_refs": [],
             },
             {
-                # second call is in save_revision and passes org to validate dependencies, but during import those
+                # second call is after cloning and passes org to validate dependencies, but during import those
                 # dependencies which didn't exist already are created in a transaction and mailroom can't see them
                 "dependencies": [{"key": "age", "name": "", "type": "field", "missing": True}],
                 "issues": [{"type": "missing_dependency"}],
@@ -4778,6 +4779,24 @@ class BulkExportTest(TembaTest):
 
         self.assertFalse(flow.has_issues)
 
+    @patch("temba.utils.analytics.gauge")
+    def test_import_flow_phases(self, mock_gauge):
+        self.import_file("the_clinic")
+
+        self.assertEqual(8, Flow.objects.filter(org=self.org, is_system=False).count())
+
+        # each phase of importing the flows is timed
+        gauges = [c.args[0] for c in mock_gauge.call_args_list if c.args[0].startswith("temba.flow_import_")]
+        self.assertEqual(
+            [
+                "temba.flow_import_inspect_time",
+                "temba.flow_import_dependencies_time",
+                "temba.flow_import_clone_time",
+                "temba.flow_import_save_time",
+            ],
+            gauges,
+        )
+
     def test_import_missing_flow_dependency(self):
         # in production this would blow up validating the flow but we can't do that during tests
         self.import_file("parent_without_its_child")
@@ -5593,7 +5612,7 @@ class StripeCreditsTest(TembaTest):
 
 class OrgActivityTest(TembaTest):
     def test_get_dependencies(self):
-        from temba.orgs.tasks import update_org_activity
+        from temba.orgs.tasks import backfill_org_activity_sketches, update_org_activity
 
         now = timezone.now()
 
@@ -5604,12 +5623,13 @@ class OrgActivityTest(TembaTest):
         workspace = self.org.create_sub_org("Workspace")
         self.assertEqual(workspace.plan, settings.WORKSPACE_PLAN)
 
+        self.create_channel("A", "Workspace Channel", "+12065551000", org=workspace)
         mark = self.create_contact("Mark S", phone="+12065551212", org=workspace)
         self.create_incoming_msg(mark, "I'm feeling uneasy")
         self.create_outgoing_msg(mark, "Please try to enjoy each text equally.")
 
         # create a few contacts
-        self.create_contact("Marshawn", phone="+14255551212")
+        marshawn = self.create_contact("Marshawn", phone="+14255551212")
         russell = self.create_contact("Marshawn", phone="+14255551313")
 
         # create some messages for russel
@@ -5659,6 +5679,55 @@ class OrgActivityTest(TembaTest):
         self.assertEqual(1, activity.outgoing_count)
         self.assertEqual(1, activity.plan_active_contact_count)
 
+        # the next day, russell is active again along with marshawn
+        self.create_incoming_msg(marshawn, "hike", created_on=now + timedelta(days=1))
+        self.create_incoming_msg(russell, "touchdown", created_on=now + timedelta(days=1))
+
+        update_org_activity(now + timedelta(days=2))
+
+        activity = OrgActivity.objects.get(org=self.org, day=(now + timedelta(days=1)).date())
+        self.assertEqual(2, activity.contact_count)
+        self.assertEqual(2, activity.active_contact_count)
+        self.assertEqual(2, activity.incoming_count)
+        self.assertEqual(0, activity.outgoing_count)
+        self.assertEqual(2, activity.plan_active_contact_count)  # merged with previous day so russell counted once
+
+        activity = OrgActivity.objects.get(org=workspace, day=(now + timedelta(days=1)).date())
+        self.assertEqual(0, activity.active_contact_count)
+        self.assertEqual(0, HyperLogLog.from_bytes(bytes(activity.active_contacts_sketch)).count())
+        self.assertEqual(1, activity.plan_active_contact_count)
+
+        # days without a stored sketch, e.g. from before we stored them or without an activity row, aren't sketched
+        # from their messages by the nightly update
+        OrgActivity.objects.filter(org=self.org, day=now.date()).update(active_contacts_sketch=None)
+        OrgActivity.objects.filter(org=workspace, day=now.date()).delete()
+
+        update_org_activity(now + timedelta(days=2))
+
+        activity = OrgActivity.objects.get(org=workspace, day=(now + timedelta(days=1)).date())
+        self.assertEqual(0, activity.plan_active_contact_count)
+
+        # instead they're backfilled in batches
+        self.assertEqual(1, OrgActivity.backfill_sketches(now + timedelta(days=2), limit=1))
+        self.assertIsNotNone(OrgActivity.objects.get(org=self.org, day=now.date()).active_contacts_sketch)
+        self.assertFalse(OrgActivity.objects.filter(org=workspace, day=now.date()).exists())
+
+        backfill_org_activity_sketches(now + timedelta(days=2))
+
+        activity = OrgActivity.objects.get(org=workspace, day=now.date())
+        self.assertEqual(1, HyperLogLog.from_bytes(bytes(activity.active_contacts_sketch)).count())
+
+        # and only once
+        self.assertEqual(0, OrgActivity.backfill_sketches(now + timedelta(days=2), limit=100))
+
+        update_org_activity(now + timedelta(days=2))
+
+        activity = OrgActivity.objects.get(org=self.org, day=(now + timedelta(days=1)).date())
+        self.assertEqual(2, activity.plan_active_contact_count)
+
+        activity = OrgActivity.objects.get(org=workspace, day=(now + timedelta(days=1)).date())
+        self.assertEqual(1, activity.plan_active_contact_count)
+
 
 class BackupTokenTest(TembaTest):
     def test_model(self):
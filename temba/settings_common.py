@@ -87,6 +87,15 @@ AWS_BUCKET_DOMAIN = AWS_STORAGE_BUCKET_NAME + ".s3.amazonaws.com"
 # bucket where archives files are stored
 ARCHIVE_BUCKET = "dl-temba-archives"
 
+# how many archives exports fetch concurrently (0 to disable), spooling them to temporary files, and a cap on the
+# compressed size of the archives being prefetched
+ARCHIVE_PREFETCH = 0
+ARCHIVE_PREFETCH_MAX_SIZE = 25 * 1024 * 1024
+
+# local directory where archive files are cached by their hashes (None to disable) and the max total size of that cache
+ARCHIVE_CACHE_DIR = None
+ARCHIVE_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
 # -----------------------------------------------------------------------------------
 # On Unix systems, a value of None will cause Django to use the same
 # timezone as the operating system.
@@ -1008,6 +1017,7 @@ CELERY_BROKER_URL = "redis://%s:%d/%d" % (REDIS_HOST, REDIS_PORT, REDIS_DB)
 CELERY_BROKER_TRANSPORT_OPTIONS = {"socket_timeout": 5}
 
 CELERY_BEAT_SCHEDULE = {
+    "backfill-org-activity-sketches": {"task": "backfill_org_activity_sketches", "schedule": timedelta(seconds=900)},
     "check-channels": {"task": "check_channels_task", "schedule": timedelta(seconds=300)},
     "check-credits": {"task": "check_credits_task", "schedule": timedelta(seconds=900)},
     "check-elasticsearch-lag": {"task": "check_elasticsearch_lag", "schedule": timedelta(seconds=300)},
@@ -1286,11 +1296,43 @@ RETENTION_PERIODS = {
     "webhookevent": timedelta(hours=48),
 }
 
+# trimming deletes in batches of this size, stops after the time budget (in seconds) to resume on its next run, and
+# pauses between batches while the readonly replica is lagging by more than the given number of seconds
+TRIM_BATCH_SIZE = 1000
+TRIM_TIME_BUDGET = 0 if TESTING else 600
+TRIM_MAX_REPLICA_LAG = 10
+
+# -----------------------------------------------------------------------------------
+# Count squashing - "bulk" collapses all unsquashed sets of a count model in a few set-based statements, optionally
+# partitioned across a pool of workers, and "sets" squashes one distinct set at a time
+# -----------------------------------------------------------------------------------
+SQUASH_MODE = "bulk"
+SQUASH_WORKERS = 4
+SQUASH_BATCH_SIZE = 5000
+
 # -----------------------------------------------------------------------------------
 # Mailroom
 # -----------------------------------------------------------------------------------
 MAILROOM_URL = None
 MAILROOM_AUTH_TOKEN = None
+MAILROOM_CONNECT_TIMEOUT = 5  # seconds
+MAILROOM_READ_TIMEOUT = 60  # seconds
+MAILROOM_POOL_SIZE = 10
+MAILROOM_RETRIES = 2  # max retries of idempotent requests after connection errors or 502/503/504 responses
+FLOW_IMPORT_WORKERS = 4  # max concurrent requests to mailroom when importing flows
+
+# how long (in seconds) to memoize parsed queries and search results from mailroom, 0 to disable
+SEARCH_PARSE_CACHE_TTL = 0 if TESTING else 60
+SEARCH_RESULTS_CACHE_TTL = 0 if TESTING else 10
+
+# how long (in seconds) to cache the events of ended sessions for contact history, 0 to disable
+SESSION_EVENTS_CACHE_TTL = 0 if TESTING else 60 * 60
+
+# how long (in seconds) to cache the current definitions of flows and the results of migrating revisions, 0 to disable
+FLOW_DEFINITION_CACHE_TTL = 0 if TESTING else 60 * 60
+
+# record cache hit and miss stats for one in this many cache lookups, scaled up to estimate the totals
+CACHE_STATS_SAMPLE = 1 if TESTING else 100
 
 # To allow manage fields to support up to 1000 fields
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 4000
@@ -1301,3 +1343,9 @@ MACHINE_HOSTNAME = socket.gethostname().split(".")[0]
 
 # ElasticSearch configuration (URL RFC-1738)
 ELASTICSEARCH_URL = os.environ.get("ELASTICSEARCH_URL", "http://localhost:9200")
+ELASTICSEARCH_TIMEOUT = 30  # seconds before a request is retried
+ELASTICSEARCH_MAX_RETRIES = 3
+ELASTICSEARCH_MAX_CONNECTIONS = 10  # per node, shared by all threads of a process
+
+# number of sliced scrolls used in parallel to fetch the contact ids of large exports
+ELASTICSEARCH_SCROLL_SLICES = 1 if TESTING else 4
@@ -352,6 +352,22 @@ CREATE OR REPLACE FUNCTION temba_insert_channelcount(_channel_id INTEGER, _count
   END;
 $$ LANGUAGE plpgsql;
 
+----------------------------------------------------------------------
+-- Moves a channel's last sent time forward. To avoid contention on busy channels, it's only written when it has moved
+-- forward by more than a few minutes, which is plenty accurate for alerting.
+----------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION temba_update_channel_last_sent(_channel_id INTEGER, _sent_on TIMESTAMP WITH TIME ZONE) RETURNS VOID AS $$
+BEGIN
+  UPDATE channels_channelsendstatus SET last_sent_on = _sent_on
+  WHERE channel_id = _channel_id AND (last_sent_on IS NULL OR last_sent_on < _sent_on - INTERVAL '5 minutes');
+
+  IF NOT FOUND THEN
+    INSERT INTO channels_channelsendstatus(channel_id, last_sent_on) VALUES(_channel_id, _sent_on)
+    ON CONFLICT (channel_id) DO NOTHING;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+
 CREATE OR REPLACE FUNCTION temba_insert_flowcategorycount(_flow_id integer, result_key text, _result json, _count integer)
  RETURNS void
  LANGUAGE plpgsql
@@ -578,6 +594,15 @@ BEGIN
       PERFORM temba_insert_broadcastmsgcount(NEW.broadcast_id, 1);
     END IF;
 
+    -- update the contact's reference to their last message, which is only maintained for contacts with open tickets
+    UPDATE contacts_contact SET last_msg_id = NEW.id
+    WHERE id = NEW.contact_id AND ticket_count > 0 AND (last_msg_id IS NULL OR last_msg_id < NEW.id);
+
+    -- message was created as already sent so update its channel's last sent time
+    IF NEW.direction = 'O' AND NEW.channel_id IS NOT NULL AND NEW.sent_on IS NOT NULL THEN
+      PERFORM temba_update_channel_last_sent(NEW.channel_id, NEW.sent_on);
+    END IF;
+
   -- existing message updated
   ELSIF TG_OP = 'UPDATE' THEN
     _old_label_type := temba_msg_determine_system_label(OLD);
@@ -608,6 +633,11 @@ BEGIN
       PERFORM temba_insert_broadcastmsgcount(NEW.broadcast_id, 1);
     END IF;
 
+    -- message has been sent so update its channel's last sent time
+    IF NEW.direction = 'O' AND NEW.channel_id IS NOT NULL AND NEW.sent_on IS DISTINCT FROM OLD.sent_on AND NEW.sent_on IS NOT NULL THEN
+      PERFORM temba_update_channel_last_sent(NEW.channel_id, NEW.sent_on);
+    END IF;
+
   -- existing message deleted
   ELSIF TG_OP = 'DELETE' THEN
     _old_label_type := temba_msg_determine_system_label(OLD);
@@ -615,12 +645,29 @@ BEGIN
     IF _old_label_type IS NOT NULL THEN
       PERFORM temba_insert_system_label(OLD.org_id, _old_label_type, -1);
     END IF;
+
+    -- if this was the contact's last message, fall back to their previous message
+    UPDATE contacts_contact SET last_msg_id = temba_contact_last_msg_id(OLD.contact_id, OLD.id)
+    WHERE id = OLD.contact_id AND ticket_count > 0 AND last_msg_id = OLD.id;
   END IF;
 
   RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
+----------------------------------------------------------------------
+-- Gets the id of the given contact's most recent message, excluding the given message
+----------------------------------------------------------------------
+CREATE OR REPLACE FUNCTION temba_contact_last_msg_id(_contact_id INT, _exclude_id BIGINT) RETURNS BIGINT AS $$
+BEGIN
+  -- ordered to use the index on (contact_id, created_on DESC)
+  RETURN (
+    SELECT id FROM msgs_msg WHERE contact_id = _contact_id AND id IS DISTINCT FROM _exclude_id
+    ORDER BY created_on DESC, id DESC LIMIT 1
+  );
+END;
+$$ LANGUAGE plpgsql;
+
 ----------------------------------------------------------------------
 -- Trigger procedure to notification counts on notification changes
 ----------------------------------------------------------------------
@@ -659,7 +706,8 @@ BEGIN
     PERFORM temba_insert_ticketcount(NEW.org_id, NEW.assignee_id, NEW.status, 1);
 
     IF NEW.status = 'O' THEN
-      UPDATE contacts_contact SET ticket_count = ticket_count + 1, modified_on = NOW() WHERE id = NEW.contact_id;
+      UPDATE contacts_contact SET ticket_count = ticket_count + 1, modified_on = NOW(),
+      last_msg_id = temba_contact_last_msg_id(NEW.contact_id, NULL) WHERE id = NEW.contact_id;
     END IF;
   ELSIF TG_OP = 'UPDATE' THEN -- existing ticket updated
     IF OLD.assignee_id IS DISTINCT FROM NEW.assignee_id OR OLD.status != NEW.status THEN
@@ -670,7 +718,8 @@ BEGIN
     IF OLD.status = 'O' AND NEW.status = 'C' THEN -- ticket closed
       UPDATE contacts_contact SET ticket_count = ticket_count - 1, modified_on = NOW() WHERE id = OLD.contact_id;
     ELSIF OLD.status = 'C' AND NEW.status = 'O' THEN -- ticket reopened
-      UPDATE contacts_contact SET ticket_count = ticket_count + 1, modified_on = NOW() WHERE id = OLD.contact_id;
+      UPDATE contacts_contact SET ticket_count = ticket_count + 1, modified_on = NOW(),
+      last_msg_id = temba_contact_last_msg_id(OLD.contact_id, NULL) WHERE id = OLD.contact_id;
     END IF;
   ELSIF TG_OP = 'DELETE' THEN -- existing ticket deleted
     PERFORM temba_insert_ticketcount(OLD.org_id, OLD.assignee_id, OLD.status, -1);
@@ -24,6 +24,7 @@ class ESMockWithScroll:
             "_scroll_id": "1",
             "hits": {"hits": []},
         }
+        patched_object.count.return_value = {"count": len(self.data)}
 
         return patched_object()
 
@@ -55,5 +56,6 @@ class ESMockWithScrollMultiple(ESMockWithScroll):
             }
             for _ in range(len(self.data))
         ]
+        patched_object.count.side_effect = [{"count": len(return_value)} for return_value in self.data]
 
         return patched_object()
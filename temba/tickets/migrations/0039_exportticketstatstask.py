@@ -0,0 +1,106 @@
+# Generated by Django 4.0.4 on 2022-06-14 15:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+import temba.utils.json
+import temba.utils.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("orgs", "0101_remove_org_administrators_remove_org_agents_and_more"),
+        ("tickets", "0038_remove_ticket_tickets_ticketer_external_id_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExportTicketStatsTask",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "is_active",
+                    models.BooleanField(
+                        default=True, help_text="Whether this item is active, use this instead of deleting"
+                    ),
+                ),
+                (
+                    "created_on",
+                    models.DateTimeField(
+                        blank=True,
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        help_text="When this item was originally created",
+                    ),
+                ),
+                (
+                    "modified_on",
+                    models.DateTimeField(
+                        blank=True,
+                        default=django.utils.timezone.now,
+                        editable=False,
+                        help_text="When this item was last modified",
+                    ),
+                ),
+                (
+                    "uuid",
+                    models.CharField(
+                        db_index=True,
+                        default=temba.utils.models.generate_uuid,
+                        help_text="The unique identifier for this object",
+                        max_length=36,
+                        unique=True,
+                        verbose_name="Unique Identifier",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("P", "Pending"), ("O", "Processing"), ("C", "Complete"), ("F", "Failed")],
+                        default="P",
+                        max_length=1,
+                    ),
+                ),
+                (
+                    "stats",
+                    temba.utils.models.JSONField(
+                        decoder=temba.utils.json.TembaDecoder, encoder=temba.utils.json.TembaEncoder, null=True
+                    ),
+                ),
+                ("since", models.DateField()),
+                ("until", models.DateField()),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        help_text="The user which originally created this item",
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="%(app_label)s_%(class)s_creations",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "modified_by",
+                    models.ForeignKey(
+                        help_text="The user which last modified this item",
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="%(app_label)s_%(class)s_modifications",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "org",
+                    models.ForeignKey(
+                        help_text="The organization of the user.",
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="%(class)ss",
+                        to="orgs.org",
+                    ),
+                ),
+            ],
+            options={"abstract": False},
+        ),
+    ]
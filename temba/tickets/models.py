@@ -1,9 +1,12 @@
+import logging
+import time
 from abc import ABCMeta
-from datetime import date
+from datetime import date, datetime
 
-import openpyxl
+from xlsxlite.writer import XLSXBook
 
 from django.conf import settings
+from django.core.files.temp import NamedTemporaryFile
 from django.db import models
 from django.db.models import Q, Sum
 from django.db.models.functions import Lower
@@ -13,12 +16,16 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from temba import mailroom
+from temba.assets.models import register_asset_store
 from temba.contacts.models import Contact
 from temba.orgs.models import DependencyMixin, Org, User, UserSettings
 from temba.utils.dates import date_range
+from temba.utils.export import BaseExportAssetStore, BaseExportTask
 from temba.utils.models import DailyCountModel, DailyTimingModel, SquashableModel, TembaModel
 from temba.utils.uuid import uuid4
 
+logger = logging.getLogger(__name__)
+
 
 class TicketerType(metaclass=ABCMeta):
     """
@@ -400,7 +407,7 @@ class TicketCount(SquashableModel):
     Counts of tickets by assignment and status
     """
 
-    SQUASH_OVER = ("org_id", "assignee_id", "status")
+    squash_over = ("org_id", "assignee_id", "status")
 
     org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="ticket_counts")
     assignee = models.ForeignKey(User, null=True, on_delete=models.PROTECT, related_name="ticket_counts")
@@ -519,6 +526,21 @@ class TicketDailyCount(DailyCountModel):
     def get_by_users(cls, org, users, count_type: str, since=None, until=None):
         return cls._get_count_set(count_type, {f"o:{org.id}:u:{u.id}": u for u in users}, since, until)
 
+    @classmethod
+    def get_user_day_totals(cls, org, users, count_types: tuple, since, until) -> dict:
+        """
+        Gets per-day totals of the given count types for each of the given users in a single grouped query, as a dict
+        of (count_type, user, day) to total
+        """
+        scopes = {f"o:{org.id}:u:{u.id}": u for u in users}
+        totals = (
+            cls.objects.filter(count_type__in=count_types, scope__in=scopes.keys(), day__gte=since, day__lt=until)
+            .values_list("count_type", "scope", "day")
+            .annotate(total=Sum("count"))
+            .order_by()
+        )
+        return {(count_type, scopes[scope], day): total for count_type, scope, day, total in totals}
+
     class Meta:
         indexes = [
             models.Index(name="tickets_dailycount_type_scope", fields=("count_type", "scope", "day")),
@@ -553,62 +575,90 @@ class TicketDailyTiming(DailyTimingModel):
         ]
 
 
-def export_ticket_stats(org: Org, since: date, until: date) -> openpyxl.Workbook:
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    sheet.title = "Tickets"
-    sheet.merge_cells("A1:A2")
-    sheet.cell(row=1, column=2, value="Workspace")
-    sheet.merge_cells("B1:D1")
-    sheet.cell(row=2, column=2, value="Opened")
-    sheet.cell(row=2, column=3, value="Replies")
-    sheet.cell(row=2, column=4, value="Reply Time (Secs)")
-
-    users = list(org.users.order_by("email"))
-
-    user_col = 5
-    for user in users:
-        cell = sheet.cell(row=1, column=user_col, value=str(user))
-        cell.hyperlink = f"mailto:{user.email}"
-        cell.style = "Hyperlink"
-        sheet.merge_cells(start_row=1, start_column=user_col, end_row=1, end_column=user_col + 1)
-
-        sheet.cell(row=2, column=user_col, value="Assigned")
-        sheet.cell(row=2, column=user_col + 1, value="Replies")
-        user_col += 2
-
-    def by_day(cs: list) -> dict:
-        return {c[0]: c[1] for c in cs}
-
-    org_openings = by_day(TicketDailyCount.get_by_org(org, TicketDailyCount.TYPE_OPENING, since, until).day_totals())
-    org_replies = by_day(TicketDailyCount.get_by_org(org, TicketDailyCount.TYPE_REPLY, since, until).day_totals())
-    org_avg_reply_time = by_day(
-        TicketDailyTiming.get_by_org(org, TicketDailyTiming.TYPE_FIRST_REPLY, since, until).day_averages(rounded=True)
-    )
+class ExportTicketStatsTask(BaseExportTask):
+    """
+    Export of daily ticket activity stats for a workspace and each of its users
+    """
 
-    user_assignments = {}
-    user_replies = {}
-    for user in users:
-        user_assignments[user] = by_day(
-            TicketDailyCount.get_by_users(org, [user], TicketDailyCount.TYPE_ASSIGNMENT, since, until).day_totals()
-        )
-        user_replies[user] = by_day(
-            TicketDailyCount.get_by_users(org, [user], TicketDailyCount.TYPE_REPLY, since, until).day_totals()
-        )
+    analytics_key = "ticket_stats_export"
+    notification_export_type = "ticket"
 
-    day_row = 3
-    for day in date_range(since, until):
-        sheet.cell(row=day_row, column=1, value=day)
-        sheet.cell(row=day_row, column=2, value=org_openings.get(day, 0))
-        sheet.cell(row=day_row, column=3, value=org_replies.get(day, 0))
-        sheet.cell(row=day_row, column=4, value=org_avg_reply_time.get(day, ""))
+    since = models.DateField()
+    until = models.DateField()
 
-        user_col = 5
+    @classmethod
+    def create(cls, org, user, since: date, until: date):
+        return cls.objects.create(org=org, since=since, until=until, created_by=user, modified_by=user)
+
+    def write_export(self):
+        org = self.org
+        users = list(org.users.order_by("email"))
+
+        book = XLSXBook()
+        sheet = book.add_sheet("Tickets")
+
+        # workbook is streamed so headers can't be merged cells, which means user names go above their first column
+        header1, header2 = ["", "Workspace", "", ""], ["", "Opened", "Replies", "Reply Time (Secs)"]
         for user in users:
-            sheet.cell(row=day_row, column=user_col, value=user_assignments[user].get(day, 0))
-            sheet.cell(row=day_row, column=user_col + 1, value=user_replies[user].get(day, 0))
-            user_col += 2
+            header1 += [str(user), ""]
+            header2 += ["Assigned", "Replies"]
+
+        sheet.append_row(*header1)
+        sheet.append_row(*header2)
+
+        def by_day(cs: list) -> dict:
+            return {c[0]: c[1] for c in cs}
 
-        day_row += 1
+        org_openings = by_day(
+            TicketDailyCount.get_by_org(org, TicketDailyCount.TYPE_OPENING, self.since, self.until).day_totals()
+        )
+        org_replies = by_day(
+            TicketDailyCount.get_by_org(org, TicketDailyCount.TYPE_REPLY, self.since, self.until).day_totals()
+        )
+        org_avg_reply_time = by_day(
+            TicketDailyTiming.get_by_org(org, TicketDailyTiming.TYPE_FIRST_REPLY, self.since, self.until).day_averages(
+                rounded=True
+            )
+        )
+        user_totals = TicketDailyCount.get_user_day_totals(
+            org, users, (TicketDailyCount.TYPE_ASSIGNMENT, TicketDailyCount.TYPE_REPLY), self.since, self.until
+        )
 
-    return workbook
+        start = time.time()
+
+        for day in date_range(self.since, self.until):
+            row = [
+                datetime.combine(day, datetime.min.time()),
+                org_openings.get(day, 0),
+                org_replies.get(day, 0),
+                org_avg_reply_time.get(day, ""),
+            ]
+            for user in users:
+                row.append(user_totals.get((TicketDailyCount.TYPE_ASSIGNMENT, user, day), 0))
+                row.append(user_totals.get((TicketDailyCount.TYPE_REPLY, user, day), 0))
+
+            sheet.append_row(*row)
+            self.num_rows += 1
+
+            if self.num_rows % self.LOG_PROGRESS_PER_ROWS == 0:  # pragma: no cover
+                mins = (time.time() - start) / 60
+                logger.info(
+                    f"Ticket stats export #{self.id} for org #{org.id}: exported {self.num_rows} in {mins:.1f} mins"
+                )
+
+                self.modified_on = timezone.now()
+                self.save(update_fields=("modified_on",))
+
+        temp = NamedTemporaryFile(delete=True, suffix=".xlsx", mode="wb+")
+        book.finalize(to_file=temp)
+        temp.flush()
+        return temp, "xlsx"
+
+
+@register_asset_store
+class TicketStatsExportAssetStore(BaseExportAssetStore):
+    model = ExportTicketStatsTask
+    key = "ticket_stats_export"
+    directory = "ticket_stats_exports"
+    permission = "tickets.ticket_export_stats"
+    extensions = ("xlsx",)
@@ -1,6 +1,8 @@
+from celery import shared_task
+
 from temba.utils.celery import nonoverlapping_task
 
-from .models import TicketCount, TicketDailyCount, TicketDailyTiming
+from .models import ExportTicketStatsTask, TicketCount, TicketDailyCount, TicketDailyTiming
 
 
 @nonoverlapping_task(track_started=True, name="squash_ticketcounts", lock_timeout=7200)
@@ -8,3 +10,11 @@ def squash_ticketcounts():
     TicketCount.squash()
     TicketDailyCount.squash()
     TicketDailyTiming.squash()
+
+
+@shared_task(track_started=True, name="export_ticket_stats_task")
+def export_ticket_stats_task(export_id):
+    """
+    Export ticket stats to a file and e-mail a link to the user
+    """
+    ExportTicketStatsTask.objects.select_related("org", "created_by").get(id=export_id).perform()
@@ -1,6 +1,9 @@
 from datetime import date, datetime
 from unittest.mock import patch
 
+from openpyxl import load_workbook
+
+from django.conf import settings
 from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
@@ -10,6 +13,7 @@ from temba.tests import CRUDLTestMixin, MigrationTest, TembaTest, matchers, mock
 from temba.utils.dates import datetime_to_timestamp
 
 from .models import (
+    ExportTicketStatsTask,
     Team,
     Ticket,
     TicketCount,
@@ -18,7 +22,6 @@ from .models import (
     Ticketer,
     TicketEvent,
     Topic,
-    export_ticket_stats,
 )
 from .tasks import squash_ticketcounts
 from .types import reload_ticketer_types
@@ -499,13 +502,20 @@ class TicketCRUDLTest(TembaTest, CRUDLTestMixin):
 
         self.login(self.admin)
 
-        response = self.client.get(export_url)
-        self.assertEqual(200, response.status_code)
-        self.assertEqual("application/ms-excel", response["Content-Type"])
-        self.assertEqual(
-            f"attachment; filename=ticket-stats-{timezone.now().strftime('%Y-%m-%d')}.xlsx",
-            response["Content-Disposition"],
+        response = self.client.get(export_url + "?days=7")
+        self.assertRedirect(response, reverse("tickets.ticket_list"))
+
+        export = ExportTicketStatsTask.objects.get()
+        self.assertEqual(ExportTicketStatsTask.STATUS_COMPLETE, export.status)
+        self.assertEqual(self.admin, export.created_by)
+        self.assertEqual(8, (export.until - export.since).days)  # includes today
+        self.assertEqual(export, self.admin.notifications.get(notification_type="export:finished").ticket_export)
+
+        workbook = load_workbook(
+            filename=f"{settings.MEDIA_ROOT}/test_orgs/{self.org.id}/ticket_stats_exports/{export.uuid}.xlsx"
         )
+        self.assertEqual(["Tickets"], workbook.sheetnames)
+        self.assertEqual(10, len(list(workbook.active.rows)))  # 2 header rows + 8 days
 
 
 class TicketerTest(TembaTest):
@@ -841,17 +851,25 @@ class TicketDailyCountTest(TembaTest):
         assert_counts()
         self.assertEqual(14, TicketDailyCount.objects.count())
 
-        workbook = export_ticket_stats(self.org, date(2022, 4, 30), date(2022, 5, 6))
+        workbook = self._export(date(2022, 4, 30), date(2022, 5, 6))
         self.assertEqual(["Tickets"], workbook.sheetnames)
         self.assertExcelRow(
             workbook.active, 1, ["", "Opened", "Replies", "Reply Time (Secs)"] + ["Assigned", "Replies"] * 5
         )
-        self.assertExcelRow(workbook.active, 2, [date(2022, 4, 30), 1, 0, "", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-        self.assertExcelRow(workbook.active, 3, [date(2022, 5, 1), 0, 0, "", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-        self.assertExcelRow(workbook.active, 4, [date(2022, 5, 2), 0, 0, "", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-        self.assertExcelRow(workbook.active, 5, [date(2022, 5, 3), 1, 1, "", 1, 1, 0, 0, 0, 0, 0, 0, 0, 0])
-        self.assertExcelRow(workbook.active, 6, [date(2022, 5, 4), 0, 2, "", 0, 0, 0, 1, 0, 1, 0, 0, 0, 0])
-        self.assertExcelRow(workbook.active, 7, [date(2022, 5, 5), 1, 3, "", 0, 2, 0, 1, 0, 0, 0, 0, 0, 0])
+        self.assertExcelRow(workbook.active, 2, [datetime(2022, 4, 30), 1, 0, "", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+        self.assertExcelRow(workbook.active, 3, [datetime(2022, 5, 1), 0, 0, "", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+        self.assertExcelRow(workbook.active, 4, [datetime(2022, 5, 2), 0, 0, "", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+        self.assertExcelRow(workbook.active, 5, [datetime(2022, 5, 3), 1, 1, "", 1, 1, 0, 0, 0, 0, 0, 0, 0, 0])
+        self.assertExcelRow(workbook.active, 6, [datetime(2022, 5, 4), 0, 2, "", 0, 0, 0, 1, 0, 1, 0, 0, 0, 0])
+        self.assertExcelRow(workbook.active, 7, [datetime(2022, 5, 5), 1, 3, "", 0, 2, 0, 1, 0, 0, 0, 0, 0, 0])
+
+    def _export(self, since: date, until: date):
+        export = ExportTicketStatsTask.create(self.org, self.admin, since, until)
+        export.perform()
+
+        return load_workbook(
+            filename=f"{settings.MEDIA_ROOT}/test_orgs/{self.org.id}/ticket_stats_exports/{export.uuid}.xlsx"
+        )
 
     def _record_opening(self, org, d: date):
         TicketDailyCount.objects.create(count_type=TicketDailyCount.TYPE_OPENING, scope=f"o:{org.id}", day=d, count=1)
@@ -913,15 +931,23 @@ class TicketDailyTimingTest(TembaTest):
 
         assert_timings()
 
-        workbook = export_ticket_stats(self.org, date(2022, 4, 30), date(2022, 5, 4))
+        workbook = self._export(date(2022, 4, 30), date(2022, 5, 4))
         self.assertEqual(["Tickets"], workbook.sheetnames)
         self.assertExcelRow(
             workbook.active, 1, ["", "Opened", "Replies", "Reply Time (Secs)"] + ["Assigned", "Replies"] * 5
         )
-        self.assertExcelRow(workbook.active, 2, [date(2022, 4, 30), 0, 0, 60, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-        self.assertExcelRow(workbook.active, 3, [date(2022, 5, 1), 0, 0, 120, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-        self.assertExcelRow(workbook.active, 4, [date(2022, 5, 2), 0, 0, 40, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
-        self.assertExcelRow(workbook.active, 5, [date(2022, 5, 3), 0, 0, "", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+        self.assertExcelRow(workbook.active, 2, [datetime(2022, 4, 30), 0, 0, 60, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+        self.assertExcelRow(workbook.active, 3, [datetime(2022, 5, 1), 0, 0, 120, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+        self.assertExcelRow(workbook.active, 4, [datetime(2022, 5, 2), 0, 0, 40, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+        self.assertExcelRow(workbook.active, 5, [datetime(2022, 5, 3), 0, 0, "", 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+
+    def _export(self, since: date, until: date):
+        export = ExportTicketStatsTask.create(self.org, self.admin, since, until)
+        export.perform()
+
+        return load_workbook(
+            filename=f"{settings.MEDIA_ROOT}/test_orgs/{self.org.id}/ticket_stats_exports/{export.uuid}.xlsx"
+        )
 
     def _record_first_reply(self, org, d: date, seconds: int):
         TicketDailyTiming.objects.create(
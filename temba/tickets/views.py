@@ -3,9 +3,11 @@ from datetime import timedelta
 from smartmin.views import SmartCRUDL, SmartFormView, SmartListView, SmartReadView, SmartTemplateView, SmartUpdateView
 
 from django import forms
+from django.conf import settings
+from django.contrib import messages
 from django.contrib.auth.models import User
 from django.db.models.aggregates import Max
-from django.http import JsonResponse
+from django.http import HttpResponseRedirect, JsonResponse
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
@@ -15,21 +17,22 @@ from django.utils.translation import gettext_lazy as _
 from temba.msgs.models import Msg
 from temba.notifications.views import NotificationTargetMixin
 from temba.orgs.views import DependencyDeleteModal, ModalMixin, OrgObjPermsMixin, OrgPermsMixin
+from temba.utils import on_transaction_commit
 from temba.utils.dates import datetime_to_timestamp, timestamp_to_datetime
-from temba.utils.export import response_from_workbook
 from temba.utils.fields import InputWidget, SelectWidget
 from temba.utils.views import ComponentFormMixin, SpaMixin
 
 from .models import (
     AllFolder,
+    ExportTicketStatsTask,
     MineFolder,
     Ticket,
     TicketCount,
     Ticketer,
     TicketFolder,
     UnassignedFolder,
-    export_ticket_stats,
 )
+from .tasks import export_ticket_stats_task
 
 
 class BaseConnectView(ComponentFormMixin, OrgPermsMixin, SmartFormView):
@@ -248,16 +251,26 @@ class TicketCRUDL(SmartCRUDL):
             tickets = self.get_queryset()
             context["tickets"] = tickets
 
-            # get the last message for each contact that these tickets belong to
-            contact_ids = {t.contact_id for t in tickets}
-            last_msg_ids = (
-                Msg.objects.filter(contact_id__in=contact_ids).values("contact").annotate(last_msg=Max("id"))
-            )
-            last_msgs = Msg.objects.filter(id__in=[m["last_msg"] for m in last_msg_ids]).select_related(
-                "broadcast__created_by"
-            )
+            # get the last message for each contact that these tickets belong to - contacts with open tickets have a
+            # reference to it maintained by a trigger, and for any others we have to look it up
+            last_msg_ids = set()
+            other_contact_ids = set()
+            for t in tickets:
+                if t.contact.ticket_count > 0:
+                    if t.contact.last_msg_id:
+                        last_msg_ids.add(t.contact.last_msg_id)
+                else:
+                    other_contact_ids.add(t.contact_id)
+
+            if other_contact_ids:
+                other_last_msgs = (
+                    Msg.objects.filter(contact_id__in=other_contact_ids).values("contact").annotate(last_msg=Max("id"))
+                )
+                last_msg_ids.update(m["last_msg"] for m in other_last_msgs)
 
-            context["last_msgs"] = {m.contact: m for m in last_msgs}
+            last_msgs = Msg.objects.filter(id__in=last_msg_ids).select_related("broadcast__created_by")
+
+            context["last_msgs"] = {m.contact_id: m for m in last_msgs}
             return context
 
         def render_to_response(self, context, **response_kwargs):
@@ -290,7 +303,7 @@ class TicketCRUDL(SmartCRUDL):
                 """
                 Converts a ticket to the contact-centric format expected by our frontend components
                 """
-                last_msg = context["last_msgs"].get(t.contact)
+                last_msg = context["last_msgs"].get(t.contact_id)
                 return {
                     "uuid": str(t.contact.uuid),
                     "name": t.contact.get_display(),
@@ -386,13 +399,43 @@ class TicketCRUDL(SmartCRUDL):
 
     class ExportStats(OrgPermsMixin, SmartTemplateView):
         def render_to_response(self, context, **response_kwargs):
-            num_days = self.request.GET.get("days", 90)
-            today = timezone.now().date()
-            workbook = export_ticket_stats(
-                self.request.org, today - timedelta(days=num_days), today + timedelta(days=1)
-            )
+            org = self.request.org
+            user = self.request.user
+
+            # is there already an export taking place?
+            existing = ExportTicketStatsTask.get_recent_unfinished(org)
+            if existing:
+                messages.info(
+                    self.request,
+                    _(
+                        "There is already an export in progress, started by %s. You must wait "
+                        "for that export to complete before starting another." % existing.created_by.username
+                    ),
+                )
+
+            # otherwise, off we go
+            else:
+                num_days = int(self.request.GET.get("days", 90))
+                today = timezone.now().date()
+                export = ExportTicketStatsTask.create(
+                    org, user, today - timedelta(days=num_days), today + timedelta(days=1)
+                )
+
+                on_transaction_commit(lambda: export_ticket_stats_task.delay(export.id))
+
+                if not getattr(settings, "CELERY_TASK_ALWAYS_EAGER", False):  # pragma: needs cover
+                    messages.info(
+                        self.request,
+                        _("We are preparing your export. We will e-mail you at %s when it is ready.") % user.username,
+                    )
+                else:
+                    dl_url = reverse("assets.download", kwargs=dict(type="ticket_stats_export", pk=export.pk))
+                    messages.info(
+                        self.request,
+                        _("Export complete, you can find it here: %s (production users will get an email)") % dl_url,
+                    )
 
-            return response_from_workbook(workbook, f"ticket-stats-{timezone.now().strftime('%Y-%m-%d')}.xlsx")
+            return HttpResponseRedirect(reverse("tickets.ticket_list"))
 
 
 class TicketerCRUDL(SmartCRUDL):
@@ -1,33 +1,153 @@
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
 from django_redis import get_redis_connection
+from redis.exceptions import LockNotOwnedError
 
+from django.conf import settings
+from django.db.models import Max, Sum
 from django.utils.encoding import force_str
 
-from temba.utils import json
+from temba.utils import analytics, json
+
+CACHE_STATS_KEY = "cache:stats"
+
+STALE_TTL = 300  # how long after expiring that a value can still be returned while it's being recalculated
+LOCK_TIMEOUT = 30  # how long a caller can hold the lock to recalculate a value
+LOCK_WAIT = 5  # how long to wait for another caller to calculate a missing value before calculating it ourselves
+LOCAL_CACHE_SIZE = 1000  # how many values can be cached in process memory before least recently used ones are evicted
+
+# values cached in process memory as cache key -> (expires_at, value), least recently used first
+_local_cache = OrderedDict()
+_local_cache_lock = threading.Lock()
 
 
-def get_cacheable(cache_key, callable, r=None, force_dirty=False):
+def get_cacheable(cache_key, callable, r=None, force_dirty=False, local_ttl: int = 0):
     """
-    Gets the result of a method call, using the given key and TTL as a cache
+    Gets the result of a method call, using the given key and TTL as a cache. Only one caller at a time recalculates an
+    expired or missing value. Other callers get the expired value while that happens, or wait for the new value if
+    there isn't one. If local_ttl is given, values are also cached in process memory for that many seconds.
     """
+    if local_ttl and not force_dirty:
+        found, value = _get_local(cache_key)
+        if found:
+            return value
+
     if not r:
         r = get_redis_connection()
 
+    family = get_key_family(cache_key)
+    lock = r.lock(f"{cache_key}:lock", timeout=LOCK_TIMEOUT)
+    locked = False
+
     if not force_dirty:
-        cached = r.get(cache_key)
+        cached, fresh = r.mget(cache_key, f"{cache_key}:fresh")
+
         if cached is not None:
-            return json.loads(force_str(cached))
+            value = json.loads(force_str(cached))
 
-    (calculated, cache_ttl) = callable()
-    r.set(cache_key, json.dumps(calculated), ex=cache_ttl or None)
+            # if value is fresh or someone else is recalculating it, return it as is
+            if fresh is None:
+                locked = lock.acquire(blocking=False)
+            if not locked:
+                _record_stat(r, family, "hits" if fresh is not None else "stale_hits")
+                return _set_local(cache_key, value, local_ttl)
 
-    return calculated
+        # value is missing so wait until we can calculate it, and check whether someone else did in the meantime
+        else:
+            locked = lock.acquire(blocking_timeout=LOCK_WAIT)
+            if locked:
+                cached = r.get(cache_key)
+                if cached is not None:
+                    lock.release()
+                    _record_stat(r, family, "hits")
+                    return _set_local(cache_key, json.loads(force_str(cached)), local_ttl)
 
+    _record_stat(r, family, "misses")
 
-def get_cacheable_result(cache_key, callable, r=None, force_dirty=False):
+    try:
+        start = time.perf_counter()
+        (calculated, cache_ttl) = callable()
+        analytics.gauge(f"temba.cache_{family}_recalc_time", time.perf_counter() - start)
+
+        # the value itself outlives its freshness so it can be returned while being recalculated
+        pipe = r.pipeline()
+        pipe.set(cache_key, json.dumps(calculated), ex=(cache_ttl + STALE_TTL) if cache_ttl else None)
+        pipe.set(f"{cache_key}:fresh", 1, ex=cache_ttl or None)
+        pipe.execute()
+    finally:
+        if locked:
+            try:
+                lock.release()
+            except LockNotOwnedError:  # calculating took longer than the lock timeout
+                pass
+
+    return _set_local(cache_key, calculated, local_ttl)
+
+
+def get_cacheable_result(cache_key, callable, r=None, force_dirty=False, local_ttl: int = 0):
     """
     Gets a cache-able integer calculation result
     """
-    return int(get_cacheable(cache_key, callable, r=r, force_dirty=force_dirty))
+    return int(get_cacheable(cache_key, callable, r=r, force_dirty=force_dirty, local_ttl=local_ttl))
+
+
+def get_key_family(cache_key: str) -> str:
+    """
+    Gets the family of a cache key by removing any ids from it, e.g. org:123:cache:credits_used -> org_cache_credits_used
+    """
+    return re.sub(r":\d+", "", cache_key).replace(":", "_")
+
+
+def get_cache_stats() -> dict:
+    """
+    Gets the hit, stale hit and miss counts of cached values by key family. These are estimates as only a sample of
+    lookups are recorded.
+    """
+    stats = get_redis_connection().hgetall(CACHE_STATS_KEY)
+    return {force_str(k): int(v) for k, v in stats.items()}
+
+
+def clear_local_cache():
+    with _local_cache_lock:
+        _local_cache.clear()
+
+
+def _get_local(cache_key: str) -> tuple:
+    with _local_cache_lock:
+        local = _local_cache.get(cache_key)
+        if local is None:
+            return False, None
+
+        if local[0] <= time.time():
+            del _local_cache[cache_key]
+            return False, None
+
+        _local_cache.move_to_end(cache_key)
+        return True, local[1]
+
+
+def _set_local(cache_key: str, value, local_ttl: int):
+    if local_ttl:
+        with _local_cache_lock:
+            _local_cache[cache_key] = (time.time() + local_ttl, value)
+            _local_cache.move_to_end(cache_key)
+
+            while len(_local_cache) > LOCAL_CACHE_SIZE:
+                _local_cache.popitem(last=False)
+    return value
+
+
+def _record_stat(r, family: str, stat: str):
+    # only a sample of lookups pay for the extra round trip
+    sample = settings.CACHE_STATS_SAMPLE
+    if sample > 1 and random.randrange(sample):
+        return
+
+    r.hincrby(CACHE_STATS_KEY, f"{family}:{stat}", sample)
 
 
 def incrby_existing(key, delta, r=None):
@@ -50,3 +170,60 @@ def incrby_existing(key, delta, r=None):
         "end"
     )
     r.eval(lua, 1, key, delta)
+
+
+def get_count_totals(cache_key, counts, group_by: str, generation: int, ttl: int, r=None) -> dict:
+    """
+    Gets totals of the given squashable count rows grouped by the given field. Totals are cached using the given key
+    along with the id of the last count row they include. On each call only the unsquashed rows inserted since then are
+    summed and applied to the cached totals. Totals are recalculated from all rows if they're from an older squash
+    generation or after the given TTL. The generation must be read before calling this.
+    """
+    if not r:
+        r = get_redis_connection()
+
+    raw = r.get(cache_key)
+    cached = json.loads(force_str(raw)) if raw is not None else None
+
+    if cached and cached["generation"] == generation:
+        totals, last_id = {k: v for k, v in cached["totals"]}, cached["last_id"]
+
+        # squashed rows are skipped as they replace rows we've already applied. Rows which commit out of id order are
+        # missed here but squashing always picks them up, and it changes the generation so we'll recalculate anyway
+        deltas = _sum_counts(counts.filter(id__gt=last_id, is_squashed=False), group_by)
+        if not deltas:
+            return totals
+
+        for key, (count_sum, max_id) in deltas.items():
+            totals[key] = totals.get(key, 0) + count_sum
+            last_id = max(last_id, max_id)
+    else:
+        totals, last_id = {}, 0
+        for key, (count_sum, max_id) in _sum_counts(counts, group_by).items():
+            totals[key] = count_sum
+            last_id = max(last_id, max_id)
+
+    # only replace the cached value if no one else has since, and keep its TTL so that it's still reconciled
+    lua = (
+        "local val = redis.call('get', KEYS[1])\n"
+        "if (val or '') == ARGV[1] then\n"
+        "  local ttl = redis.call('pttl', KEYS[1])\n"
+        "  if ttl > 0 then\n"
+        "    redis.call('set', KEYS[1], ARGV[2], 'PX', ttl)\n"
+        "  else\n"
+        "    redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])\n"
+        "  end\n"
+        "end"
+    )
+    value = {"totals": list(totals.items()), "generation": generation, "last_id": last_id}
+    r.eval(lua, 1, cache_key, raw or "", json.dumps(value), ttl)
+
+    return totals
+
+
+def _sum_counts(counts, group_by: str) -> dict:
+    """
+    Sums the given count rows grouped by the given field, as a dict of key to tuple of sum and max row id
+    """
+    sums = counts.values_list(group_by).annotate(count_sum=Sum("count"), max_id=Max("id")).order_by()
+    return {key: (count_sum, max_id) for key, count_sum, max_id in sums}
@@ -1,6 +1,10 @@
+import csv
 import gc
+import gzip
+import io
 import logging
 import os
+import threading
 import time
 from datetime import datetime, timedelta
 
@@ -17,7 +21,7 @@ from django.utils.translation import gettext_lazy as _
 from temba.assets.models import BaseAssetStore, get_asset_store
 
 from . import analytics
-from .models import LegacyUUIDMixin
+from .models import JSONField, LegacyUUIDMixin
 from .text import clean_string
 
 logger = logging.getLogger(__name__)
@@ -64,6 +68,9 @@ class BaseExportTask(LegacyUUIDMixin, SmartModel):
 
     status = models.CharField(max_length=1, default=STATUS_PENDING, choices=STATUS_CHOICES)
 
+    # rows written, rows per second and peak memory growth of the export
+    stats = JSONField(null=True)
+
     def perform(self):
         """
         Performs the actual export. If export generation throws an exception it's caught here and the task is marked
@@ -77,17 +84,23 @@ class BaseExportTask(LegacyUUIDMixin, SmartModel):
             print(f"Started perfoming {self.analytics_key} with ID {self.id}")
 
             start = time.time()
+            self.num_rows = 0
+
+            with MemorySampler() as memory:
+                temp_file, extension = self.write_export()
 
-            temp_file, extension = self.write_export()
+            self.record_stats(time.time() - start, memory.peak_growth_kb)
 
-            get_asset_store(model=self.__class__).save(self.id, File(temp_file), extension)
+            # exports which are written straight to storage don't have a temporary file to save
+            if temp_file:
+                get_asset_store(model=self.__class__).save(self.id, File(temp_file), extension)
 
-            # remove temporary file
-            if hasattr(temp_file, "delete"):
-                if temp_file.delete is False:  # pragma: no cover
+                # remove temporary file
+                if hasattr(temp_file, "delete"):
+                    if temp_file.delete is False:  # pragma: no cover
+                        os.unlink(temp_file.name)
+                else:  # pragma: no cover
                     os.unlink(temp_file.name)
-            else:  # pragma: no cover
-                os.unlink(temp_file.name)
 
         except Exception as e:
             logger.error(f"Unable to perform export: {str(e)}", exc_info=True)
@@ -107,10 +120,23 @@ class BaseExportTask(LegacyUUIDMixin, SmartModel):
 
     def write_export(self):  # pragma: no cover
         """
-        Should return a file handle for a temporary file and the file extension
+        Should return a file handle for a temporary file and the file extension, or None and the file extension if the
+        export was written straight to storage
         """
         pass
 
+    def record_stats(self, elapsed: float, peak_memory_kb: int):
+        """
+        Records stats for this export once the export file has been written
+        """
+        rows_per_sec = round(self.num_rows / elapsed) if elapsed else 0
+
+        self.stats = {"rows": self.num_rows, "rows_per_sec": rows_per_sec, "peak_memory_kb": peak_memory_kb}
+        self.save(update_fields=("stats",))
+
+        analytics.gauge(f"temba.{self.analytics_key}_rows_per_sec", rows_per_sec)
+        analytics.gauge(f"temba.{self.analytics_key}_peak_memory_kb", peak_memory_kb)
+
     def update_status(self, status):
         self.status = status
         self.save(update_fields=("status", "modified_on"))
@@ -134,6 +160,7 @@ class BaseExportTask(LegacyUUIDMixin, SmartModel):
 
     def append_row(self, sheet, values):
         sheet.append_row(*[self.prepare_value(v) for v in values])
+        self.num_rows = getattr(self, "num_rows", 0) + 1
 
     def prepare_value(self, value):
         if value is None:
@@ -160,6 +187,46 @@ class BaseExportTask(LegacyUUIDMixin, SmartModel):
         abstract = True
 
 
+class MemorySampler:
+    """
+    Samples the resident memory of this process on a background thread while in use, to find how far it grew above
+    what it was at the start
+    """
+
+    INTERVAL = 0.5  # seconds between samples
+
+    def __enter__(self):
+        self.start_kb = self.peak_kb = self._get_rss_kb()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample_until_stopped, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stopped.set()
+        self.thread.join()
+        self._sample()
+
+    @property
+    def peak_growth_kb(self) -> int:
+        return self.peak_kb - self.start_kb
+
+    def _sample_until_stopped(self):
+        while not self.stopped.wait(self.INTERVAL):
+            self._sample()
+
+    def _sample(self):
+        self.peak_kb = max(self.peak_kb, self._get_rss_kb())
+
+    @staticmethod
+    def _get_rss_kb() -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+        except (OSError, ValueError):  # pragma: no cover
+            return 0
+
+
 class TableExporter:
     """
     Class that abstracts out writing a table of data to a CSV or Excel file. This only works for exports that
@@ -168,9 +235,21 @@ class TableExporter:
 
     When writing to an Excel sheet, this also takes care of creating different sheets every 1048576
     rows, as again, Excel file only support that many per sheet.
+
+    Rows are written to disk as they are added in all formats so memory usage doesn't grow with the number of rows.
+    CSV files are written straight to storage, which uploads them in chunks as they're written.
     """
 
-    def __init__(self, task, sheet_name, columns):
+    FORMAT_XLSX = "xlsx"
+    FORMAT_CSV = "csv"
+    FORMAT_CSV_GZ = "csv.gz"
+    FORMAT_CHOICES = (
+        (FORMAT_XLSX, _("Excel")),
+        (FORMAT_CSV, _("CSV")),
+        (FORMAT_CSV_GZ, _("Compressed CSV")),
+    )
+
+    def __init__(self, task, sheet_name, columns, format: str = FORMAT_XLSX):
         self.task = task
         self.columns = columns
         self.sheet_name = sheet_name
@@ -178,9 +257,22 @@ class TableExporter:
         self.current_sheet = 0
         self.current_row = 0
 
-        self.workbook = XLSXBook()
-        self.sheet_number = 0
-        self._add_sheet()
+        # Excel doesn't support this many columns so we have to use CSV
+        if format == self.FORMAT_XLSX and len(columns) > BaseExportTask.MAX_EXCEL_COLS:
+            format = self.FORMAT_CSV
+
+        self.format = format
+
+        if self.format == self.FORMAT_XLSX:
+            self.workbook = XLSXBook()
+            self.sheet_number = 0
+            self._add_sheet()
+        else:
+            self.file = get_asset_store(model=task.__class__).open(task.id, self.format)
+            self.stream = gzip.GzipFile(fileobj=self.file, mode="wb") if self.format == self.FORMAT_CSV_GZ else None
+            self.text = io.TextIOWrapper(self.stream or self.file, encoding="utf-8", newline="")
+            self.writer = csv.writer(self.text)
+            self.writer.writerow(self.columns)
 
     def _add_sheet(self):
         self.sheet_number += 1
@@ -195,6 +287,12 @@ class TableExporter:
         """
         Writes the passed in row to our exporter, taking care of creating new sheets if necessary
         """
+        self.task.num_rows = getattr(self.task, "num_rows", 0) + 1
+
+        if self.format != self.FORMAT_XLSX:
+            self.writer.writerow(values)
+            return
+
         # time for a new sheet? do it
         if self.sheet_row > BaseExportTask.MAX_EXCEL_ROWS:
             self._add_sheet()
@@ -205,9 +303,17 @@ class TableExporter:
 
     def save_file(self):
         """
-        Saves our data to a file, returning the file saved to and the extension
+        Saves our data to a file, returning the temporary file saved to and the extension. CSV files are already in
+        storage so there's no temporary file for them.
         """
-        gc.collect()  # force garbage collection
+        if self.format != self.FORMAT_XLSX:
+            self.text.flush()
+            self.text.detach()
+            if self.stream:
+                self.stream.close()  # writes the gzip trailer but leaves the underlying file open
+            self.file.close()  # completes the upload to storage
+
+            return None, self.format
 
         print("Writing Excel workbook...")
         temp_file = NamedTemporaryFile(delete=False, suffix=".xlsx", mode="wb+")
@@ -0,0 +1,60 @@
+import hashlib
+import math
+import zlib
+
+DEFAULT_PRECISION = 12  # 4096 registers, for a standard error of about 1.6%
+
+
+class HyperLogLog:
+    """
+    A HyperLogLog sketch for estimating the number of distinct values added to it. Sketches can be merged, which gives
+    the sketch of the union of their values, and serialized to compressed bytes for storage.
+    """
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        assert 4 <= precision <= 16, "precision must be between 4 and 16"
+
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        registers = zlib.decompress(data)
+        sketch = cls(precision=len(registers).bit_length() - 1)
+        sketch.registers = bytearray(registers)
+        return sketch
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(bytes(self.registers))
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+        # first bits of the hash pick the register, and the rest give the rank of the first set bit
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        remaining = hashed & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - remaining.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        assert self.precision == other.precision, "can't merge sketches with different precisions"
+
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self) -> int:
+        """
+        Estimates the number of distinct values in this sketch
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+
+        # small cardinalities are better estimated by counting empty registers
+        empty = self.registers.count(0)
+        if empty and estimate <= 2.5 * m:
+            estimate = m * math.log(m / empty)
+
+        return round(estimate)
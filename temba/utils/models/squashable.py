@@ -1,17 +1,29 @@
 import logging
 import time
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
+from django_redis import get_redis_connection
+
+from django.conf import settings
 from django.db import connection, models
 from django.db.models import Sum
 
+from temba.utils import analytics
+
+logger = logging.getLogger(__name__)
+
 
 class SquashableModel(models.Model):
     """
     Base class for models which track counts by delta insertions which are then periodically squashed
     """
 
-    squash_over = ()
+    squash_over = ()  # the columns which identify a distinct set of counts
+    squash_sum = ("count",)  # the columns which are summed when a set is squashed
+    squash_partition_key = None  # column used to partition bulk squashing across workers, defaults to first set column
+    squash_generation_key = None  # optional redis key pattern for a scope's generation, incremented by squashing
+    squash_generation_over = None  # the column whose values identify the scopes whose generations are incremented
 
     id = models.BigAutoField(auto_created=True, primary_key=True)
     is_squashed = models.BooleanField(default=False)
@@ -20,10 +32,54 @@ class SquashableModel(models.Model):
     def get_unsquashed(cls):
         return cls.objects.filter(is_squashed=False)
 
+    @classmethod
+    def get_squash_rollups(cls) -> tuple:
+        """
+        Gets SQL statements which are run as part of squashing to maintain rollups of this model's counts. They can read
+        the new counts being squashed (i.e. those which weren't already squashed) from a "deltas" relation.
+        """
+        return ()
+
+    @classmethod
+    def get_squash_generation(cls, r, scope_id) -> int:
+        """
+        Gets the squash generation of the given scope, which changes whenever squashing changes that scope's counts
+        """
+        return int(r.get(cls.squash_generation_key % scope_id) or 0)
+
+    @classmethod
+    def get_squash_generation_scopes(cls, values) -> set:
+        """
+        Gets the scope ids for the given values of the squash_generation_over column
+        """
+        return set(values)
+
+    @classmethod
+    def _increment_squash_generations(cls, values):
+        if not cls.squash_generation_key or not values:
+            return
+
+        r = get_redis_connection()
+        pipe = r.pipeline()
+        for scope_id in cls.get_squash_generation_scopes(values):
+            pipe.incr(cls.squash_generation_key % scope_id)
+        pipe.execute()
+
     @classmethod
     def squash(cls):
+        if settings.SQUASH_MODE == "bulk" and cls.squash_over:
+            cls.squash_bulk(workers=settings.SQUASH_WORKERS, batch_size=settings.SQUASH_BATCH_SIZE)
+        else:
+            cls.squash_sets()
+
+    @classmethod
+    def squash_sets(cls) -> int:
+        """
+        Squashes up to 5000 distinct sets, one set at a time. Returns the number of sets squashed.
+        """
         start = time.time()
         num_sets = 0
+        generation_values = set()
 
         for distinct_set in cls.get_unsquashed().order_by(*cls.squash_over).distinct(*cls.squash_over)[:5000]:
             with connection.cursor() as cursor:
@@ -33,10 +89,134 @@ class SquashableModel(models.Model):
 
             num_sets += 1
 
+            if cls.squash_generation_over:
+                generation_values.add(getattr(distinct_set, cls.squash_generation_over))
+
+        cls._increment_squash_generations(generation_values)
+
         time_taken = time.time() - start
 
         logging.debug("Squashed %d distinct sets of %s in %0.3fs" % (num_sets, cls.__name__, time_taken))
 
+        return num_sets
+
+    @classmethod
+    def squash_bulk(cls, workers: int = 1, batch_size: int = 5000, max_batches: int = 20) -> tuple:
+        """
+        Squashes all unsquashed sets using set-based statements which each collapse up to batch_size sets. If workers
+        is greater than one, sets are partitioned across that many threads, each with its own connection. Returns a
+        tuple of the number of sets squashed and the number of rows they replaced.
+        """
+        start = time.time()
+
+        # other connections can't see rows from an uncommitted transaction so in that case we squash inline
+        if workers > 1 and not connection.in_atomic_block:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(
+                    executor.map(
+                        lambda p: cls._squash_partition(p, workers, batch_size, max_batches, close=True),
+                        range(workers),
+                    )
+                )
+        else:
+            results = [cls._squash_partition(0, 1, batch_size, max_batches)]
+
+        num_sets = sum(r[0] for r in results)
+        num_rows = sum(r[1] for r in results)
+        time_taken = time.time() - start
+
+        cls._increment_squash_generations(set().union(*(r[2] for r in results)))
+
+        logger.debug(f"Squashed {num_sets} distinct sets ({num_rows} rows) of {cls.__name__} in {time_taken:.3f}s")
+
+        metric = f"temba.squash_{cls.__name__.lower()}"
+        analytics.gauge(f"{metric}_sets", num_sets)
+        analytics.gauge(f"{metric}_rows", num_rows)
+        analytics.gauge(f"{metric}_rate", num_rows / time_taken if time_taken else 0)
+
+        return num_sets, num_rows
+
+    @classmethod
+    def _squash_partition(cls, partition: int, num_partitions: int, batch_size: int, max_batches: int, close=False):
+        num_sets, num_rows, generation_values = 0, 0, set()
+        try:
+            for _ in range(max_batches):
+                with connection.cursor() as cursor:
+                    sql, params = cls.get_bulk_squash_query(batch_size, partition, num_partitions)
+
+                    cursor.execute(sql, params)
+                    batch_sets, batch_rows, batch_values = cursor.fetchone()
+
+                num_sets += batch_sets
+                num_rows += batch_rows
+                generation_values.update(batch_values or ())
+
+                if batch_sets < batch_size:
+                    break
+        finally:
+            if close:
+                connection.close()
+
+        return num_sets, num_rows, generation_values
+
+    @classmethod
+    def get_bulk_squash_query(cls, limit: int, partition: int = 0, num_partitions: int = 1) -> tuple:
+        """
+        Gets the query which squashes up to limit distinct sets in a single statement, returning the number of sets
+        squashed, the number of rows removed, and the distinct values of the squash_generation_over column if any
+        """
+        table = cls._meta.db_table
+        set_cols = ", ".join(f'"{c}"' for c in cls.squash_over)
+        sum_cols = ", ".join(f'"{c}"' for c in cls.squash_sum)
+        sum_exprs = ", ".join(f'GREATEST(0, SUM("{c}"))' for c in cls.squash_sum)
+        returning = ", ".join(f't."{c}"' for c in cls.squash_over + cls.squash_sum + ("is_squashed",))
+        generation_values = (
+            f'(SELECT ARRAY_AGG(DISTINCT "{cls.squash_generation_over}") FROM removed)'
+            if cls.squash_generation_over
+            else "NULL"
+        )
+
+        # nullable columns have to be matched with IS NOT DISTINCT FROM so that NULL sets are squashed too
+        matches = []
+        for col in cls.squash_over:
+            op = "IS NOT DISTINCT FROM" if cls._meta.get_field(col).null else "="
+            matches.append(f't."{col}" {op} s."{col}"')
+
+        where, params = '"is_squashed" = FALSE', []
+        if num_partitions > 1:
+            key = cls.squash_partition_key or cls.squash_over[0]
+            where += f" AND ABS(hashtext(COALESCE(\"{key}\"::text, ''))::bigint) %% %s = %s"
+            params = [num_partitions, partition]
+
+        sql = f"""
+        WITH sets AS (
+            SELECT DISTINCT {set_cols} FROM {table} WHERE {where} LIMIT %s
+        ), removed AS (
+            DELETE FROM {table} t USING sets s WHERE {" AND ".join(matches)} RETURNING {returning}
+        ), squashed AS (
+            INSERT INTO {table}({set_cols}, {sum_cols}, "is_squashed")
+            SELECT {set_cols}, {sum_exprs}, TRUE FROM removed GROUP BY {set_cols}
+            RETURNING 1
+        ){cls._get_rollup_ctes()}
+        SELECT (SELECT COUNT(*) FROM squashed), (SELECT COUNT(*) FROM removed), {generation_values};
+        """
+
+        return sql, (*params, limit)
+
+    @classmethod
+    def _get_rollup_ctes(cls) -> str:
+        """
+        Gets the CTEs to append to a squash query which has a "removed" CTE, to run any rollup statements
+        """
+        rollups = cls.get_squash_rollups()
+        if not rollups:
+            return ""
+
+        ctes = ', deltas AS (SELECT * FROM removed WHERE NOT "is_squashed")'
+        for i, rollup in enumerate(rollups):
+            ctes += f", rollup_{i} AS ({rollup})"
+        return ctes
+
     @classmethod
     @abstractmethod
     def get_squash_query(cls, distinct_set) -> tuple:  # pragma: no cover
@@ -56,7 +236,8 @@ class ScopedCountModel(SquashableModel):
     Base for scoped count squashable models
     """
 
-    SQUASH_OVER = ("count_type", "scope")
+    squash_over = ("count_type", "scope")
+    squash_partition_key = "scope"
 
     count_type = models.CharField(max_length=1)
     scope = models.CharField(max_length=32)
@@ -112,7 +293,7 @@ class DailyCountModel(ScopedCountModel):
     Base for daily scoped count squashable models
     """
 
-    SQUASH_OVER = ("count_type", "scope", "day")
+    squash_over = ("count_type", "scope", "day")
 
     day = models.DateField()
 
@@ -168,6 +349,8 @@ class DailyTimingModel(DailyCountModel):
     Base for daily scoped count+seconds squashable models
     """
 
+    squash_sum = ("count", "seconds")
+
     seconds = models.BigIntegerField()
 
     @classmethod
@@ -1,13 +1,17 @@
+from datetime import date
 from decimal import Decimal
 
 from django.contrib.auth.models import User
 from django.core import checks
 from django.db import connection, models
 from django.test import TestCase
+from django.test.utils import override_settings
 
+from temba.channels.models import ChannelCount
 from temba.contacts.models import Contact
 from temba.flows.models import Flow
 from temba.tests import TembaTest
+from temba.tickets.models import TicketCount
 
 from .base import patch_queryset_count
 from .es import IDSliceQuerySet
@@ -26,6 +30,80 @@ class ModelsTest(TembaTest):
             self.assertEqual(qs.count(), 33)
 
 
+class SquashableModelTest(TembaTest):
+    def _create_counts(self):
+        ChannelCount.objects.all().delete()
+        TicketCount.objects.all().delete()
+
+        day1, day2 = date(2021, 1, 1), date(2021, 1, 2)
+        for count in (3, 2, -1):
+            ChannelCount.objects.create(channel=self.channel, count_type="IM", day=day1, count=count)
+        ChannelCount.objects.create(channel=self.channel, count_type="IM", day=day2, count=4)
+        ChannelCount.objects.create(channel=self.channel, count_type="OM", day=None, count=5)
+        ChannelCount.objects.create(channel=self.channel, count_type="OM", day=None, count=-7)
+
+        TicketCount.objects.create(org=self.org, assignee=None, status="O", count=2)
+        TicketCount.objects.create(org=self.org, assignee=None, status="O", count=3)
+        TicketCount.objects.create(org=self.org, assignee=self.admin, status="O", count=1)
+        TicketCount.objects.create(org=self.org2, assignee=self.admin, status="C", count=6)
+
+    def _assert_squashed(self):
+        self.assertEqual(
+            [("IM", date(2021, 1, 1), 4), ("IM", date(2021, 1, 2), 4), ("OM", None, 0)],
+            list(ChannelCount.objects.order_by("count_type", "day").values_list("count_type", "day", "count")),
+        )
+        self.assertEqual(0, ChannelCount.get_unsquashed().count())
+        self.assertEqual(
+            [(self.org.id, self.admin.id, 1), (self.org.id, None, 5), (self.org2.id, self.admin.id, 6)],
+            list(TicketCount.objects.order_by("org_id", "assignee_id").values_list("org_id", "assignee_id", "count")),
+        )
+        self.assertEqual(0, TicketCount.get_unsquashed().count())
+
+    def test_squash_bulk(self):
+        self._create_counts()
+
+        self.assertEqual((3, 6), ChannelCount.squash_bulk())
+        self.assertEqual((3, 4), TicketCount.squash_bulk())
+        self._assert_squashed()
+
+        # squashing again only rewrites sets with new unsquashed rows
+        ChannelCount.objects.create(channel=self.channel, count_type="IM", day=date(2021, 1, 2), count=1)
+
+        self.assertEqual((1, 2), ChannelCount.squash_bulk(workers=4))
+        self.assertEqual(5, ChannelCount.objects.get(day=date(2021, 1, 2)).count)
+
+        # sets are limited by batch size but we keep going until there are none left
+        self._create_counts()
+
+        self.assertEqual((3, 6), ChannelCount.squash_bulk(batch_size=1))
+        self.assertEqual((0, 0), ChannelCount.squash_bulk(batch_size=1))
+
+        # partitions split up the sets without overlapping
+        num_sets = 0
+        for p in range(3):
+            num_sets += TicketCount._squash_partition(p, 3, batch_size=10, max_batches=1)[0]
+
+        self.assertEqual(3, num_sets)
+        self._assert_squashed()
+
+    def test_squash_modes(self):
+        self._create_counts()
+
+        with override_settings(SQUASH_MODE="sets"):
+            ChannelCount.squash()
+            TicketCount.squash()
+
+        self._assert_squashed()
+
+        self._create_counts()
+
+        with override_settings(SQUASH_MODE="bulk"):
+            ChannelCount.squash()
+            TicketCount.squash()
+
+        self._assert_squashed()
+
+
 class IDSliceQuerySetTest(TembaTest):
     def test_fields(self):
         # if we don't specify fields, we fetch *
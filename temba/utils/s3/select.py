@@ -1,7 +1,19 @@
+import operator
 from datetime import datetime
 
+import iso8601
+
 LOOKUPS = {"gt": ">", "gte": ">=", "lte": "<=", "lt": "<", "in": "IN"}
 
+OPERATORS = {
+    "=": operator.eq,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "<": operator.lt,
+    "IN": lambda a, b: a in b,
+}
+
 
 def compile_select(*, fields=(), alias: str = "s", where: dict = None) -> str:
     """
@@ -54,3 +66,50 @@ def _compile_value(val) -> str:
     if isinstance(val, (list, tuple)):
         return f"({', '.join([_compile_value(v) for v in val])})"
     return str(val)
+
+
+def compile_matcher(where: dict):
+    """
+    Compiles the same conditions as compile_select into a Python function which matches records locally. Raw conditions
+    can't be compiled and raise a ValueError.
+    """
+    conditions = [_compile_match_condition(k, v) for k, v in where.items()]
+
+    def matcher(record: dict) -> bool:
+        return all(c(record) for c in conditions)
+
+    return matcher
+
+
+def _compile_match_condition(field: str, val):
+    if field == "__raw__":
+        raise ValueError("raw conditions can't be matched locally")
+
+    op = "="
+    field_parts = field.split("__")
+    if field_parts[-1] in LOOKUPS:
+        op = LOOKUPS[field_parts[-1]]
+        field_parts = field_parts[:-1]
+
+    func = OPERATORS[op]
+    is_datetime = isinstance(val, datetime)
+
+    def condition(record: dict) -> bool:
+        value = record
+        for part in field_parts:
+            if not isinstance(value, dict) or part not in value:
+                return False  # like S3 select, comparisons with missing values never match
+            value = value[part]
+
+        if value is None:
+            return False
+
+        try:
+            if is_datetime:
+                value = iso8601.parse_date(value)
+
+            return func(value, val)
+        except (TypeError, iso8601.ParseError):
+            return False
+
+    return condition
@@ -6,7 +6,7 @@ import pytz
 
 from temba.tests import TembaTest
 from temba.tests.s3 import MockEventStream, MockS3Client
-from temba.utils.s3 import EventStreamReader, compile_select, get_body, split_url
+from temba.utils.s3 import EventStreamReader, compile_matcher, compile_select, get_body, split_url
 
 
 class S3Test(TembaTest):
@@ -85,3 +85,28 @@ class SelectTest(TembaTest):
             "SELECT s.* FROM s3object s WHERE '1ccf09f6-3fe8-4c0d-a073-981632be5a30' IN s.labels[*].uuid[*]",
             compile_select(where={"__raw__": "'1ccf09f6-3fe8-4c0d-a073-981632be5a30' IN s.labels[*].uuid[*]"}),
         )
+
+    def test_compile_matcher(self):
+        records = [
+            {"id": 1, "active": True, "created_on": "2021-09-28T18:00:00Z", "flow": {"uuid": "1234"}},
+            {"id": 2, "active": False, "created_on": "2021-09-28T19:00:00Z", "flow": {"uuid": "2345"}},
+            {"id": 3, "active": True, "created_on": "2021-09-28T20:00:00Z", "flow": None},
+        ]
+
+        def assert_matches(where, ids):
+            matcher = compile_matcher(where)
+            self.assertEqual(ids, [r["id"] for r in records if matcher(r)])
+
+        assert_matches({}, [1, 2, 3])
+        assert_matches({"id": 2}, [2])
+        assert_matches({"id__gt": 1}, [2, 3])
+        assert_matches({"id__lte": 2, "active": True}, [1])
+        assert_matches({"flow__uuid": "2345"}, [2])
+        assert_matches({"flow__uuid__in": ("1234", "2345")}, [1, 2])
+        assert_matches({"created_on__gte": datetime(2021, 9, 28, 19, 0, 0, 0, pytz.UTC)}, [2, 3])
+        assert_matches({"created_on__lt": datetime(2021, 9, 28, 19, 0, 0, 0, pytz.UTC)}, [1])
+        assert_matches({"missing": "foo"}, [])
+
+        # raw conditions can only be evaluated by S3 select
+        with self.assertRaises(ValueError):
+            compile_matcher({"__raw__": "s.contact.uuid = '1234'"})
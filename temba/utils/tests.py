@@ -1,5 +1,6 @@
 import copy
 import datetime
+import gzip
 import io
 import os
 from collections import OrderedDict
@@ -12,6 +13,7 @@ from django_redis import get_redis_connection
 from openpyxl import load_workbook
 
 from django.conf import settings
+from django.core.files.storage import default_storage
 from django.forms import ValidationError
 from django.test import TestCase, override_settings
 from django.urls import reverse
@@ -19,22 +21,35 @@ from django.utils import timezone, translation
 
 from celery.app.task import Task
 
+from temba.assets.models import get_asset_store
 from temba.campaigns.models import Campaign
+from temba.channels.models import ChannelLog
 from temba.contacts.models import Contact, ExportContactsTask
 from temba.flows.models import Flow
+from temba.msgs.models import LabelCount, SystemLabelCount
 from temba.tests import TembaTest, matchers
 from temba.triggers.models import Trigger
 from temba.utils import json, uuid
 from temba.utils.templatetags.temba import format_datetime, icon
 
 from . import chunk_list, countries, format_number, languages, percentage, redact, sizeof_fmt, str_to_bool
-from .cache import get_cacheable_result, incrby_existing
+from .cache import (
+    CACHE_STATS_KEY,
+    clear_local_cache,
+    get_cache_stats,
+    get_cacheable,
+    get_cacheable_result,
+    get_count_totals,
+    get_key_family,
+    incrby_existing,
+)
 from .celery import nonoverlapping_task
 from .dates import date_range, datetime_to_str, datetime_to_timestamp, timestamp_to_datetime
 from .email import is_valid_address, send_simple_email
-from .export import TableExporter
+from .export import MemorySampler, TableExporter
 from .fields import NameValidator, validate_external_url
 from .http import http_headers
+from .hyperloglog import HyperLogLog
 from .locks import LockNotAcquiredException, NonBlockingLock
 from .templatetags.temba import oxford, short_datetime
 from .text import (
@@ -48,6 +63,7 @@ from .text import (
     unsnakify,
 )
 from .timezones import TimeZoneFormField, timezone_to_country_code
+from .trim import get_replica_lag, trim
 
 
 class InitTest(TembaTest):
@@ -512,6 +528,102 @@ class CacheTest(TembaTest):
         with self.assertNumQueries(0):
             self.assertEqual(get_cacheable_result("test_contact_count", calculate), 2)  # from cache
 
+    def test_get_cacheable(self):
+        r = get_redis_connection()
+        calls = []
+
+        def calculate():
+            calls.append(1)
+            return {"count": len(calls)}, 60
+
+        self.assertEqual({"count": 1}, get_cacheable("org:123:cache:test", calculate))
+        self.assertEqual({"count": 1}, get_cacheable("org:123:cache:test", calculate))
+        self.assertEqual(1, len(calls))
+
+        # value outlives its freshness
+        self.assertTrue(60 < r.ttl("org:123:cache:test") <= 360)
+        self.assertTrue(0 < r.ttl("org:123:cache:test:fresh") <= 60)
+
+        # once value is stale, a caller which can't get the lock gets the stale value
+        r.delete("org:123:cache:test:fresh")
+        lock = r.lock("org:123:cache:test:lock", timeout=10)
+        lock.acquire()
+
+        self.assertEqual({"count": 1}, get_cacheable("org:123:cache:test", calculate))
+        self.assertEqual(1, len(calls))
+
+        # and the caller which can get the lock recalculates it
+        lock.release()
+
+        self.assertEqual({"count": 2}, get_cacheable("org:123:cache:test", calculate))
+        self.assertEqual({"count": 2}, get_cacheable("org:123:cache:test", calculate))
+        self.assertEqual(2, len(calls))
+        self.assertIsNone(r.get("org:123:cache:test:lock"))
+
+        # if value is missing and someone else holds the lock, we wait for it and then calculate it ourselves
+        r.delete("org:123:cache:test")
+        lock.acquire()
+
+        with patch("temba.utils.cache.LOCK_WAIT", 0.1):
+            self.assertEqual({"count": 3}, get_cacheable("org:123:cache:test", calculate))
+
+        lock.release()
+
+        # force dirty always recalculates
+        self.assertEqual({"count": 4}, get_cacheable("org:123:cache:test", calculate, force_dirty=True))
+
+        self.assertEqual(
+            {
+                "org_cache_test:hits": 2,
+                "org_cache_test:stale_hits": 1,
+                "org_cache_test:misses": 4,
+            },
+            get_cache_stats(),
+        )
+
+        # stats can be sampled, in which case recorded lookups count for the whole sample
+        r.delete(CACHE_STATS_KEY)
+
+        with override_settings(CACHE_STATS_SAMPLE=10):
+            with patch("temba.utils.cache.random.randrange", side_effect=[0, 3]):
+                get_cacheable("org:123:cache:test", calculate)
+                get_cacheable("org:123:cache:test", calculate)
+
+        self.assertEqual({"org_cache_test:hits": 10}, get_cache_stats())
+
+        # values can also be cached in process memory
+        self.assertEqual({"count": 4}, get_cacheable("org:123:cache:test", calculate, local_ttl=5))
+        r.delete("org:123:cache:test")
+
+        self.assertEqual({"count": 4}, get_cacheable("org:123:cache:test", calculate, local_ttl=5))
+
+        clear_local_cache()
+
+        self.assertEqual({"count": 5}, get_cacheable("org:123:cache:test", calculate, local_ttl=5))
+
+        # least recently used values are evicted from process memory once it's full
+        with patch("temba.utils.cache.LOCAL_CACHE_SIZE", 1):
+            self.assertEqual(
+                {"other": 1}, get_cacheable("org:123:cache:other", lambda: ({"other": 1}, 60), local_ttl=5)
+            )
+            r.delete("org:123:cache:test")
+
+            self.assertEqual({"count": 6}, get_cacheable("org:123:cache:test", calculate, local_ttl=5))
+
+        clear_local_cache()
+
+        # if our lock expires while we're recalculating, there's nothing to release
+        def calculate_slowly():
+            r.delete("org:123:cache:test:lock")
+            return calculate()
+
+        r.delete("org:123:cache:test:fresh")
+
+        self.assertEqual({"count": 7}, get_cacheable("org:123:cache:test", calculate_slowly))
+
+        self.assertEqual("org_cache_credits_used", get_key_family("org:123:cache:credits_used"))
+        self.assertEqual("org_topup_remaining", get_key_family("org:12:topup:34:remaining"))
+
     def test_incrby_existing(self):
         r = get_redis_connection()
         r.setex("foo", 100, 10)
@@ -537,6 +649,85 @@ class CacheTest(TembaTest):
         incrby_existing("xxx", -2, r)  # non-existent key
         self.assertIsNone(r.get("xxx"))
 
+    def test_get_count_totals(self):
+        r = get_redis_connection()
+        SystemLabelCount.objects.all().delete()
+        SystemLabelCount.objects.create(org=self.org, label_type="I", count=3, is_squashed=True)
+        SystemLabelCount.objects.create(org=self.org, label_type="I", count=2)
+        SystemLabelCount.objects.create(org=self.org, label_type="O", count=1, is_squashed=True)
+        SystemLabelCount.objects.create(org=self.org2, label_type="I", count=7, is_squashed=True)
+
+        counts = SystemLabelCount.objects.filter(org=self.org)
+
+        with self.assertNumQueries(1):
+            self.assertEqual({"I": 5, "O": 1}, get_count_totals("test_counts", counts, "label_type", 1, 60, r=r))
+
+        self.assertTrue(0 < r.ttl("test_counts") <= 60)
+
+        # from then on only count rows inserted since are summed and applied to the cached totals
+        with self.assertNumQueries(1):
+            self.assertEqual({"I": 5, "O": 1}, get_count_totals("test_counts", counts, "label_type", 1, 60, r=r))
+
+        SystemLabelCount.objects.create(org=self.org, label_type="O", count=-1)
+        SystemLabelCount.objects.create(org=self.org, label_type="S", count=4)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                {"I": 5, "O": 0, "S": 4}, get_count_totals("test_counts", counts, "label_type", 1, 60, r=r)
+            )
+            self.assertEqual(
+                {"I": 5, "O": 0, "S": 4}, get_count_totals("test_counts", counts, "label_type", 1, 60, r=r)
+            )
+
+        # applying deltas doesn't extend the TTL of the cached totals
+        self.assertTrue(0 < r.ttl("test_counts") <= 60)
+
+        # cached totals aren't replaced if someone else replaced them since we read them
+        stale = r.get("test_counts")
+        SystemLabelCount.objects.create(org=self.org, label_type="S", count=1)
+
+        self.assertEqual({"I": 5, "O": 0, "S": 5}, get_count_totals("test_counts", counts, "label_type", 1, 60, r=r))
+        latest = r.get("test_counts")
+
+        with patch.object(r, "get", return_value=stale):
+            SystemLabelCount.objects.create(org=self.org, label_type="S", count=1)
+
+            self.assertEqual(
+                {"I": 5, "O": 0, "S": 6}, get_count_totals("test_counts", counts, "label_type", 1, 60, r=r)
+            )
+
+        self.assertEqual(latest, r.get("test_counts"))
+        self.assertEqual({"I": 5, "O": 0, "S": 6}, get_count_totals("test_counts", counts, "label_type", 1, 60, r=r))
+
+        # changes to existing rows aren't seen until the squash generation changes
+        SystemLabelCount.objects.filter(label_type="O", is_squashed=True).update(count=3)
+
+        self.assertEqual({"I": 5, "O": 0, "S": 6}, get_count_totals("test_counts", counts, "label_type", 1, 60, r=r))
+        self.assertEqual({"I": 5, "O": 2, "S": 6}, get_count_totals("test_counts", counts, "label_type", 2, 60, r=r))
+
+        # check system label counts are invalidated by squashing, but only for the orgs which were squashed
+        self.assertEqual(5, SystemLabelCount.get_totals(self.org)["I"])
+        self.assertEqual(7, SystemLabelCount.get_totals(self.org2)["I"])
+
+        SystemLabelCount.objects.create(org=self.org, label_type="I", count=1)
+        SystemLabelCount.squash()
+
+        self.assertEqual(1, SystemLabelCount.get_squash_generation(r, self.org.id))
+        self.assertEqual(0, SystemLabelCount.get_squash_generation(r, self.org2.id))
+        self.assertEqual(6, SystemLabelCount.get_totals(self.org)["I"])
+        self.assertEqual(7, SystemLabelCount.get_totals(self.org2)["I"])
+
+        # same for label counts, which are versioned by the org of their label
+        label = self.create_label("Spam")
+        LabelCount.objects.create(label=label, count=2)
+        self.assertEqual({label: 2}, LabelCount.get_totals([label]))
+
+        LabelCount.objects.create(label=label, count=1)
+        LabelCount.squash()
+
+        self.assertEqual(1, LabelCount.get_squash_generation(r, self.org.id))
+        self.assertEqual({label: 3}, LabelCount.get_totals([label]))
+
 
 class EmailTest(TembaTest):
     @override_settings(SEND_EMAILS=True)
@@ -723,6 +914,69 @@ class CeleryTest(TembaTest):
         self.assertEqual(task_calls, ["1-11-12", "2-21-22", "3-31-32"])
 
 
+class TrimTest(TembaTest):
+    def test_trim(self):
+        r = get_redis_connection()
+
+        def create_logs(num):
+            return [ChannelLog.objects.create(channel=self.channel, description=f"Log {i}") for i in range(num)]
+
+        logs = create_logs(7)
+        ChannelLog.objects.filter(id__in=[logs[1].id, logs[5].id]).update(is_error=True)
+        deleted = []
+
+        # trim in batches with a callback, leaving unmatched rows alone
+        self.assertEqual(
+            5, trim("test", ChannelLog.objects.filter(is_error=False), before_delete=deleted.append, batch_size=2)
+        )
+        self.assertEqual([[logs[0].id, logs[2].id], [logs[3].id, logs[4].id], [logs[6].id]], deleted)
+        self.assertEqual({logs[1], logs[5]}, set(ChannelLog.objects.all()))
+        self.assertIsNone(r.get("trim_cursor:test"))
+
+        # trimming when there's nothing to trim is a noop
+        self.assertEqual(0, trim("test", ChannelLog.objects.filter(is_error=False), batch_size=2))
+
+        ChannelLog.objects.all().delete()
+        logs = create_logs(5)
+
+        # if we run out of time, we save where we got to...
+        with patch("temba.utils.trim._out_of_time", return_value=True):
+            self.assertEqual(2, trim("test", ChannelLog.objects.all(), batch_size=2, time_budget=60))
+
+        self.assertEqual(str(logs[1].id).encode(), r.get("trim_cursor:test"))
+        self.assertEqual(3, ChannelLog.objects.count())
+
+        # ... and resume from there next time
+        with patch("temba.utils.trim._out_of_time", return_value=False):
+            self.assertEqual(3, trim("test", ChannelLog.objects.all(), batch_size=2, time_budget=60))
+
+        self.assertEqual(0, ChannelLog.objects.count())
+        self.assertIsNone(r.get("trim_cursor:test"))
+
+        # our test database isn't a replica
+        self.assertEqual(0.0, get_replica_lag())
+
+        logs = create_logs(5)
+
+        # if the replica is lagging, we pause between batches until it catches up
+        with patch("temba.utils.trim.get_replica_lag", side_effect=[30.0, 3.0, 0.0]):
+            with patch("time.sleep") as mock_sleep:
+                self.assertEqual(5, trim("test", ChannelLog.objects.all(), batch_size=2))
+
+                mock_sleep.assert_called_once_with(10)
+
+        ChannelLog.objects.all().delete()
+        logs = create_logs(5)
+
+        # unless we run out of time while waiting
+        with patch("temba.utils.trim.get_replica_lag", return_value=30.0):
+            with patch("temba.utils.trim._out_of_time", side_effect=[False, True]):
+                with patch("time.sleep"):
+                    self.assertEqual(2, trim("test", ChannelLog.objects.all(), batch_size=2, time_budget=60))
+
+        self.assertEqual(str(logs[1].id).encode(), r.get("trim_cursor:test"))
+
+
 class ExportTest(TembaTest):
     def setUp(self):
         super().setUp()
@@ -749,6 +1003,11 @@ class ExportTest(TembaTest):
 
         self.assertEqual(self.task.status, ExportContactsTask.STATUS_COMPLETE)
 
+        # check stats were recorded
+        self.task.refresh_from_db()
+        self.assertEqual(0, self.task.stats["rows"])  # group is empty
+        self.assertEqual({"rows", "rows_per_sec", "peak_memory_kb"}, set(self.task.stats.keys()))
+
         task2 = ExportContactsTask.objects.create(
             org=self.org, group=self.group, created_by=self.admin, modified_by=self.admin
         )
@@ -815,6 +1074,51 @@ class ExportTest(TembaTest):
 
         os.unlink(temp_file.name)
 
+    def test_tableexporter_csv(self):
+        asset_store = get_asset_store(model=ExportContactsTask)
+
+        # CSV files are written straight to storage
+        exporter = TableExporter(self.task, "test", ["Name", "Age", "Active"], format=TableExporter.FORMAT_CSV)
+        exporter.write_row(["Bob, Jr.", "23", True])
+        exporter.write_row(["Jim", "", False])
+
+        self.assertEqual((None, "csv"), exporter.save_file())
+
+        with default_storage.open(asset_store.derive_path(self.org, self.task.uuid, "csv"), "rb") as f:
+            self.assertEqual(b'Name,Age,Active\r\n"Bob, Jr.",23,True\r\nJim,,False\r\n', f.read())
+
+        # optionally compressed
+        exporter = TableExporter(self.task, "test", ["Name", "Age"], format=TableExporter.FORMAT_CSV_GZ)
+        exporter.write_row(["Bob", "23"])
+
+        self.assertEqual((None, "csv.gz"), exporter.save_file())
+
+        with default_storage.open(asset_store.derive_path(self.org, self.task.uuid, "csv.gz"), "rb") as f:
+            self.assertEqual(b"Name,Age\r\nBob,23\r\n", gzip.decompress(f.read()))
+
+        # if there are too many columns for Excel, we write CSV
+        columns = ["Name"] + [f"Column {i}" for i in range(16384)]
+        exporter = TableExporter(self.task, "test", columns)
+        self.assertEqual("csv", exporter.format)
+
+        exporter.write_row(["Bob, Jr."] + [""] * 16384)
+
+        self.assertEqual((None, "csv"), exporter.save_file())
+
+        with default_storage.open(asset_store.derive_path(self.org, self.task.uuid, "csv"), "rb") as f:
+            header, row = f.read().decode("utf-8").splitlines()
+
+        self.assertTrue(header.startswith("Name,Column 0,Column 1,"))
+        self.assertEqual('"Bob, Jr."' + "," * 16384, row)
+
+    def test_memory_sampler(self):
+        # memory is sampled when we start and stop, as well as periodically in between
+        with patch("temba.utils.export.MemorySampler._get_rss_kb", side_effect=[1000, 1500]):
+            with MemorySampler() as memory:
+                pass
+
+        self.assertEqual(500, memory.peak_growth_kb)
+
 
 class MiddlewareTest(TembaTest):
     def test_org(self):
@@ -983,6 +1287,38 @@ class NonBlockingLockTest(TestCase):
         self.assertRaises(Exception, raise_exception)
 
 
+class HyperLogLogTest(TestCase):
+    def test_sketch(self):
+        sketch = HyperLogLog()
+        self.assertEqual(0, sketch.count())
+
+        # small counts are exact, and adding values again doesn't change the count
+        for i in range(3):
+            sketch.add(i)
+            sketch.add(i)
+        self.assertEqual(3, sketch.count())
+
+        # larger counts are estimates
+        for i in range(10_000):
+            sketch.add(i)
+        self.assertAlmostEqual(10_000, sketch.count(), delta=500)
+
+        # merging gives the count of the union
+        other = HyperLogLog()
+        for i in range(5_000, 20_000):
+            other.add(i)
+        sketch.merge(other)
+        self.assertAlmostEqual(20_000, sketch.count(), delta=1_000)
+
+        # round trip through bytes
+        restored = HyperLogLog.from_bytes(sketch.to_bytes())
+        self.assertEqual(sketch.precision, restored.precision)
+        self.assertEqual(sketch.count(), restored.count())
+
+        with self.assertRaises(AssertionError):
+            sketch.merge(HyperLogLog(precision=10))
+
+
 class JSONTest(TestCase):
     def test_json(self):
         self.assertEqual(OrderedDict({"one": 1, "two": Decimal("0.2")}), json.loads('{"one": 1, "two": 0.2}'))
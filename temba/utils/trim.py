@@ -0,0 +1,101 @@
+import logging
+import time
+
+from django_redis import get_redis_connection
+
+from django.conf import settings
+from django.db import connections
+
+from temba.utils import analytics
+
+logger = logging.getLogger(__name__)
+
+CURSOR_KEY = "trim_cursor:%s"
+CURSOR_TTL = 7 * 24 * 60 * 60
+
+REPLICA_LAG_SQL = """
+SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+ELSE EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()) END
+"""
+
+
+def trim(name: str, queryset, *, before_delete=None, batch_size: int = None, time_budget: int = None) -> int:
+    """
+    Deletes the rows matched by the given queryset in batches, in ascending id order. If the time budget (in seconds)
+    runs out, the last id reached is saved so that the next call with the same name resumes from there. That cursor
+    is cleared once the end is reached so that rows behind it which became trimmable since, are found on the next pass.
+    Between batches, trimming pauses while the readonly replica is lagging. Returns the number of rows deleted.
+    """
+    batch_size = batch_size or settings.TRIM_BATCH_SIZE
+    time_budget = settings.TRIM_TIME_BUDGET if time_budget is None else time_budget
+
+    r = get_redis_connection()
+    cursor_key = CURSOR_KEY % name
+    last_id = int(r.get(cursor_key) or 0)
+    start = time.monotonic()
+    num_deleted = 0
+
+    if last_id:
+        logger.info(f"Resuming trimming of {name} from id {last_id}")
+
+    while True:
+        ids = list(queryset.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:batch_size])
+        if ids:
+            if before_delete:
+                before_delete(ids)
+
+            queryset.model.objects.filter(id__in=ids).delete()
+            num_deleted += len(ids)
+            last_id = ids[-1]
+
+        if len(ids) < batch_size:
+            r.delete(cursor_key)
+            break
+
+        if _out_of_time(start, time_budget) or not _wait_for_replica(start, time_budget):
+            r.set(cursor_key, last_id, ex=CURSOR_TTL)
+            logger.info(f"Stopped trimming of {name} at id {last_id} after exceeding time budget")
+            break
+
+    time_taken = time.monotonic() - start
+    rate = num_deleted / time_taken if time_taken else 0
+
+    logger.info(f"Trimmed {num_deleted} {name} rows in {time_taken:.3f}s ({rate:.0f} rows/s)")
+
+    analytics.gauge(f"temba.trim_{name}_rows", num_deleted)
+    analytics.gauge(f"temba.trim_{name}_rate", rate)
+
+    return num_deleted
+
+
+def get_replica_lag() -> float:
+    """
+    Gets how many seconds the readonly database is behind in replaying changes, which is zero if it isn't a replica
+    """
+    with connections["readonly"].cursor() as cursor:
+        cursor.execute(REPLICA_LAG_SQL)
+        lag = cursor.fetchone()[0]
+
+    return float(lag) if lag is not None else 0.0
+
+
+def _out_of_time(start: float, time_budget: int) -> bool:
+    return bool(time_budget) and time.monotonic() - start > time_budget
+
+
+def _wait_for_replica(start: float, time_budget: int) -> bool:
+    """
+    Waits until the replica lag is acceptable, returning false if the time budget ran out first
+    """
+    lag = get_replica_lag()
+
+    while lag > settings.TRIM_MAX_REPLICA_LAG:
+        logger.debug(f"Pausing trimming while replica lag is {lag:.1f}s")
+        time.sleep(min(lag, settings.TRIM_MAX_REPLICA_LAG))
+
+        if _out_of_time(start, time_budget):
+            return False
+
+        lag = get_replica_lag()
+
+    return True